@@ -0,0 +1,292 @@
+# noqa: INP001
+"""Static analysis of an image: control flow, code and data, and the words it can write.
+
+`analyze` follows control flow from the entry through the operands as they are
+in the image and finds every store an instruction makes through a fixed `b`
+operand. Where an operand word is itself written the image can't say where
+it points: a written `b` stores through a patched pointer (as in
+`write_deref!`, the instruction's `indirect` writes can reach any address),
+and a written `c` is a computed jump (as the return slot of
+`subroutine_boilerplate!`). A computed jump is followed to the target in the
+image and to the address literals laid out as return addresses (see
+`_return_sites`), so the code after a `call_subroutine!` is reached. Each
+pass assumes the stores of the one before until they agree.
+
+What the engines may rely on: an instruction in `fixed` never changes while
+the program runs, unless an indirect store or code entered only through a
+computed jump to somewhere else writes to it. Stores through fixed operands
+only ever go to `written` words, so an engine that specialises fixed code
+only has to check the other stores::
+
+    analyze -b prog.sqi
+"""
+
+import argparse
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+from . import const
+from .image import load_image
+from .memory import allocate
+from .trace import Names
+
+MAX_PASSES = 16
+
+PORTS = frozenset((const.IO_ADDR, const.INSPECT_ADDR))  # stores here go to a device, not memory
+
+
+@dataclass(frozen=True)
+class Block:
+    """The instructions at `start`, `start + 3`, ... before `end`, entered at `start` only.
+
+    `successors` are the static targets of the last instruction (its branch
+    target and the fall-through), `computed` whether it can also jump to a
+    patched target and `modified` whether any of its words can be written.
+    """
+
+    start: int
+    end: int
+    successors: tuple[int, ...]
+    computed: bool = False
+    modified: bool = False
+
+    @property
+    def pcs(self) -> range:
+        return range(self.start, self.end, 3)
+
+
+@dataclass
+class Analysis:
+    """What `analyze` found out about an image."""
+
+    size: int
+    entry: int
+    reached: np.ndarray  # per address: an instruction starting here is reachable
+    written: np.ndarray  # per address: a store through a fixed operand can write it
+    indirect: np.ndarray  # pcs storing through a written `b`
+    computed: np.ndarray  # pcs jumping through a written `c`
+    blocks: list[Block]
+
+    @property
+    def code(self) -> np.ndarray:
+        """Per address: a word of a reachable instruction."""
+        code = np.zeros(self.size + 2, dtype=bool)
+        pcs = np.nonzero(self.reached)[0]
+        for k in range(3):
+            code[pcs + k] = True
+        return code[: self.size]
+
+    @property
+    def data(self) -> np.ndarray:
+        """Per address: not a word of any reachable instruction."""
+        return ~self.code
+
+    @property
+    def fixed(self) -> np.ndarray:
+        """Per address: a reachable instruction none of whose words a fixed store can change."""
+        w = np.zeros(self.size + 2, dtype=bool)
+        w[: self.size] = self.written
+        fixed = self.reached.copy()
+        fixed[: self.size - 2] &= ~(w[: self.size - 2] | w[1 : self.size - 1] | w[2 : self.size])
+        return fixed
+
+    @property
+    def self_modified(self) -> np.ndarray:
+        """Words of reachable instructions that the program writes."""
+        return self.code & self.written
+
+    def may_write(self, addr: int) -> bool:
+        """Whether any store can reach `addr`, indirect ones included."""
+        return bool(self.written[addr] or len(self.indirect))
+
+
+def analyze(words: np.ndarray, entry: int = 0, ports: frozenset[int] = PORTS) -> Analysis:
+    """Analyse `words` (padded to the full address space) as run from `entry`.
+
+    Stores to `ports` go to devices (see `bus.Bus.stores`) and write nothing.
+    """
+    mem = allocate(np.asarray(words)).tolist()
+    size = len(mem)
+    written, reached = _fixpoint(mem, entry, ports)
+
+    flags = np.zeros(size, dtype=bool)
+    flags[list(reached)] = True
+    stores = np.zeros(size, dtype=bool)
+    stores[list(written)] = True
+    # the entry instruction runs once with the image as it is, see `_pass`
+    others = sorted(reached - {entry})
+    indirect = [pc for pc in others if pc + 1 in written and mem[pc + 1] not in ports]
+    computed = [pc for pc in others if pc + 2 in written]
+    return Analysis(
+        size=size,
+        entry=entry,
+        reached=flags,
+        written=stores,
+        indirect=np.array(indirect, dtype=np.int64),
+        computed=np.array(computed, dtype=np.int64),
+        blocks=_blocks(mem, entry, reached, written, ports),
+    )
+
+
+def _fixpoint(mem: list[int], entry: int, ports: frozenset[int]) -> tuple[set[int], set[int]]:
+    """Repeat `_pass` on the stores of the pass before until they stop changing."""
+    written: set[int] = set()
+    seen: list[set[int]] = []
+    for _ in range(MAX_PASSES):
+        found, reached = _pass(mem, entry, written, ports)
+        if found == written:
+            return written, reached
+        if found in seen:
+            break  # alternating between assumptions
+        seen.append(found)
+        written = found
+    # settle on all of them, and whatever more they lead to
+    written = set().union(*seen)
+    while True:
+        found, reached = _pass(mem, entry, written, ports)
+        if found <= written:
+            return written, reached
+        written |= found
+
+
+def _successors(mem: list[int], pc: int, assumed: set[int], ports: frozenset[int]) -> tuple[list[int], bool]:
+    """Static successors of the instruction at `pc` when the words in `assumed` can change.
+
+    Also whether it can fall through: `x x c` always branches, unless `x` is
+    patched or a device.
+    """
+    a, b, c = mem[pc], mem[pc + 1], mem[pc + 2]
+    successors = []
+    if c != const.HALT_ADDR:  # a patched `c` still holds this until first written
+        successors.append(c)
+    falls = a != b or b in ports or bool(assumed.intersection((pc, pc + 1)))
+    if falls:
+        successors.append(pc + 3)
+    return successors, falls
+
+
+def _pass(mem: list[int], entry: int, written: set[int], ports: frozenset[int]) -> tuple[set[int], set[int]]:
+    """One pass assuming `written`: the words stored through fixed operands, and the reached pcs.
+
+    The entry instruction is the first to run, before anything is written, so
+    it is read as it is in the image once; later visits assume `written`.
+    """
+    size = len(mem)
+    found = set()
+    reached = set()
+
+    def visit(pc: int, assumed: set[int]) -> list[int]:
+        b = mem[pc + 1]
+        if pc + 1 not in assumed and b not in ports:
+            found.add(b)
+        return _successors(mem, pc, assumed, ports)[0]
+
+    if entry + 2 >= size:
+        return found, reached
+    work = visit(entry, set())
+    while work:
+        while work:
+            pc = work.pop()
+            if pc + 2 >= size or pc in reached:
+                continue
+            reached.add(pc)
+            work.extend(visit(pc, written))
+        sites = _return_sites(mem, reached | {entry}, written, ports)
+        work = [pc for pc in sites if pc not in reached and pc + 2 < size]
+    return found, reached | {entry}
+
+
+def _return_sites(mem: list[int], reached: set[int], written: set[int], ports: frozenset[int]) -> set[int]:
+    """Where the computed jumps in `reached` may go: address literals that follow the data they are read from.
+
+    A computed jump's target is a value stored into its `c` word, which the
+    pass cannot follow. The addresses it can be are taken from the words the
+    reached instructions read: an address held there is a target when the
+    word before it is such a data word too, as a return address is laid out
+    (the word holding it just before the code it returns to).
+    """
+    if not any(pc + 2 in written for pc in reached):
+        return set()
+    operands = {mem[pc] for pc in reached} | {mem[pc + 1] for pc in reached}
+    operands -= ports
+    code = {pc + k for pc in reached for k in range(3)}
+    values = {mem[addr] for addr in operands}
+    return {v for v in values if v - 1 in operands and v not in operands and v not in code and v != const.HALT_ADDR}
+
+
+def _blocks(
+    mem: list[int],
+    entry: int,
+    reached: set[int],
+    written: set[int],
+    ports: frozenset[int],
+) -> list[Block]:
+    """Split the reached instructions into basic blocks."""
+    leaders = {entry}
+    ends = set()
+    for pc in reached:
+        successors, _ = _successors(mem, pc, written, ports)
+        if pc + 2 in written or successors != [pc + 3] and successors != [pc + 3, pc + 3]:
+            ends.add(pc)
+            leaders.update(successors)
+    leaders &= reached
+    # a run also starts wherever the previous word is not a reached instruction
+    leaders.update(pc for pc in reached if pc - 3 not in reached)
+
+    blocks = []
+    for start in sorted(leaders):
+        pc = start
+        while pc not in ends and pc + 3 in reached and pc + 3 not in leaders:
+            pc += 3
+        successors, _ = _successors(mem, pc, written, ports)
+        words = range(start, pc + 3)
+        blocks.append(
+            Block(
+                start=start,
+                end=pc + 3,
+                successors=tuple(sorted(set(successors))),
+                computed=pc + 2 in written,
+                modified=any(w in written for w in words),
+            ),
+        )
+    return blocks
+
+
+def main() -> None:
+    """Entrypoint."""
+    parser = argparse.ArgumentParser(description="Static analysis of a subleq image")
+    parser.add_argument("input", type=Path, help="Input image file (.sqi or .npy)")
+    parser.add_argument("-b", "--blocks", action="store_true", help="List the basic blocks")
+    args = parser.parse_args()
+
+    image = load_image(args.input)
+    analysis = analyze(image.words, image.entry)
+    name = Names(image.labels)
+    code = analysis.code
+    print(
+        f"{args.input}: {int(analysis.reached.sum())} reachable instructions in {len(analysis.blocks)} blocks, "
+        f"{int(code.sum())} code words, {int(analysis.written.sum())} words written "
+        f"({int(analysis.self_modified.sum())} of them code)",
+    )
+    for title, addrs in (
+        ("self-modified code words", np.nonzero(analysis.self_modified)[0]),
+        ("stores through a patched operand (can write anywhere)", analysis.indirect),
+        ("jumps through a patched target", analysis.computed),
+    ):
+        print(f"{title}: {len(addrs)}")
+        for addr in addrs.tolist():
+            print(f"  {addr:5d}  {name(addr)}")
+    if args.blocks:
+        print("blocks:")
+        for block in analysis.blocks:
+            flags = "".join(("C" if block.computed else "-", "M" if block.modified else "-"))
+            targets = ", ".join(name(s) for s in block.successors)
+            if block.computed:
+                targets = f"{targets}, ?" if targets else "?"
+            print(f"  {flags} {name(block.start)} ({len(block.pcs)}) -> {targets}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+# noqa: INP001
+"""Lock-step vectorised engine running one image on many inputs at once."""
+
+import argparse
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+from . import const
+from .devices import ENCODINGS, OutputDevice
+from .fast import SIGN_BIT, WORD_MASK
+from .image import load_image
+from .memory import allocate, verify
+
+
+@dataclass
+class BatchResult:
+    """Final state of every instance of a batch run."""
+
+    memory: np.ndarray
+    counts: np.ndarray
+    halted: np.ndarray
+    outputs: list[bytes]
+    pc: np.ndarray
+
+
+MAX_GROUPS = 4  # distinct pcs stepped group by group; more are stepped row by row
+
+
+def subleq_batch(
+    data: np.ndarray,
+    inputs: np.ndarray | list,
+    max_steps: int | None = None,
+    entry: int = 0,
+    encoding: str = "byte",
+) -> BatchResult:
+    """Run `data` from `entry` once per row of `inputs`, all instances stepping together.
+
+    Each step groups the active instances by pc. While they are at a few
+    distinct pcs, each group runs as one operation: an instruction no instance
+    has written to is read once from the image, and its operands are one
+    column of the memory of all instances in the group. Instances spread over
+    more pcs step together with fancy indexing on their own pcs. Output words
+    go through an `OutputDevice` with `encoding` per instance, `INSPECT` lines
+    into the same buffer.
+
+    Each instance starts with memory the size of the image. If `memory.verify`
+    cannot show that the image stays inside it, every step checks the
+    addresses it is about to touch and the memory of all instances grows to
+    the full address space the first time one falls outside.
+
+    `inputs` holds one queue of input words per instance, either as a 2-D
+    array or as a list of sequences of different lengths. An instance that
+    reads past the end of its queue halts without counting the read.
+    """
+    batch = _Batch(np.asarray(data, dtype=np.uint16), inputs, entry, encoding)
+    rows = np.arange(len(batch.pc))
+    steps = 0
+    while len(rows) and (max_steps is None or steps < max_steps):
+        steps += 1
+        rows = batch.step_all(rows)
+    return batch.result()
+
+
+class _Batch:
+    """The state of every instance, and one lock step over a set of them."""
+
+    def __init__(self, data: np.ndarray, inputs: np.ndarray | list, entry: int, encoding: str) -> None:
+        self.queues, self.lengths = _pad_inputs(inputs)
+        n = len(self.queues)
+        self.code = allocate(data).tolist()  # the image, for instructions no instance wrote
+        self.dirty = np.zeros(WORD_MASK + 1, dtype=bool)  # words some instance may have written
+        self.memory = np.tile(data, (n, 1))
+        self.checked = not verify(data, len(data), entry).ok
+        self.pc = np.full(n, entry, dtype=np.int64)
+        self.counts = np.zeros(n, dtype=np.int64)
+        self.consumed = np.zeros(n, dtype=np.int64)
+        self.halted = np.zeros(n, dtype=bool)
+        self.wait = 0  # steps until the pcs are counted again
+        self.buffers = [bytearray() for _ in range(n)]
+        self.outs = [
+            OutputDevice(buffer, encoding, line_buffered=False, flush_on_input=False) for buffer in self.buffers
+        ]
+
+    def result(self) -> BatchResult:
+        for out in self.outs:
+            out.flush()
+        return BatchResult(self.memory, self.counts, self.halted, [bytes(b) for b in self.buffers], self.pc)
+
+    def _fits(self, *addrs: int) -> None:
+        """Grow the memory if it is image-sized and unverified and an address falls outside."""
+        if self.checked and max(addrs) >= self.memory.shape[1]:
+            self.memory, self.checked = _grow(self.memory), False
+
+    def step_all(self, rows: np.ndarray) -> np.ndarray:
+        """One instruction for every instance in `rows`; returns the ones still running."""
+        p = self.pc[rows]
+        first = int(p[0])
+        if (p == first).all():
+            return self.step_group(rows, first)
+        self.wait -= 1
+        if self.wait <= 0:
+            pcs = np.unique(p)
+            if len(pcs) <= MAX_GROUPS:
+                return np.concatenate([self.step_group(rows[p == pc], pc) for pc in pcs.tolist()])
+            self.wait = len(pcs)  # spread out: look again later
+        self._fits(int(p.max()) + 2)
+        memory = self.memory
+        a = memory[rows, p].astype(np.int64)
+        b = memory[rows, (p + 1) & WORD_MASK].astype(np.int64)
+        c = memory[rows, (p + 2) & WORD_MASK].astype(np.int64)
+        return self.step_rows(rows, p, a, b, c)
+
+    def step_group(self, rows: np.ndarray, pc: int) -> np.ndarray:
+        """Step `rows`, all at `pc`: one operation on a column when no instance wrote the instruction."""
+        words = [pc, (pc + 1) & WORD_MASK, (pc + 2) & WORD_MASK]
+        self._fits(pc + 2)
+        if self.dirty[words].any():
+            a, b, c = (self.memory[rows, w].astype(np.int64) for w in words)
+            return self.step_rows(rows, pc, a, b, c)
+        a, b, c = (self.code[w] for w in words)
+        self._fits(a, b)
+        self.counts[rows] += 1
+        if a == const.IO_ADDR:
+            ok, da = self._read(rows)
+            rows, da = rows[ok], da[ok]
+        else:
+            da = self.memory[rows, a].astype(np.int64)
+        db = self.memory[rows, b].astype(np.int64)
+        if b == const.IO_ADDR or b == const.INSPECT_ADDR:
+            for row, v in zip(rows.tolist(), da.tolist(), strict=True):
+                self._output(row, b, v)
+        else:
+            db = (db - da) & WORD_MASK
+            self.memory[rows, b] = db
+            self.dirty[b] = True
+        return self._branch(rows, db, c, (pc + 3) & WORD_MASK)
+
+    def step_rows(
+        self,
+        rows: np.ndarray,
+        p: np.ndarray | int,
+        a: np.ndarray,
+        b: np.ndarray,
+        c: np.ndarray,
+    ) -> np.ndarray:
+        """Step `rows` at pcs `p` on their own operands `a`, `b` and `c`."""
+        self._fits(int(a.max()), int(b.max()))
+        memory = self.memory
+        da = memory[rows, a].astype(np.int64)
+        db = memory[rows, b].astype(np.int64)
+        self.counts[rows] += 1
+
+        reads = a == const.IO_ADDR
+        if reads.any():
+            ok, da[reads] = self._read(rows[reads])
+            if not ok.all():
+                keep = np.ones(len(rows), dtype=bool)
+                keep[np.nonzero(reads)[0][~ok]] = False
+                rows, p, a, b, c, da, db = (x[keep] if np.ndim(x) else x for x in (rows, p, a, b, c, da, db))
+
+        devices = (b == const.IO_ADDR) | (b == const.INSPECT_ADDR)
+        for i in np.nonzero(devices)[0].tolist():
+            self._output(int(rows[i]), int(b[i]), int(da[i]))
+
+        stores = ~devices
+        db[stores] = (db[stores] - da[stores]) & WORD_MASK
+        memory[rows[stores], b[stores]] = db[stores]
+        self.dirty[b[stores]] = True
+        return self._branch(rows, db, c, (p + 3) & WORD_MASK)
+
+    def _read(self, readers: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Take the next input word of each of `readers`, negated; halt the ones out of input.
+
+        Returns which readers got a word, and the words.
+        """
+        pos = self.consumed[readers]
+        ok = pos < self.lengths[readers]
+        value = self.queues[readers, np.minimum(pos, self.queues.shape[1] - 1)]
+        self.consumed[readers] += 1
+        if not ok.all():
+            # out of input: halt the reader before its read executes
+            starved = readers[~ok]
+            self.counts[starved] -= 1
+            self.halted[starved] = True
+        return ok, -value & WORD_MASK
+
+    def _output(self, row: int, b: int, value: int) -> None:
+        """Instance `row` subtracted `value` from the device word `b`."""
+        out = self.outs[row]
+        if b == const.IO_ADDR:
+            out.write(value, int(self.counts[row]))
+        else:
+            out.flush()
+            self.buffers[row] += f" < {value:5d}, {value:6x}, {value:16b}\n".encode()
+
+    def _branch(
+        self,
+        rows: np.ndarray,
+        db: np.ndarray,
+        c: np.ndarray | int,
+        following: np.ndarray | int,
+    ) -> np.ndarray:
+        """Move `rows` to `c` where `db` is not positive and on to `following` elsewhere."""
+        taken = (db == 0) | (db & SIGN_BIT != 0)
+        stop = taken & (c == const.HALT_ADDR)
+        self.pc[rows] = np.where(taken, c, following)
+        self.halted[rows[stop]] = True
+        return rows[~stop]
+
+
+def _grow(memory: np.ndarray) -> np.ndarray:
+    """Extend every instance's memory to the full address space."""
+    return np.pad(memory, ((0, 0), (0, WORD_MASK + 1 - memory.shape[1])))
+
+
+def _pad_inputs(inputs: np.ndarray | list) -> tuple[np.ndarray, np.ndarray]:
+    """Turn per-instance input queues into a padded 2-D array and their lengths."""
+    if isinstance(inputs, np.ndarray) and inputs.ndim == 2:  # noqa: PLR2004
+        queues = inputs.astype(np.int64)
+        return queues, np.full(len(queues), queues.shape[1], dtype=np.int64)
+    lengths = np.array([len(q) for q in inputs], dtype=np.int64)
+    queues = np.zeros((len(inputs), max(1, lengths.max(initial=0))), dtype=np.int64)
+    for i, q in enumerate(inputs):
+        queues[i, : len(q)] = q
+    return queues, lengths
+
+
+def main() -> None:
+    """Entrypoint."""
+    parser = argparse.ArgumentParser(description="Subleq batch runner")
+    parser.add_argument("input", type=Path, help="Input image file (.sqi or .npy)")
+    parser.add_argument(
+        "inputs",
+        type=Path,
+        help="Input words, one line of whitespace separated integers per instance",
+    )
+    parser.add_argument("-o", "--output", type=Path, help="Save results to this .npz")
+    parser.add_argument("--max-steps", type=int, help="Stop after this many steps")
+    parser.add_argument(
+        "--output-encoding",
+        choices=ENCODINGS,
+        default="byte",
+        help="How output words become bytes (byte: values above 255 are an error)",
+    )
+    args = parser.parse_args()
+
+    image = load_image(args.input)
+    inputs = [[int(x, 0) for x in line.split()] for line in args.inputs.read_text().splitlines()]
+
+    t = time.time()
+    result = subleq_batch(image.words, inputs, args.max_steps, image.entry, args.output_encoding)
+    print(
+        f"{args.input}: {int(result.halted.sum())}/{len(inputs)} instances halted in "
+        f"{int(result.counts.sum())} instructions, {time.time() - t:.3f} seconds",
+    )
+    if args.output:
+        np.savez(
+            args.output,
+            memory=result.memory,
+            counts=result.counts,
+            halted=result.halted,
+            output_data=np.frombuffer(b"".join(result.outputs), dtype=np.uint8),
+            output_offsets=np.cumsum([0] + [len(o) for o in result.outputs]),
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+# noqa: INP001
+"""Memory-mapped devices: a `Bus` maps address ranges to `Device`s.
+
+A device word is not memory to the instructions naming it. As `b`, the value
+the instruction subtracts goes to the device's `store` and memory is left
+alone (the branch still tests the memory word, as for `IO_ADDR`). As `a`, the
+word subtracted comes from the device's `load` if the device overrides it, and
+from memory otherwise. Devices hand values to the program negated, as
+`IO_ADDR` does, so `dev x` adds them to `x`; a `load` raising `EOFError` halts
+the machine before the instruction.
+
+`default_bus` maps the stdio `Port` at `IO_ADDR` and the `Inspect` printer at
+`INSPECT_ADDR`. `DEVICES` are the others `run --device KIND@ADDR[=ARG]` maps;
+a new device is a `Device` subclass, nothing in an engine changes. Which
+addresses load and store through the bus is known before the image runs, so
+the translated and JIT engines dispatch only from the instructions that name
+them. They are the only engines taking a bus; the reference, fast and fused
+loops have `IO_ADDR` and `INSPECT_ADDR` only.
+"""
+
+import re
+import time
+from collections.abc import Callable
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+
+from . import const
+from .debugger import resolve
+from .devices import InputDevice, OutputDevice
+from .fast import WORD_MASK
+
+DEFAULT_BLOCK_WORDS = 256
+DEFAULT_BLOCKS = 256
+
+
+class Device:
+    """`size` words of registers. Loads read memory and stores are dropped unless overridden."""
+
+    size = 1
+
+    def attach(self, bus: "Bus", base: int) -> None:
+        """Called when an engine starts on `bus.mem`, with the device mapped at `base`."""
+        self.bus = bus
+        self.base = base
+
+    def load(self, offset: int, count: int) -> int:  # noqa: ARG002
+        """The word instruction number `count` subtracts when it reads register `offset`."""
+        return self.bus.mem[self.base + offset]
+
+    def store(self, offset: int, value: int, count: int) -> None:
+        """Instruction number `count` subtracted `value` from register `offset`."""
+
+    def flush(self) -> None:
+        """Called when the run ends."""
+
+
+class Port(Device):
+    """The engine's input and output: reads the next input word, writes one output word."""
+
+    def attach(self, bus: "Bus", base: int) -> None:
+        super().attach(bus, base)
+        self._read = bus.inp.read
+        self._write = bus.out.write
+
+    def load(self, offset: int, count: int) -> int:  # noqa: ARG002
+        return -self._read(count) & WORD_MASK
+
+    def store(self, offset: int, value: int, count: int) -> None:  # noqa: ARG002
+        self._write(value, count)
+
+
+class Inspect(Device):
+    """Prints every value stored to it; reads see memory."""
+
+    def store(self, offset: int, value: int, count: int) -> None:  # noqa: ARG002
+        self.bus.out.flush()
+        print(f" < {value:5d}, {value:6x}, {value:16b}")
+
+
+class Timer(Device):
+    """Register 0: the number of the reading instruction; register 1: milliseconds since the start.
+
+    Both modulo 2**16.
+    """
+
+    size = 2
+
+    def attach(self, bus: "Bus", base: int) -> None:
+        super().attach(bus, base)
+        self.start = time.monotonic()
+
+    def load(self, offset: int, count: int) -> int:
+        ticks = count if offset == 0 else int((time.monotonic() - self.start) * 1000)
+        return -ticks & WORD_MASK
+
+
+class BlockStorage(Device):
+    """Word-addressed storage in blocks, kept in a file (or in memory without one).
+
+    Storing to register 0 selects a block and to register 1 a word in it;
+    register 2 reads or writes that word and moves on to the next. The file is
+    opened when the machine starts; a new one holds `blocks` blocks of
+    `block_words` words, an existing one must hold at least one word.
+    """
+
+    size = 3
+
+    def __init__(
+        self,
+        path: Path | None = None,
+        block_words: int = DEFAULT_BLOCK_WORDS,
+        blocks: int = DEFAULT_BLOCKS,
+    ) -> None:
+        if path is not None and path.exists() and path.stat().st_size < 2:  # noqa: PLR2004
+            msg = f"{path} holds no words to store blocks in"
+            raise ValueError(msg)
+        self.path = path
+        self.block_words = block_words
+        self.blocks = blocks
+        self.block = 0
+        self.offset = 0
+
+    def attach(self, bus: "Bus", base: int) -> None:
+        super().attach(bus, base)
+        shape = (self.block_words * self.blocks,)
+        if self.path is None:
+            self.words = np.zeros(shape, dtype="<u2")
+        elif self.path.exists():
+            self.words = np.memmap(self.path, dtype="<u2", mode="r+")
+        else:
+            self.words = np.memmap(self.path, dtype="<u2", mode="w+", shape=shape)
+
+    def _next(self) -> int:
+        pos = (self.block * self.block_words + self.offset) % len(self.words)
+        self.offset += 1
+        return pos
+
+    def load(self, offset: int, count: int) -> int:
+        if offset != 2:  # noqa: PLR2004
+            return super().load(offset, count)
+        return -int(self.words[self._next()]) & WORD_MASK
+
+    def store(self, offset: int, value: int, count: int) -> None:  # noqa: ARG002
+        if offset == 0:
+            self.block, self.offset = value, 0
+        elif offset == 1:
+            self.offset = value
+        else:
+            self.words[self._next()] = value
+
+    def flush(self) -> None:
+        if isinstance(self.words, np.memmap):
+            self.words.flush()
+
+
+class BulkOutput(Device):
+    """Writes a run of memory words in one instruction.
+
+    Storing to register 0 sets the start address; storing `n` to register 1
+    writes the `n` words from there to the output and moves the start past them.
+    """
+
+    size = 2
+
+    def __init__(self) -> None:
+        self.start = 0
+
+    def store(self, offset: int, value: int, count: int) -> None:
+        if offset == 0:
+            self.start = value
+            return
+        write = self.bus.out.write
+        for word in self.bus.mem[self.start : self.start + value]:
+            write(word, count)
+        self.start = (self.start + value) & WORD_MASK
+
+
+def _storage(arg: str | None) -> BlockStorage:
+    return BlockStorage(Path(arg) if arg else None)
+
+
+DEVICES: dict[str, Callable[[str | None], Device]] = {
+    "timer": lambda arg: Timer(),  # noqa: ARG005
+    "storage": _storage,  # ARG: the file, created if missing
+    "bulk": lambda arg: BulkOutput(),  # noqa: ARG005
+}
+
+
+class Bus:
+    """The devices of one machine and the words each serves.
+
+    `loads` and `stores` map every address that goes to a device instead of
+    memory to a `(count) -> word` or `(value, count)` callable.
+    """
+
+    def __init__(self) -> None:
+        self.devices: list[tuple[int, Device]] = []
+        self.loads: dict[int, Callable[[int], int]] = {}
+        self.stores: dict[int, Callable[[int, int], None]] = {}
+        self.mem: list[int] = []
+        self.out: OutputDevice | None = None
+        self.inp: InputDevice | None = None
+
+    def map(self, base: int, device: Device) -> None:
+        """Map `device` at `base` .. `base + device.size - 1`."""
+        words = range(base, base + device.size)
+        if base <= const.HALT_ADDR or words.stop > WORD_MASK + 1:
+            msg = f"{type(device).__name__} does not fit at {base}"
+            raise ValueError(msg)
+        for addr in words:
+            if addr in self.stores:
+                msg = f"{type(device).__name__} at {base} overlaps another device at {addr}"
+                raise ValueError(msg)
+        overrides_load = type(device).load is not Device.load
+        for offset, addr in enumerate(words):
+            if overrides_load:
+                self.loads[addr] = partial(device.load, offset)
+            self.stores[addr] = partial(device.store, offset)
+        self.devices.append((base, device))
+
+    @property
+    def layout(self) -> tuple[tuple[int, ...], tuple[int, ...]]:
+        """The addresses loading and storing through the bus: all an engine specialises on."""
+        return tuple(sorted(self.loads)), tuple(sorted(self.stores))
+
+    def attach(self, mem: list[int], out: OutputDevice, inp: InputDevice) -> None:
+        """Connect the devices to the machine an engine is about to run."""
+        self.mem, self.out, self.inp = mem, out, inp
+        for base, device in self.devices:
+            device.attach(self, base)
+
+    def flush(self) -> None:
+        for _, device in self.devices:
+            device.flush()
+
+
+def default_bus() -> Bus:
+    """The devices every engine has: `Port` at `IO_ADDR` and `Inspect` at `INSPECT_ADDR`."""
+    bus = Bus()
+    bus.map(const.IO_ADDR, Port())
+    bus.map(const.INSPECT_ADDR, Inspect())
+    return bus
+
+
+def parse_device(spec: str, labels: dict[str, int]) -> tuple[int, Device]:
+    """`KIND@ADDR[=ARG]` (ADDR as for `debugger.resolve`) as a base address and a new device."""
+    m = re.fullmatch(r"(\w+)@([^=]+)(?:=(.*))?", spec)
+    if m is None:
+        msg = f"bad device {spec!r}, expected KIND@ADDR[=ARG]"
+        raise ValueError(msg)
+    kind, addr, arg = m.groups()
+    if kind not in DEVICES:
+        msg = f"unknown device {kind!r}, expected one of {', '.join(DEVICES)}"
+        raise ValueError(msg)
+    return resolve(addr, labels), DEVICES[kind](arg)
+
+
+def build_bus(specs: list[str], labels: dict[str, int]) -> Bus:
+    """`default_bus` with the devices of `specs` mapped too."""
+    bus = default_bus()
+    for spec in specs:
+        bus.map(*parse_device(spec, labels))
+    return bus
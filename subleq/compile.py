@@ -11,8 +11,9 @@ from pathlib import Path
 import numpy as np
 from rich import print  # noqa: A004
 
-from .subleq import Lark_StandAlone, Transformer
-from . import const
+from .subleq import Lark_StandAlone, Transformer, v_args
+from . import const, image
+from .sourcemap import TOP, Frame, SourceMap
 
 DEBUG = True
 
@@ -37,6 +38,29 @@ class _Label:
 class _Next: ...
 
 
+@dataclass
+class _Line:
+    """Zero-width marker: the following words come from this source line."""
+
+    line: int
+
+
+@dataclass
+class _Enter:
+    """Zero-width marker: the following words are an expansion of this macro call."""
+
+    macro: str
+    line: int
+
+
+@dataclass
+class _Exit:
+    """Zero-width marker: end of the innermost macro expansion."""
+
+
+_MARKERS = (_Line, _Enter, _Exit)
+
+
 @dataclass
 class _Macro:
     ident: str
@@ -78,7 +102,7 @@ class _Macro:
             for instr in instructions
         ]
         for instr in instructions:
-            if not isinstance(instr, (str, _Next, int, _Label)):
+            if not isinstance(instr, (str, _Next, int, _Label, *_MARKERS)):
                 msg = f"Unsupported instruction token: {instr!r}"
                 raise TypeError(msg)
 
@@ -116,28 +140,33 @@ class _SubleqTransformer(Transformer):
         self.macros[ident] = m
         return []
 
-    def macro_call(self, items) -> list[str | _Next | _Label]:  # noqa: ANN001
+    @v_args(meta=True)
+    def macro_call(self, meta, items) -> list[str | _Next | _Label]:  # noqa: ANN001
         ident, args = items
-        return self.macros[ident].expand(args)
+        return [_Enter(ident, meta.line), *self.macros[ident].expand(args), _Exit()]
 
     def label_def(self, items) -> _Label:  # noqa: ANN001
         name = items[0]
         return _Label(name=name)
 
-    def single_arg(self, items) -> tuple[str | _Next]:  # noqa: ANN001
+    @v_args(meta=True)
+    def single_arg(self, meta, items) -> tuple[str | _Next]:  # noqa: ANN001
         a = items[0]
-        return a, a, _Next()
+        return _Line(meta.line), a, a, _Next()
 
-    def double_arg(self, items) -> tuple[str | _Next]:  # noqa: ANN001
+    @v_args(meta=True)
+    def double_arg(self, meta, items) -> tuple[str | _Next]:  # noqa: ANN001
         a, b = items
-        return a, b, _Next()
+        return _Line(meta.line), a, b, _Next()
 
-    def triple_arg(self, items) -> tuple[str | _Next]:  # noqa: ANN001
+    @v_args(meta=True)
+    def triple_arg(self, meta, items) -> tuple[str | _Next]:  # noqa: ANN001
         a, b, c = items
-        return a, b, c
+        return _Line(meta.line), a, b, c
 
-    def data_block(self, items) -> tuple[str | _Label]:  # noqa: ANN001
-        return items
+    @v_args(meta=True)
+    def data_block(self, meta, items) -> list[str | _Label]:  # noqa: ANN001
+        return [_Line(meta.line), *items]
 
     def IDENT(self, token) -> str:  # noqa: ANN001, N802
         return token.value
@@ -151,7 +180,16 @@ class _SubleqTransformer(Transformer):
 
 def subleq_compile(source: str) -> tuple[np.ndarray, dict[str, int]]:
     """Compile subleq assembly into image in the format of np.ndarray."""
-    parser = Lark_StandAlone()
+    data, labels, _ = subleq_compile_mapped(source)
+    return data, labels
+
+
+def subleq_compile_mapped(
+    source: str,
+    filename: str = "<source>",
+) -> tuple[np.ndarray, dict[str, int], SourceMap]:
+    """`subleq_compile`, also returning the source map of the image."""
+    parser = Lark_StandAlone(propagate_positions=True)
     tree = parser.parse(source)
     debug(tree)
     transformer = _SubleqTransformer()
@@ -160,12 +198,27 @@ def subleq_compile(source: str) -> tuple[np.ndarray, dict[str, int]]:
 
     code = []
     labels = const.get_labels()
+    frames = {}
+    stack = [TOP]
+    line = 0
+    words = []
     for inst in instructions:
+        if isinstance(inst, _Line):
+            line = inst.line
+            continue
+        if isinstance(inst, _Enter):
+            frame = Frame(inst.macro, 0, inst.line, stack[-1])
+            stack.append(frames.setdefault(frame, len(frames)))
+            continue
+        if isinstance(inst, _Exit):
+            stack.pop()
+            continue
         if isinstance(inst, _Label):
             if inst.name in labels:
                 raise CompilationError(f"Label {inst.name!r} used twice")
             labels[inst.name] = len(code)
             continue
+        words.append((0, line, stack[-1]))
         if isinstance(inst, _Next):
             code.append(len(code) + 1)
             continue
@@ -182,7 +235,7 @@ def subleq_compile(source: str) -> tuple[np.ndarray, dict[str, int]]:
         assert isinstance(x, int), f"x must be an int {x!r}"
         data[i] = np.uint16(x % (1 << 16))
 
-    return data, labels
+    return data, labels, SourceMap([filename], list(frames), words)
 
 
 def main() -> None:
@@ -195,7 +248,14 @@ def main() -> None:
         "--labels",
         dest="labels",
         action="store_true",
-        help="Save labels to output.labels",
+        help="Save labels to output.labels (npy format; images always carry them)",
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        choices=("image", "npy"),
+        default="image",
+        help="Output an image file (.sqi) or a bare .npy array",
     )
     parser.add_argument(
         "-g",
@@ -211,14 +271,18 @@ def main() -> None:
     debug(f"Input file: {args.input!r}")
 
     source = args.input.read_text()
-    data, labels = subleq_compile(source)
+    data, labels, source_map = subleq_compile_mapped(source, args.input.name)
 
     output_filename = args.output or args.input
-    output_filename = output_filename.with_suffix(".npy")
-    if args.labels:
-        lbstr = json.dumps(labels)
-        output_filename.with_suffix(".labels").write_text(lbstr)
-    np.save(output_filename, data)
+    if args.format == "image":
+        output_filename = output_filename.with_suffix(image.SUFFIX)
+        image.save_image(output_filename, data, labels, source_map=source_map.to_json())
+    else:
+        output_filename = output_filename.with_suffix(".npy")
+        if args.labels:
+            lbstr = json.dumps(labels)
+            output_filename.with_suffix(".labels").write_text(lbstr)
+        np.save(output_filename, data)
     print(f"Compiled output saved to {output_filename!r}. {len(data)} instructions")
 
 
@@ -0,0 +1,423 @@
+# noqa: INP001
+"""Breakpoints on code addresses and watchpoints on memory words.
+
+`subleq_debug` is the `fast.subleq_fast` loop with two cheap checks: the pc is
+compared with one precomputed address, the next breakpoint on the straight
+line of instructions it falls through, which is looked up again only when a
+branch is taken; and a write tests one flag byte of the target word. When
+either fires, the engine stops and `Debugger` shows the instruction as `-g`
+does and asks whether to continue, single-step, inspect memory or quit.
+"""
+
+import re
+import sys
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from . import const
+from .devices import InputDevice, OutputDevice, PromptInput
+from .fast import SIGN_BIT, WORD_MASK, step_wrapped
+from .sourcemap import SourceMap
+from .trace import format_instruction, reverse_labels
+from .watchdog import HALTED, Stopped, Watchdog, run_sliced
+
+if TYPE_CHECKING:
+    from .timetravel import Journal
+
+NO_BREAKPOINT = -1
+
+HELP = """\
+c           continue to the next breakpoint or watchpoint
+s [N]       execute N instructions (default 1), stopping after each
+p SPEC[:N]  print N words (default 1) at a label, label+offset or address
+b SPEC      add a breakpoint
+w SPEC[:N]  watch N words for writes
+q           stop the run and save its state, as with --max-instructions
+(an empty line repeats the last command)"""
+
+HELP_REVERSE = """\
+rs [N]      go back N instructions (default 1)
+rc          go back to the previous breakpoint or watchpoint
+j N         go to the state after instruction N, backwards or forwards"""
+
+
+def resolve(spec: str, labels: dict[str, int]) -> int:
+    """Address of `LABEL`, `LABEL+N`, `LABEL-N` or a number (decimal, 0x...)."""
+    m = re.fullmatch(r"\s*([^\s+-]+)\s*(?:([+-])\s*(\w+))?\s*", spec)
+    if m is None:
+        msg = f"bad address {spec!r}"
+        raise ValueError(msg)
+    base, sign, offset = m.groups()
+    if base in labels:
+        addr = labels[base]
+    else:
+        try:
+            addr = int(base, 0)
+        except ValueError:
+            msg = f"unknown label {base!r}"
+            raise ValueError(msg) from None
+    if offset is not None:
+        addr += int(offset, 0) if sign == "+" else -int(offset, 0)
+    if not 0 <= addr <= WORD_MASK:
+        msg = f"address {addr} of {spec!r} is out of memory"
+        raise ValueError(msg)
+    return addr
+
+
+def resolve_range(spec: str, labels: dict[str, int]) -> range:
+    """Words `SPEC[:N]`: N words (default 1) from the address of `SPEC`."""
+    start, _, words = spec.partition(":")
+    addr = resolve(start, labels)
+    return range(addr, min(addr + (int(words, 0) if words else 1), WORD_MASK + 1))
+
+
+@dataclass
+class Hit:
+    """Why the engine stopped: a breakpoint at `addr`, or a write to the watched `addr`."""
+
+    kind: str
+    addr: int
+    pc: int = 0
+    old: int = 0
+    new: int = 0
+
+
+class Breakpoints:
+    """Breakpoint addresses and per-word watch flags, in the shape the loop checks them."""
+
+    def __init__(self, addrs: Iterable[int] = (), watches: Iterable[range] = ()) -> None:
+        self.addrs = set()
+        self.watched = bytearray(WORD_MASK + 1)
+        self.hit: Hit | None = None
+        self._ahead = None
+        for addr in addrs:
+            self.add(addr)
+        for words in watches:
+            self.watch(words)
+
+    def add(self, addr: int) -> None:
+        self.addrs.add(addr)
+        self._ahead = None
+
+    def watch(self, words: range) -> None:
+        self.watched[words.start : words.stop] = b"\x01" * len(words)
+
+    @property
+    def ahead(self) -> list[int]:
+        """Per pc, the first breakpoint at `pc`, `pc + 3`, `pc + 6`, ... (modulo 2**16), or `NO_BREAKPOINT`.
+
+        That is the only breakpoint the run can reach before its next taken
+        branch, so the loop compares the pc with it and nothing else. The
+        entries past `WORD_MASK` repeat the first three, for `ahead[pc + 3]`.
+        """
+        if self._ahead is None:
+            ahead = [NO_BREAKPOINT] * (WORD_MASK + 4)
+            addrs = self.addrs
+            # the straight-line path wraps past the top of memory; one more
+            # sweep per wrap it can take before it comes back to `pc`
+            for _ in range(4 if addrs else 0):
+                for pc in range(WORD_MASK, -1, -1):
+                    ahead[pc] = pc if pc in addrs else ahead[(pc + 3) & WORD_MASK]
+            ahead[WORD_MASK + 1 :] = ahead[:3]
+            self._ahead = ahead
+        return self._ahead
+
+    def take(self) -> Hit | None:
+        hit, self.hit = self.hit, None
+        return hit
+
+
+def _terminal() -> Callable[[str], str] | None:
+    """`input`, or a reader on the controlling terminal when stdin is redirected."""
+    if sys.stdin.isatty():
+        return input
+    try:
+        tty = Path("/dev/tty").open()  # noqa: SIM115
+    except OSError:
+        return None
+
+    def read(prompt: str) -> str:
+        print(prompt, end="", file=sys.stderr, flush=True)
+        line = tty.readline()
+        if not line:
+            raise EOFError
+        return line.rstrip("\n")
+
+    return read
+
+
+class Debugger:
+    """Shows each stop and reads commands; without a terminal it reports stops and continues."""
+
+    def __init__(
+        self,
+        breakpoints: Breakpoints,
+        labels: dict[str, int],
+        source_map: dict | None = None,
+        commands: Callable[[str], str] | None = None,
+        journal: "Journal | None" = None,
+    ) -> None:
+        self.breakpoints = breakpoints
+        self.journal = journal
+        self.goto: int | None = None
+        self.labels = labels
+        self.rlabels = reverse_labels(labels)
+        self.source_map = SourceMap.from_json(source_map) if source_map else None
+        self.commands = commands if commands is not None else _terminal()
+        self.steps = 0
+        self.last = "s"
+
+    def show(self, mem: list[int], pc: int, count: int, hit: Hit) -> None:
+        """Print why the run stopped and the instruction it stopped at."""
+        if hit.kind == "breakpoint":
+            print(f"breakpoint {self._name(pc)} after {count} instructions", file=sys.stderr)
+        elif hit.kind == "watch":
+            print(
+                f"watch {self._name(hit.addr)}: {hit.old} -> {hit.new} "
+                f"by the instruction at {self._name(hit.pc)}, instruction {count}",
+                file=sys.stderr,
+            )
+        elif hit.kind == "travel":
+            print(f"at instruction {count}", file=sys.stderr)
+        elif hit.kind == "step":
+            print(f"step after {count} instructions", file=sys.stderr)
+        if pc == HALTED:
+            print("halted", file=sys.stderr)
+            return
+        a, b, c = mem[pc], mem[(pc + 1) & WORD_MASK], mem[(pc + 2) & WORD_MASK]
+        for line in format_instruction(pc, a, b, c, mem[a], mem[b], self.rlabels):
+            print(line, file=sys.stderr)
+        if self.source_map is not None:
+            for line in self.source_map.format_stack(pc):
+                print(line, file=sys.stderr)
+
+    def stopped(self, mem: list[int], pc: int, count: int, hit: Hit) -> None:
+        """Show the stop and run commands until one resumes; `q` raises `Stopped`."""
+        self.show(mem, pc, count, hit)
+        if pc == HALTED and self.journal is None:
+            return
+        if self.steps > 0 and pc != HALTED:
+            self.steps -= 1
+            if self.steps:
+                return
+        if self.commands is None:
+            return
+        while True:
+            try:
+                line = self.commands("(debug) ").strip() or self.last
+            except EOFError:
+                line = "q"
+            self.last = line
+            cmd, _, arg = line.partition(" ")
+            try:
+                if self._command(mem, cmd, arg.strip(), count):
+                    return
+            except ValueError as e:
+                print(e, file=sys.stderr)
+            if cmd == "q":
+                raise Stopped(pc, count, "quit in the debugger")
+
+    def _command(self, mem: list[int], cmd: str, arg: str, count: int) -> bool:
+        """Run one command; True if the run should resume."""
+        if self.journal is not None and cmd in ("rs", "rc", "j"):
+            return self._travel(cmd, arg, count)
+        if cmd == "c":
+            return True
+        if cmd == "s":
+            self.steps = int(arg or 1)
+            return True
+        if cmd == "p":
+            for addr in resolve_range(arg, self.labels):
+                value = mem[addr]
+                signed = value - 0x10000 if value & SIGN_BIT else value
+                print(f"{self._name(addr)}: {value:5d} (0x{value:04X}, {signed:6d})", file=sys.stderr)
+        elif cmd == "b":
+            self.breakpoints.add(resolve(arg, self.labels))
+        elif cmd == "w":
+            self.breakpoints.watch(resolve_range(arg, self.labels))
+        elif cmd != "q":
+            print(HELP, file=sys.stderr)
+            if self.journal is not None:
+                print(HELP_REVERSE, file=sys.stderr)
+        return False
+
+    def _travel(self, cmd: str, arg: str, count: int) -> bool:
+        """Set `goto` for a reverse command; the engine moves there and stops again."""
+        if cmd == "rs":
+            self.goto = max(count - int(arg or 1), self.journal.first)
+        elif cmd == "j":
+            self.goto = int(arg, 0)
+        else:
+            self.goto = self.journal.previous_stop(count, self.breakpoints)
+            if self.goto is None:
+                print(f"no earlier stop since instruction {self.journal.first}", file=sys.stderr)
+                return False
+        self.steps = 0
+        return True
+
+    def _name(self, addr: int) -> str:
+        """`addr` with its label, or nearest preceding label and offset."""
+        fixed = const.get_labels()
+        below = [(a, name) for name, a in self.labels.items() if a <= addr and name not in fixed]
+        if not below:
+            return str(addr)
+        a, name = max(below)
+        return f"{addr} ({name})" if a == addr else f"{addr} ({name}+{addr - a})"
+
+
+def subleq_debug(
+    data: np.ndarray,
+    labels: dict[str, int],  # noqa: ARG001
+    out: OutputDevice | None = None,
+    inp: InputDevice | None = None,
+    pc: int = 0,
+    count: int = 0,
+    watchdog: Watchdog | None = None,
+    debugger: Debugger | None = None,
+) -> int:
+    """`fast.subleq_fast` that stops at the breakpoints and watched words of `debugger`.
+
+    After a stop the run resumes with the instruction it stopped at, which does
+    not stop it again. Single steps run one instruction per watchdog slice.
+    With a `debugger.journal` every instruction is journaled, and the run also
+    stops at the halt so that it can go back from there.
+    """
+    out = out or OutputDevice()
+    inp = inp or PromptInput(on_block=out.on_input)
+    debugger = debugger or Debugger(Breakpoints(), {})
+    breakpoints = debugger.breakpoints
+    journal = debugger.journal
+    mem = data.tolist()
+    resuming = False
+
+    def step(pc: int, count: int, limit: int) -> tuple[int, int]:
+        nonlocal resuming
+        if debugger.steps:
+            b = mem[(pc + 1) & WORD_MASK]
+            old = mem[b]
+            pc_before, count_before = pc, count
+            if journal is None:
+                pc, count = step_wrapped(mem, pc, count, out, inp)
+            else:
+                pc, count = journal.step(mem, out, inp, pc, count)
+            hit = Hit("step", pc)
+            writes = b not in (const.IO_ADDR, const.INSPECT_ADDR) and count > count_before
+            if writes and breakpoints.watched[b]:
+                hit = Hit("watch", b, pc_before, old, mem[b])
+        elif journal is None:
+            pc, count = run_to_breakpoint(mem, out, inp, breakpoints, pc, count, limit, skip=resuming)
+            hit = breakpoints.take()
+        else:
+            pc, count = journal.run(mem, out, inp, breakpoints, pc, count, limit, skip=resuming)
+            hit = breakpoints.take()
+        if hit is None and pc == HALTED and journal is not None and debugger.commands is not None:
+            hit = Hit("halt", pc)
+        resuming = hit is not None
+        while hit is not None:
+            out.flush()
+            debugger.stopped(mem, pc, count, hit)
+            if debugger.goto is None:
+                break
+            try:
+                pc, count = journal.travel(mem, out, inp, pc, count, debugger.goto)
+            except ValueError as e:
+                print(e, file=sys.stderr)
+            debugger.goto = None
+            hit = Hit("travel", pc)
+        return pc, count
+
+    try:
+        return run_sliced(step, pc, count, watchdog)
+    finally:
+        data[:] = mem
+        out.flush()
+
+
+def run_to_breakpoint(  # noqa: PLR0913
+    mem: list[int],
+    out: OutputDevice,
+    inp: InputDevice,
+    breakpoints: Breakpoints,
+    pc: int,
+    count: int,
+    limit: int,
+    *,
+    skip: bool,
+    record: Callable[[int, int, int, int, int, int], None] | None = None,
+) -> tuple[int, int]:
+    """The fast loop, stopping before a breakpoint or after a write to a watched word.
+
+    A stop sets `breakpoints.hit`. With `skip` the run starts past a breakpoint
+    at `pc`. `record(pc, a, b, c, old, new)` is called for every executed
+    instruction, `old` and `new` being `mem[b]` before and after it.
+    """
+    write = out.write
+    read = inp.read
+    io_addr = const.IO_ADDR
+    inspect_addr = const.INSPECT_ADDR
+    halt_addr = const.HALT_ADDR
+    ahead = breakpoints.ahead
+    watched = breakpoints.watched
+
+    stop = ahead[pc + 3] if skip else ahead[pc]
+    try:
+        while True:
+            if pc == stop:
+                breakpoints.hit = Hit("breakpoint", pc)
+                return pc, count
+            count += 1
+            a = mem[pc]
+            b = mem[pc + 1]
+            c = mem[pc + 2]
+
+            if a == io_addr:
+                try:
+                    da = -read(count) & WORD_MASK
+                except EOFError:
+                    return HALTED, count - 1  # out of input: halt before the read
+            else:
+                da = mem[a]
+
+            old = mem[b]
+            if b == io_addr:
+                write(da, count)
+                db = old
+            elif b == inspect_addr:
+                out.flush()
+                print(f" < {da:5d}, {da:6x}, {da:16b}")
+                db = old
+            else:
+                db = (old - da) & WORD_MASK
+                mem[b] = db
+                if watched[b]:
+                    breakpoints.hit = Hit("watch", b, pc, old, db)
+                    if record is not None:
+                        record(pc, a, b, c, old, db)
+                    if db == 0 or db & SIGN_BIT:
+                        return (HALTED if c == halt_addr else c), count
+                    return (pc + 3) & WORD_MASK, count
+            if record is not None:
+                record(pc, a, b, c, old, db)
+
+            if db == 0 or db & SIGN_BIT:
+                if c == halt_addr:
+                    return HALTED, count
+                pc = c
+                if count >= limit:
+                    return pc, count
+                stop = ahead[pc]
+                continue
+            pc = (pc + 3) & WORD_MASK
+    except IndexError:
+        if len(mem) <= WORD_MASK or pc + 2 <= WORD_MASK:
+            raise
+        a, b, c = mem[pc], mem[(pc + 1) & WORD_MASK], mem[(pc + 2) & WORD_MASK]
+        old = mem[b]
+        nxt, executed = step_wrapped(mem, pc, count - 1, out, inp)
+        if record is not None and executed == count:
+            record(pc, a, b, c, old, mem[b])
+        return nxt, executed
@@ -0,0 +1,250 @@
+# noqa: INP001
+"""I/O devices behind `IO_ADDR`."""
+
+import os
+import sys
+from collections.abc import Callable, Iterable
+from typing import BinaryIO
+
+DEFAULT_BUFFER_SIZE = 1 << 16
+DEFAULT_CHUNK_SIZE = 1 << 16
+
+NEWLINE = 0x0A
+PREFIXES = ("0x", "0o", "0b")
+
+
+class BadInput(ValueError):
+    """An input token that is not an integer."""
+
+
+def parse_int(token: str | bytes) -> int:
+    """One input integer: decimal (leading zeros allowed), or hex, octal or binary with a `0x`, `0o` or `0b` prefix."""
+    text = token.decode(errors="replace") if isinstance(token, bytes) else token
+    base = 0 if text.lstrip("+-")[:2].lower() in PREFIXES else 10
+    try:
+        return int(text, base)
+    except ValueError:
+        msg = f"not an integer: {text!r}"
+        raise BadInput(msg) from None
+
+
+def _byte(value: int) -> bytes:
+    return bytes([value])
+
+
+ENCODINGS: dict[str, Callable[[int], bytes]] = {
+    "byte": _byte,  # one byte, values above 255 are an error
+    "low": lambda v: bytes([v & 0xFF]),  # low byte only
+    "u16le": lambda v: v.to_bytes(2, "little"),
+    "u16be": lambda v: v.to_bytes(2, "big"),
+    "utf8": lambda v: chr(v).encode("utf-8", "surrogatepass"),
+}
+
+
+class OutputDevice:
+    """Buffered output for the words a program writes to `IO_ADDR`.
+
+    `sink` is a file descriptor, a binary file or pipe, or a `bytearray` to
+    collect output in memory. The buffer is flushed when it reaches
+    `buffer_size`, after a newline if `line_buffered`, before the program reads
+    input if `flush_on_input`, and by the engine when the run ends.
+    """
+
+    def __init__(
+        self,
+        sink: int | BinaryIO | bytearray = 1,
+        encoding: str = "byte",
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+        *,
+        line_buffered: bool = True,
+        flush_on_input: bool = True,
+    ) -> None:
+        self.sink = sink
+        self.encoding = encoding
+        self.buffer_size = buffer_size
+        self.line_buffered = line_buffered
+        self.flush_on_input = flush_on_input
+        self.buffer = bytearray()
+        self.written = 0
+        self._encode = None if encoding == "byte" else ENCODINGS[encoding]
+
+    def write(self, value: int, count: int = 0) -> None:  # noqa: ARG002
+        """Encode one word into the buffer, flushing according to the policy.
+
+        `count` is the number of the instruction doing the write.
+        """
+        buffer = self.buffer
+        if self._encode is None:
+            buffer.append(value)
+        else:
+            buffer += self._encode(value)
+        if (value == NEWLINE and self.line_buffered) or len(buffer) >= self.buffer_size:
+            self.flush()
+
+    def on_input(self) -> None:
+        """Called before the program blocks on input."""
+        if self.flush_on_input:
+            self.flush()
+
+    def flush(self) -> None:
+        """Hand the buffered bytes to the sink."""
+        if not self.buffer:
+            return
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        self.written += len(data)
+        sink = self.sink
+        if isinstance(sink, bytearray):
+            sink += data
+        elif isinstance(sink, int):
+            view = memoryview(data)
+            while view:
+                view = view[os.write(sink, view) :]
+        else:
+            sink.write(data)
+            sink.flush()
+
+
+class InputDevice:
+    """Source of the words a program reads from `IO_ADDR`.
+
+    Words are parsed ahead in bulk by `_fill`, so a read is a list index. A
+    read past the end of the input raises `EOFError`; `on_block` is called
+    before the device may block waiting for more input.
+    """
+
+    def __init__(self, on_block: Callable[[], None] | None = None) -> None:
+        self.on_block = on_block
+        self.words = []
+        self.pos = 0
+        self.consumed = 0
+
+    def read(self, count: int = 0) -> int:  # noqa: ARG002
+        """Return the next input word for the `count`th instruction."""
+        pos = self.pos
+        if pos == len(self.words):
+            if self.on_block is not None:
+                self.on_block()
+            self.words = self._fill()
+            pos = 0
+            if not self.words:
+                self.pos = 0
+                raise EOFError
+        self.pos = pos + 1
+        self.consumed += 1
+        return self.words[pos]
+
+    def _fill(self) -> list[int]:
+        """Return the next batch of words, or an empty list at the end of input."""
+        return []
+
+    def pending(self) -> tuple[list[int], bytes]:
+        """Words parsed but not read yet, and raw input not parsed yet."""
+        return self.words[self.pos :], b""
+
+    def restore(self, words: list[int], raw: bytes = b"") -> None:  # noqa: ARG002
+        """Put back what `pending` returned, ahead of the rest of the input."""
+        self.words = list(words)
+        self.pos = 0
+
+
+class ArrayInput(InputDevice):
+    """A preloaded queue of input words."""
+
+    def __init__(self, values: Iterable[int], on_block: Callable[[], None] | None = None) -> None:
+        super().__init__(on_block)
+        self.words = [int(v) for v in values]
+
+
+class PromptInput(InputDevice):
+    """One integer per line typed at a `> ` prompt."""
+
+    def _fill(self) -> list[int]:
+        while True:
+            try:
+                line = input("> ")
+            except EOFError:
+                return []
+            try:
+                return [parse_int(line.strip())]
+            except BadInput as e:
+                print(e, file=sys.stderr)
+
+
+class _StreamInput(InputDevice):
+    def __init__(
+        self,
+        stream: BinaryIO,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        on_block: Callable[[], None] | None = None,
+    ) -> None:
+        super().__init__(on_block)
+        self._read = getattr(stream, "read1", stream.read)
+        self.chunk_size = chunk_size
+        self.offset = 0
+
+    def _chunk(self) -> bytes:
+        chunk = self._read(self.chunk_size)
+        self.offset += len(chunk)
+        return chunk
+
+
+class BytesInput(_StreamInput):
+    """Raw bytes from a binary stream, one word per byte."""
+
+    def _fill(self) -> list[int]:
+        return list(self._chunk())
+
+
+class IntsInput(_StreamInput):
+    """Whitespace separated integers (see `parse_int`) from a binary stream; a bad token raises `BadInput`."""
+
+    def __init__(
+        self,
+        stream: BinaryIO,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        on_block: Callable[[], None] | None = None,
+    ) -> None:
+        super().__init__(stream, chunk_size, on_block)
+        self.pending_bytes = b""
+
+    def _fill(self) -> list[int]:
+        while True:
+            chunk = self._chunk()
+            if not chunk:
+                tokens, self.pending_bytes = self.pending_bytes.split(), b""
+                return self._parse(tokens)
+            data = self.pending_bytes + chunk
+            # a token may continue in the next chunk
+            cut = max(data.rfind(ws) for ws in (b" ", b"\n", b"\t", b"\r"))
+            self.pending_bytes = data[cut + 1 :]
+            words = self._parse(data[: cut + 1].split())
+            if words:
+                return words
+
+    def _parse(self, tokens: list[bytes]) -> list[int]:
+        """The words of `tokens`; a bad one goes back to `pending_bytes` and raises once it is next."""
+        try:
+            return [int(t) for t in tokens]  # plain decimals
+        except ValueError:
+            pass
+        words = []
+        for i, token in enumerate(tokens):
+            try:
+                words.append(parse_int(token))
+            except BadInput:
+                if not words:
+                    raise
+                self.pending_bytes = b" ".join(tokens[i:]) + b" " + self.pending_bytes
+                break
+        return words
+
+    def pending(self) -> tuple[list[int], bytes]:
+        return self.words[self.pos :], self.pending_bytes
+
+    def restore(self, words: list[int], raw: bytes = b"") -> None:
+        super().restore(words)
+        self.pending_bytes = raw
+
+
+INPUT_MODES = {"prompt": PromptInput, "bytes": BytesInput, "ints": IntsInput}
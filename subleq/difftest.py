@@ -0,0 +1,640 @@
+# noqa: INP001
+"""Differential test harness: every engine against the reference `run.subleq`.
+
+Each case (an image plus its input words) runs on the reference engine and on
+every other engine; final memory, instruction count and output (I/O words with
+their instruction counts, and `INSPECT` lines) must match exactly. The corpus
+is `program.sub`, a driver program per macro of its library, and randomly
+generated images with I/O, `INSPECT` and self-modifying code. Besides the
+engines proper, the loops of the debugger (with and without a journal, going
+back from the halt and running to it again), of the trace file writer and of
+the scheduler are checked the same way.
+
+On a mismatch the engine is rerun in lock step with a single-stepping copy of
+the reference semantics to find the earliest instruction where it diverges.
+"""
+
+import argparse
+import contextlib
+import io
+import re
+import sys
+import tempfile
+from collections.abc import Callable, Iterator
+from dataclasses import dataclass, field
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+
+from . import compile as compiler
+from . import const
+from .batch import subleq_batch
+from .debugger import Breakpoints, Debugger, subleq_debug
+from .devices import ENCODINGS, ArrayInput, InputDevice, OutputDevice
+from .fast import SIGN_BIT, WORD_MASK, subleq_fast
+from .fuse import subleq_fused
+from .hooks import Hooks, subleq_hooked
+from .jit import subleq_jit
+from .memory import allocate
+from .profiler import subleq_profiled
+from .run import subleq
+from .scheduler import Scheduler
+from .sourcemap import SourceMap
+from .timetravel import Journal
+from .tracefile import Bound, TraceWriter, subleq_trace_file
+from .translate import subleq_translated
+from .watchdog import Watchdog
+
+PROGRAM = Path(__file__).parent.parent / "program.sub"
+MAX_INSTRUCTIONS = 200_000
+CODE_START = 6  # after the jump over IO and INSPECT
+BATCH_ENCODING = "u16le"  # every output word fits
+JOURNAL_INTERVAL = 1 << 10  # so that longer cases span several segments
+TRACE_WINDOW = (100, 5000)  # instruction counts: cases run before, in and after the window
+SCHEDULER_QUANTUM = 64
+
+ENGINES: dict[str, Callable] = {
+    "fast": subleq_fast,
+    "jit": subleq_jit,
+    "jit-eager": partial(subleq_jit, hot_threshold=1),
+    "fused": subleq_fused,
+    "translated": subleq_translated,
+    "profiled": subleq_profiled,
+    "hooked": None,  # `subleq_hooked` with every event hooked, set below
+    "debugger": None,  # `subleq_debug` with no breakpoints, set below
+    "journaled": None,  # ... journaling, set below
+    "traced": None,  # `subleq_trace_file` into a scratch file, set below
+    "scheduled": None,  # one machine of a `Scheduler`, see `_run_scheduled`
+    "batch": None,  # run through `subleq_batch`, see `_run_batch`
+}
+
+# macro library drivers: each reads x and y, applies the macro, writes x and y
+MACRO_DRIVERS = {
+    "add": ("add! x y;", 65536, 65536),
+    "sub": ("sub! x y;", 65536, 65536),
+    "cpy": ("cpy! x y;", 65536, 65536),
+    "inc-dec": ("inc! x; dec! y;", 65536, 65536),
+    "double": ("double! x;", 65536, 65536),
+    "mul": ("mul! x y;", 40, 65536),
+    "lshift": ("lshift! x y;", 20, 65536),
+    "rshift": ("rshift! x y;", 65536, 17),
+    "jleqz": ("jleqz! x yes; clr! y; jmp! done; yes: clr! y; inc! y; done:", 65536, 1),
+    "jgtz": ("jgtz! x yes; clr! y; jmp! done; yes: clr! y; inc! y; done:", 65536, 1),
+    "jeqz": ("jeqz! x yes; clr! y; jmp! done; yes: clr! y; inc! y; done:", 65536, 1),
+    "jgeqz": ("jgeqz! x yes; clr! y; jmp! done; yes: clr! y; inc! y; done:", 65536, 1),
+    "jltz": ("jltz! x yes; clr! y; jmp! done; yes: clr! y; inc! y; done:", 65536, 1),
+    "push-pop": ("push! x; push! y; pop! x; pop! y;", 65536, 65536),
+    "quarter_word_lshift_overflow": ("quarter_word_lshift_overflow! x y;", 65536, 16),
+    "half_word_lshift_overflow": ("half_word_lshift_overflow! x y;", 65536, 16),
+    "lshift_overflow": ("lshift_overflow! x y;", 65536, 16),
+    "double_dabble_add_3": ("double_dabble_add_3! x;", 16, 1),
+    "newline": ("newline!;", 1, 1),
+}
+
+
+class Divergence(Exception):  # noqa: N818
+    """An engine left the reference path."""
+
+
+@dataclass
+class Case:
+    """An image and the input words it runs on."""
+
+    name: str
+    words: np.ndarray
+    inputs: list[int]
+    labels: dict[str, int] = field(default_factory=dict)
+    source_map: SourceMap | None = None
+
+
+@dataclass
+class Outcome:
+    """What an engine did with a case."""
+
+    memory: np.ndarray
+    count: int
+    events: list[tuple]
+    error: str | None = None
+
+
+class _Capture(OutputDevice):
+    """Keeps every output word with its instruction count."""
+
+    def __init__(self, events: list[tuple]) -> None:
+        super().__init__(bytearray(), line_buffered=False)
+        self.events = events
+
+    def write(self, value: int, count: int = 0) -> None:
+        self.events.append(("out", value, count))
+
+
+class _Prints(io.TextIOBase):
+    """Collects the `INSPECT` lines engines print, in order with the output words."""
+
+    def __init__(self, events: list[tuple]) -> None:
+        self.events = events
+
+    def write(self, s: str) -> int:
+        if s:
+            self.events.append(("print", s, 0))
+        return len(s)
+
+
+class _EveryHook(Hooks):
+    """Listens to every event, so the hooked engine runs its fullest generated loop."""
+
+    def __init__(self) -> None:
+        self.events = 0
+
+    def on_instruction(self, count: int, pc: int, a: int, b: int, c: int) -> None:  # noqa: ARG002
+        self.events += 1
+
+    def on_write(self, count: int, addr: int, old: int, new: int) -> None:  # noqa: ARG002
+        self.events += 1
+
+    def on_branch(self, count: int, pc: int, target: int) -> None:  # noqa: ARG002
+        self.events += 1
+
+    def on_read(self, count: int, value: int) -> None:  # noqa: ARG002
+        self.events += 1
+
+    def on_output(self, count: int, value: int) -> None:  # noqa: ARG002
+        self.events += 1
+
+    def on_halt(self, count: int, pc: int) -> None:  # noqa: ARG002
+        self.events += 1
+
+
+ENGINES["hooked"] = partial(subleq_hooked, hooks=[_EveryHook(), _EveryHook()])
+
+
+def _debugged(
+    data: np.ndarray,
+    labels: dict[str, int],
+    out: OutputDevice,
+    inp: InputDevice,
+    watchdog: Watchdog | None = None,
+    *,
+    journal: bool = False,
+) -> int:
+    """`subleq_debug` with no breakpoints; with `journal`, going back from the halt and running to it again.
+
+    Output words written again on the way are dropped by the journal; the
+    `INSPECT` lines printed again are dropped here.
+    """
+    timeline = None
+    if journal:
+        timeline = Journal(JOURNAL_INTERVAL)
+        inp, out = timeline.devices(inp, out)
+    replay = contextlib.ExitStack()
+
+    def session() -> Iterator[str]:
+        yield "rs 1000000"  # as far back as the journal goes
+        replay.enter_context(contextlib.redirect_stdout(io.StringIO()))
+        yield "c"
+        replay.close()
+        while True:
+            yield "c"
+
+    commands = session()
+    debugger = Debugger(Breakpoints(), labels, commands=lambda _: next(commands), journal=timeline)
+    with replay, contextlib.redirect_stderr(io.StringIO()):
+        return subleq_debug(data, labels, out, inp, watchdog=watchdog, debugger=debugger)
+
+
+def _traced(
+    data: np.ndarray,
+    labels: dict[str, int],
+    out: OutputDevice,
+    inp: InputDevice,
+    watchdog: Watchdog | None = None,
+) -> int:
+    """`subleq_trace_file` tracing `TRACE_WINDOW` into a scratch file."""
+    start, stop = TRACE_WINDOW
+    with tempfile.TemporaryDirectory() as tmp:
+        trace = TraceWriter(Path(tmp) / "case.trace.npz")
+        try:
+            return subleq_trace_file(
+                data, labels, out, inp, watchdog=watchdog, trace=trace, start=Bound(count=start), stop=Bound(count=stop)
+            )
+        finally:
+            trace.close(labels)
+
+
+def _scheduled(
+    data: np.ndarray,
+    labels: dict[str, int],  # noqa: ARG001
+    out: OutputDevice,
+    inp: InputDevice,
+    watchdog: Watchdog | None = None,
+) -> int:
+    """`data` as the one machine of a `Scheduler`, `watchdog` checked between quanta."""
+    scheduler = Scheduler(SCHEDULER_QUANTUM)
+    vm = scheduler.spawn(data, inp=inp, out=out)
+    while scheduler.run_quantum() is not None:
+        if watchdog is not None and not vm.done:
+            watchdog.check(vm.pc, vm.count)
+    data[:] = vm.memory
+    if vm.status != "halted":
+        msg = f"{vm.status}: {vm.reason}"
+        raise RuntimeError(msg)
+    return vm.count
+
+
+ENGINES["debugger"] = _debugged
+ENGINES["journaled"] = partial(_debugged, journal=True)
+ENGINES["traced"] = _traced
+ENGINES["scheduled"] = _scheduled
+
+
+class Stepper:
+    """The reference semantics on plain ints, one instruction at a time."""
+
+    def __init__(self, words: np.ndarray, inputs: list[int]) -> None:
+        self.mem = allocate(words).tolist()
+        self.inputs = list(inputs)
+        self.pos = 0
+        self.pc = 0
+        self.count = 0
+        self.halted = False
+        self.outputs = []
+        self.last_write = {}
+
+    def step(self) -> None:
+        mem = self.mem
+        pc = self.pc
+        a, b, c = mem[pc], mem[(pc + 1) & WORD_MASK], mem[(pc + 2) & WORD_MASK]
+        if a == const.IO_ADDR:
+            if self.pos == len(self.inputs):
+                self.halted = True  # out of input: halt before the read
+                return
+            da = -self.inputs[self.pos] & WORD_MASK
+            self.pos += 1
+        else:
+            da = mem[a]
+        self.count += 1
+        if b == const.IO_ADDR:
+            self.outputs.append((da, self.count))
+            db = mem[b]
+        elif b == const.INSPECT_ADDR:
+            db = mem[b]
+        else:
+            db = (mem[b] - da) & WORD_MASK
+            mem[b] = db
+            self.last_write[b] = (self.count, pc)
+        if db == 0 or db & SIGN_BIT:
+            if c == const.HALT_ADDR:
+                self.halted = True
+            self.pc = c
+        else:
+            self.pc = (pc + 3) & WORD_MASK
+
+    def run_to(self, count: int) -> None:
+        while self.count < count and not self.halted:
+            self.step()
+
+
+class _Lockstep(Watchdog):
+    """Checks the engine against a `Stepper` at every block boundary."""
+
+    def __init__(self, stepper: Stepper, describe: Callable[[int], str]) -> None:
+        super().__init__(slice_size=1)
+        self.stepper = stepper
+        self.describe = describe
+
+    def check(self, pc: int, count: int) -> None:
+        s = self.stepper
+        s.run_to(count)
+        if s.count != count or s.pc != pc:
+            msg = (
+                f"after instruction {count} the engine is at {self.describe(pc)}, the reference "
+                f"{'halted' if s.halted else 'is at ' + self.describe(s.pc)} after {s.count}"
+            )
+            raise Divergence(msg)
+
+
+class _LockstepOutput(_Capture):
+    def __init__(self, stepper: Stepper, describe: Callable[[int], str]) -> None:
+        super().__init__([])
+        self.stepper = stepper
+        self.describe = describe
+
+    def write(self, value: int, count: int = 0) -> None:
+        s = self.stepper
+        s.run_to(count)
+        self.events.append((value, count))
+        if s.outputs[: len(self.events)] != self.events:
+            expected = s.outputs[len(self.events) - 1] if len(s.outputs) >= len(self.events) else None
+            msg = f"output {value} at instruction {count}, the reference wrote {expected} (word, count)"
+            raise Divergence(msg)
+
+
+def run_engine(engine: Callable, case: Case) -> Outcome:
+    """Run one engine on a case, capturing memory, count and output."""
+    data = allocate(case.words)
+    events = []
+    try:
+        with contextlib.redirect_stdout(_Prints(events)):
+            count = engine(
+                data,
+                case.labels,
+                out=_Capture(events),
+                inp=ArrayInput(case.inputs),
+                watchdog=Watchdog(MAX_INSTRUCTIONS),
+            )
+    except Exception as e:  # noqa: BLE001
+        return Outcome(data, -1, events, f"{type(e).__name__}: {e}")
+    return Outcome(data, count, events)
+
+
+def _run_batch(case: Case, max_steps: int | None = None) -> Outcome:
+    """Run a case as a one-instance batch, output words as `BATCH_ENCODING` bytes."""
+    try:
+        result = subleq_batch(allocate(case.words), [case.inputs], max_steps, encoding=BATCH_ENCODING)
+    except Exception as e:  # noqa: BLE001
+        return Outcome(allocate(case.words), -1, [], f"{type(e).__name__}: {e}")
+    return Outcome(result.memory[0], int(result.counts[0]), [("bytes", result.outputs[0], 0)])
+
+
+def _run_scheduled(case: Case) -> Outcome:
+    """Run a case on a scheduler, which keeps `INSPECT` lines in the machine's output, as `BATCH_ENCODING` bytes."""
+    buffer = bytearray()
+    out = OutputDevice(buffer, BATCH_ENCODING, line_buffered=False, flush_on_input=False)
+    data = allocate(case.words)
+    try:
+        count = _scheduled(data, case.labels, out, ArrayInput(case.inputs), Watchdog(MAX_INSTRUCTIONS))
+    except Exception as e:  # noqa: BLE001
+        return Outcome(data, -1, [], f"{type(e).__name__}: {e}")
+    return Outcome(data, count, [("bytes", bytes(buffer), 0)])
+
+
+def _batch_events(events: list[tuple]) -> list[tuple]:
+    """The reference events as one output buffer, as the batch engine and the scheduler write them."""
+    encode = ENCODINGS[BATCH_ENCODING]
+    out = bytearray()
+    for kind, value, _ in events:
+        out += value.encode() if kind == "print" else encode(value)
+    return [("bytes", bytes(out), 0)]
+
+
+def compare(expected: Outcome, got: Outcome, *, batch: bool = False) -> str | None:
+    """Describe how `got` differs from `expected`, or None if it does not.
+
+    With `batch`, `got` has its output as one buffer of bytes (see `_batch_events`).
+    """
+    if got.error is not None:
+        return got.error
+    if got.count != expected.count:
+        return f"instruction count {got.count}, expected {expected.count}"
+    events = _batch_events(expected.events) if batch else expected.events
+    if got.events != events:
+        return "output differs"
+    diff = np.nonzero(got.memory != expected.memory)[0]
+    if len(diff):
+        return f"memory differs at {len(diff)} addresses, first {int(diff[0])}"
+    return None
+
+
+def find_divergence(name: str, case: Case) -> str:
+    """Rerun engine `name` in lock step with the reference and describe the first divergence."""
+    describe = partial(_describe, case)
+    if name == "batch":
+        return _bisect_batch(case, describe)
+    stepper = Stepper(case.words, case.inputs)
+    data = allocate(case.words)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            count = ENGINES[name](
+                data,
+                case.labels,
+                out=_LockstepOutput(stepper, describe),
+                inp=ArrayInput(case.inputs),
+                watchdog=_Lockstep(stepper, describe),
+            )
+    except Divergence as e:
+        return str(e) + _context(stepper, describe)
+    except Exception as e:  # noqa: BLE001
+        return f"{type(e).__name__}: {e} after instruction {stepper.count}" + _context(stepper, describe)
+    stepper.run_to(MAX_INSTRUCTIONS)
+    if count != stepper.count:
+        return f"halted after {count} instructions, the reference after {stepper.count}"
+    diff = np.nonzero(data != np.array(stepper.mem, dtype=np.uint16))[0]
+    if not len(diff):
+        return "no divergence on rerun (nondeterministic engine?)"
+    addr = int(diff[0])
+    when = stepper.last_write.get(addr)
+    if when is None:
+        return f"memory at {addr} written by the engine only"
+    return f"memory at {addr} last written by the reference at instruction {when[0]}, {describe(when[1])}"
+
+
+def _bisect_batch(case: Case, describe: Callable[[int], str]) -> str:
+    """Binary search for the first batch step whose state differs from the reference."""
+
+    def differs(k: int) -> bool:
+        stepper = Stepper(case.words, case.inputs)
+        stepper.run_to(k)
+        result = subleq_batch(allocate(case.words), [case.inputs], k, encoding=BATCH_ENCODING)
+        memory = np.zeros(len(stepper.mem), dtype=np.uint16)
+        memory[: result.memory.shape[1]] = result.memory[0]
+        return bool(
+            int(result.counts[0]) != stepper.count
+            or (not stepper.halted and int(result.pc[0]) != stepper.pc)
+            or (memory != np.array(stepper.mem, dtype=np.uint16)).any(),
+        )
+
+    reference = Stepper(case.words, case.inputs)
+    reference.run_to(MAX_INSTRUCTIONS)
+    lo, hi = 0, reference.count + 1
+    if not differs(hi):
+        return "final state matches step by step; only the output differs"
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if differs(mid):
+            hi = mid
+        else:
+            lo = mid
+    stepper = Stepper(case.words, case.inputs)
+    stepper.run_to(lo)
+    return f"state first differs after instruction {hi}, executing {describe(stepper.pc)}"
+
+
+def _context(stepper: Stepper, describe: Callable[[int], str]) -> str:
+    return f"\n    reference last executed up to instruction {stepper.count}, now at {describe(stepper.pc)}"
+
+
+def _describe(case: Case, pc: int) -> str:
+    """`pc` with its instruction, nearest label and source line."""
+    words = allocate(case.words)
+    text = f"pc {pc} ({int(words[pc])} {int(words[(pc + 1) & WORD_MASK])} {int(words[(pc + 2) & WORD_MASK])})"
+    below = [(addr, name) for name, addr in case.labels.items() if addr <= pc and name not in const.get_labels()]
+    if below:
+        addr, name = max(below)
+        text += f" {name}+{pc - addr}"
+    if case.source_map is not None:
+        text += " " + ", ".join(line.strip() for line in case.source_map.format_stack(pc))
+    return text
+
+
+def program_cases(path: Path, rng: np.random.Generator) -> list[Case]:
+    """`program.sub` on a few input sets."""
+    words, labels, source_map = _compile(path.read_text(), path.name)
+    input_sets = [
+        [],
+        list(range(1, 21)),
+        [0, 1, 9, 10, 99, 100, 9999, 10000, 32767, 32768, 65535],
+        rng.integers(0, 1 << 16, 16).tolist(),
+    ]
+    return [Case(f"{path.name}#{i}", words, inputs, labels, source_map) for i, inputs in enumerate(input_sets)]
+
+
+def macro_cases(path: Path, rng: np.random.Generator, pairs: int = 12) -> list[Case]:
+    """One driver program per macro of the library at the top of `path`."""
+    source = path.read_text()
+    library = source[: source.index("#################### CODE")]
+    data = source[source.rindex("\n.data") :]
+    cases = []
+    for name, (body, x_range, y_range) in MACRO_DRIVERS.items():
+        driver = (
+            f"{library}\njmp! start;\n.data 0 0 .endd\n"
+            f"start: clr! x; IO x; clr! y; IO y;\n{body}\nx IO; y IO; jmp! start;\n"
+            f".data x: 0 y: 0 .endd\n{data}"
+        )
+        words, labels, source_map = _compile(driver, f"{path.name}:{name}!")
+        inputs = np.stack([rng.integers(0, x_range, pairs), rng.integers(0, y_range, pairs)], axis=1)
+        cases.append(Case(f"macro {name}!", words, inputs.ravel().tolist(), labels, source_map))
+    return cases
+
+
+def _compile(source: str, filename: str) -> tuple[np.ndarray, dict[str, int], SourceMap]:
+    debug = compiler.DEBUG
+    compiler.DEBUG = False
+    try:
+        return compiler.subleq_compile_mapped(source, filename)
+    finally:
+        compiler.DEBUG = debug
+
+
+def random_case(rng: np.random.Generator, index: int) -> Case:
+    """A random image that halts on the reference, with I/O, INSPECT and self-modifying code.
+
+    Self-modifying writes only target the `a` and `b` words of instructions, so
+    control never reaches the last two words of memory.
+    """
+    while True:
+        n_instructions = int(rng.integers(4, 40))
+        n_data = int(rng.integers(4, 16))
+        data_start = CODE_START + 3 * n_instructions
+        size = data_start + n_data + 1
+        zero = size - 1
+        words = np.zeros(size, dtype=np.int64)
+        words[:3] = (zero, zero, CODE_START)
+        words[data_start:zero] = rng.choice([0, 1, 2, 3, 7, 100, 255, 0x7FFF, 0x8000, 0xFFFF], n_data)
+        pcs = CODE_START + 3 * np.arange(n_instructions)
+        data_cells = np.arange(data_start, size)
+        operand_words = np.concatenate([pcs, pcs + 1])
+
+        for pc in pcs.tolist():
+            r = rng.random()
+            if r < 0.1:  # noqa: PLR2004
+                a = const.IO_ADDR
+            elif r < 0.2:  # noqa: PLR2004
+                a = int(rng.integers(0, size))
+            else:
+                a = int(rng.choice(data_cells))
+            r = rng.random()
+            if r < 0.08:  # noqa: PLR2004
+                b = const.IO_ADDR
+            elif r < 0.1:  # noqa: PLR2004
+                b = const.INSPECT_ADDR
+            elif r < 0.2:  # noqa: PLR2004
+                b = int(rng.choice(operand_words))
+            else:
+                b = int(rng.choice(data_cells))
+            r = rng.random()
+            if r < 0.5:  # noqa: PLR2004
+                c = pc + 3 if pc + 3 < data_start else const.HALT_ADDR
+            elif r < 0.92:  # noqa: PLR2004
+                c = int(rng.choice(pcs))
+            else:
+                c = const.HALT_ADDR
+            words[pc : pc + 3] = (a, b, c)
+
+        inputs = rng.integers(-300, 300, int(rng.integers(0, 12))).tolist()
+        stepper = Stepper(words.astype(np.uint16), inputs)
+        stepper.run_to(MAX_INSTRUCTIONS // 4)
+        if stepper.halted:
+            return Case(f"random #{index}", (words & WORD_MASK).astype(np.uint16), inputs)
+
+
+def check_case(case: Case, engines: list[str]) -> list[tuple[str, str]]:
+    """Run `case` on the reference and on `engines`; return (engine, problem) per mismatch."""
+    expected = run_engine(subleq, case)
+    if expected.error is not None:
+        return [("reference", expected.error)]
+    problems = []
+    for name in engines:
+        if name == "batch":
+            problem = compare(expected, _run_batch(case), batch=True)
+        elif name == "scheduled":
+            problem = compare(expected, _run_scheduled(case), batch=True)
+        else:
+            problem = compare(expected, run_engine(ENGINES[name], case))
+        if problem is not None:
+            problems.append((name, problem))
+    return problems
+
+
+def main() -> None:
+    """Entrypoint."""
+    parser = argparse.ArgumentParser(description="Check every engine against the reference engine")
+    parser.add_argument(
+        "sources", type=Path, nargs="*", help="Programs for the corpus (default: program.sub of a source checkout)"
+    )
+    parser.add_argument("-n", "--random", type=int, default=200, help="Number of random images")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for inputs and random images")
+    parser.add_argument(
+        "-e",
+        "--engines",
+        default=",".join(ENGINES),
+        help=f"Comma separated engines to check (default: {','.join(ENGINES)})",
+    )
+    parser.add_argument("-k", "--keep-going", action="store_true", help="Do not stop at the first mismatch")
+    args = parser.parse_args()
+
+    engines = [e for e in re.split(r"[,\s]+", args.engines) if e]
+    unknown = set(engines) - set(ENGINES)
+    if unknown:
+        parser.error(f"unknown engines: {', '.join(sorted(unknown))}")
+
+    rng = np.random.default_rng(args.seed)
+    if not args.sources and not PROGRAM.is_file():
+        parser.error(f"{PROGRAM} not found (not running from a source checkout), give the programs to test")
+    sources = args.sources or [PROGRAM]
+    missing = [str(path) for path in sources if not path.is_file()]
+    if missing:
+        parser.error(f"no such file: {', '.join(missing)}")
+    cases = []
+    for path in sources:
+        cases += program_cases(path, rng)
+        if "#################### CODE" in path.read_text():
+            cases += macro_cases(path, rng)
+    cases += [random_case(rng, i) for i in range(args.random)]
+
+    failures = 0
+    for case in cases:
+        problems = check_case(case, engines)
+        for name, problem in problems:
+            failures += 1
+            print(f"MISMATCH {name} on {case.name}: {problem}")
+            if name != "reference":
+                print(f"  first divergence: {find_divergence(name, case)}")
+        if problems and not args.keep_going:
+            break
+    print(f"{len(cases)} cases, {len(engines)} engines: {failures or 'no'} mismatches")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+# noqa: INP001
+"""Pure-int subleq engine: same semantics as `run.subleq`, no NumPy scalars in the loop."""
+
+from collections.abc import Callable
+
+import numpy as np
+
+from . import const
+from .devices import InputDevice, OutputDevice, PromptInput
+from .watchdog import HALTED, Watchdog, run_sliced
+
+WORD_MASK = 0xFFFF
+SIGN_BIT = 0x8000
+
+
+def subleq_fast(
+    data: np.ndarray,
+    labels: dict[str, int],  # noqa: ARG001
+    out: OutputDevice | None = None,
+    inp: InputDevice | None = None,
+    pc: int = 0,
+    count: int = 0,
+    watchdog: Watchdog | None = None,
+) -> int:
+    """Emulate a subleq computer on a bank of data using plain Python ints.
+
+    Memory is copied into a list for the run and written back into `data` when
+    the run ends, so callers see the same final image as with `run.subleq`.
+    """
+    out = out or OutputDevice()
+    inp = inp or PromptInput(on_block=out.on_input)
+    mem = data.tolist()
+    try:
+        return run_sliced(
+            lambda pc, count, limit: run_slice(mem, out, inp, pc, count, limit),
+            pc,
+            count,
+            watchdog,
+        )
+    finally:
+        data[:] = mem
+        out.flush()
+
+
+def run_slice(
+    mem: list[int],
+    out: OutputDevice,
+    inp: InputDevice,
+    pc: int,
+    count: int,
+    limit: int,
+    *,
+    park: tuple[type[Exception], ...] = (),
+    inspect: Callable[[int], None] | None = None,
+) -> tuple[int, int]:
+    """Run from `pc` until a halt or the first branch at or past `limit` instructions.
+
+    Returns the next pc (or `HALTED`) and the instruction count, the `step` of
+    `watchdog.run_sliced`. A read raising one of `park` returns before the
+    read, to be run again later; `inspect` takes the `INSPECT` values instead
+    of stdout.
+    """
+    write = out.write
+    read = inp.read
+    io_addr = const.IO_ADDR
+    inspect_addr = const.INSPECT_ADDR
+    halt_addr = const.HALT_ADDR
+
+    try:
+        while True:
+            count += 1
+            a = mem[pc]
+            b = mem[pc + 1]
+            c = mem[pc + 2]
+
+            if a == io_addr:
+                try:
+                    da = -read(count) & WORD_MASK
+                except EOFError:
+                    return HALTED, count - 1  # out of input: halt before the read
+                except park:
+                    return pc, count - 1
+            else:
+                da = mem[a]
+
+            if b == io_addr:
+                write(da, count)
+                db = mem[b]
+            elif b == inspect_addr:
+                if inspect is None:
+                    out.flush()
+                    print(f" < {da:5d}, {da:6x}, {da:16b}")
+                else:
+                    inspect(da)
+                db = mem[b]
+            else:
+                db = (mem[b] - da) & WORD_MASK
+                mem[b] = db
+
+            if db == 0 or db & SIGN_BIT:
+                if c == halt_addr:
+                    return HALTED, count
+                pc = c
+                if count >= limit:
+                    return pc, count
+                continue
+            pc = (pc + 3) & WORD_MASK
+    except IndexError:
+        if len(mem) <= WORD_MASK or pc + 2 <= WORD_MASK:
+            raise
+        # the instruction wraps past the top of memory; left to the exception so
+        # that the loop above carries no check for it
+        try:
+            return step_wrapped(mem, pc, count - 1, out, inp, inspect)
+        except park:
+            return pc, count - 1
+
+
+def step_wrapped(
+    mem: list[int],
+    pc: int,
+    count: int,
+    out: OutputDevice,
+    inp: InputDevice,
+    inspect: Callable[[int], None] | None = None,
+) -> tuple[int, int]:
+    """Execute the one instruction at `pc` whose words wrap around to address 0.
+
+    `count` is the number of instructions executed before it. Returns the next
+    pc (or `HALTED`) and the new count, like the engine loops.
+    """
+    a, b, c = mem[pc], mem[(pc + 1) & WORD_MASK], mem[(pc + 2) & WORD_MASK]
+    count += 1
+    if a == const.IO_ADDR:
+        try:
+            da = -inp.read(count) & WORD_MASK
+        except EOFError:
+            return HALTED, count - 1
+    else:
+        da = mem[a]
+    if b == const.IO_ADDR:
+        out.write(da, count)
+        db = mem[b]
+    elif b == const.INSPECT_ADDR:
+        if inspect is None:
+            out.flush()
+            print(f" < {da:5d}, {da:6x}, {da:16b}")
+        else:
+            inspect(da)
+        db = mem[b]
+    else:
+        db = (mem[b] - da) & WORD_MASK
+        mem[b] = db
+    if db == 0 or db & SIGN_BIT:
+        return (HALTED if c == const.HALT_ADDR else c), count
+    return (pc + 3) & WORD_MASK, count
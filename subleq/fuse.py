@@ -0,0 +1,230 @@
+# noqa: INP001
+"""Superinstruction engine: the standard macro idioms run as single fused operations.
+
+At load time the image is scanned for the instruction shapes emitted by
+`clr!` (`a a ?`), `jmp!` (`z z L`), `add!` (`a z; z b; z;`) and `cpy!`
+(`b; a z; z b; z;`). Patterns whose words are written by another fused pattern,
+or by any store `analysis.analyze` finds, are never fused, and every fused word
+is guarded: a write to it from the generic path unfuses the patterns covering
+it, so self-modified code runs unfused.
+"""
+
+import numpy as np
+
+from . import const
+from .analysis import analyze
+from .devices import InputDevice, OutputDevice, PromptInput
+from .fast import SIGN_BIT, WORD_MASK, step_wrapped
+from .watchdog import HALTED, Watchdog, run_sliced
+
+CLR = 1
+JMP = 2
+ADD = 3
+CPY = 4
+
+PATTERN_LEN = {CLR: 1, JMP: 1, ADD: 3, CPY: 4}
+MAX_PATTERN_WORDS = 3 * max(PATTERN_LEN.values())
+
+
+def subleq_fused(
+    data: np.ndarray,
+    labels: dict[str, int],  # noqa: ARG001
+    out: OutputDevice | None = None,
+    inp: InputDevice | None = None,
+    pc: int = 0,
+    count: int = 0,
+    watchdog: Watchdog | None = None,
+) -> int:
+    """Emulate a subleq computer, running recognised macro idioms as one operation."""
+    out = out or OutputDevice()
+    inp = inp or PromptInput(on_block=out.on_input)
+    fused, guard = find_superinstructions(data, pc)
+    mem = data.tolist()
+    try:
+        return run_sliced(
+            lambda pc, count, limit: _run(mem, fused, guard, out, inp, pc, count, limit),
+            pc,
+            count,
+            watchdog,
+        )
+    finally:
+        data[:] = mem
+        out.flush()
+
+
+def find_superinstructions(data: np.ndarray, entry: int = 0) -> tuple[list[tuple | None], bytearray]:
+    """Find fusable patterns in an image run from `entry`.
+
+    Returns a table indexed by pc holding `(kind, *operands)` or None, and a
+    per-word count of the fused patterns covering each word.
+    """
+    n = len(data)
+    w = np.zeros(n + MAX_PATTERN_WORDS, dtype=np.int64)
+    w[:n] = data
+    p = np.arange(n, dtype=np.int64)
+    a, b, c = w[:n], w[1 : n + 1], w[2 : n + 2]
+
+    # a single instruction that can be fused at p: in the image and no I/O
+    ok = (p + 3 <= n) & (a != const.IO_ADDR) & (b != const.IO_ADDR) & (b != const.INSPECT_ADDR)
+    ok = np.concatenate([ok, np.zeros(MAX_PATTERN_WORDS, dtype=bool)])
+    falls = c == p + 3
+    single = ok[:n] & (a == b)
+
+    def at(x: np.ndarray, k: int) -> np.ndarray:
+        """`x` for the instruction k instructions after p."""
+        return np.concatenate([x, np.zeros(3 * k, dtype=x.dtype)])[3 * k : 3 * k + n]
+
+    clr = single & falls
+    jmp = single & ~falls
+    add = (
+        ok[:n]
+        & at(ok, 1)
+        & at(ok, 2)
+        & falls
+        & at(falls, 1)
+        & at(falls, 2)
+        & (a != b)  # a z
+        & (at(a, 1) == b)  # z b
+        & (at(b, 1) != b)
+        & (at(a, 2) == b)  # z z
+        & (at(b, 2) == b)
+    )
+    cpy = clr & at(add, 1) & (at(b, 2) == a)
+
+    # longer patterns win at the same pc
+    kinds = np.zeros(n, dtype=np.int64)
+    kinds[jmp] = JMP
+    kinds[clr] = CLR
+    kinds[add] = ADD
+    kinds[cpy] = CPY
+    starts = np.nonzero(kinds)[0]
+    lengths = 3 * np.array([PATTERN_LEN.get(k, 0) for k in range(CPY + 1)])[kinds[starts]]
+
+    written = np.zeros(n + 1, dtype=bool)
+    written[:n] = analyze(data, entry).written[:n]
+    for targets in (a[clr | jmp], b[add], at(b, 1)[add]):
+        written[np.minimum(targets, n)] = True
+    written = np.concatenate([[0], np.cumsum(written[:n])])
+    keep = written[starts + lengths] == written[starts]
+    starts, lengths = starts[keep], lengths[keep]
+
+    cover = np.zeros(n + 1, dtype=np.int64)
+    np.add.at(cover, starts, 1)
+    np.add.at(cover, starts + lengths, -1)
+    guard = bytearray(np.cumsum(cover[:n]).astype(np.uint8).tobytes())
+
+    fused = [None] * n
+    for pc in starts.tolist():
+        kind = int(kinds[pc])
+        if kind in (CLR, JMP):
+            fused[pc] = (kind, int(a[pc]), int(c[pc]))
+        elif kind == ADD:
+            fused[pc] = (kind, int(a[pc]), int(b[pc]), int(b[pc + 3]))
+        else:
+            fused[pc] = (kind, int(a[pc + 3]), int(b[pc + 3]), int(a[pc]))
+    return fused, guard
+
+
+def _unfuse(fused: list[tuple | None], guard: bytearray, addr: int) -> None:
+    """Drop every fused pattern covering `addr`."""
+    for pc in range(max(0, addr - MAX_PATTERN_WORDS + 1), addr + 1):
+        op = fused[pc]
+        if op is None:
+            continue
+        end = pc + 3 * PATTERN_LEN[op[0]]
+        if addr < end:
+            fused[pc] = None
+            for i in range(pc, end):
+                guard[i] -= 1
+
+
+def _run(
+    mem: list[int],
+    fused: list[tuple | None],
+    guard: bytearray,
+    out: OutputDevice,
+    inp: InputDevice,
+    pc: int,
+    count: int,
+    limit: int,
+) -> tuple[int, int]:
+    write = out.write
+    read = inp.read
+    io_addr = const.IO_ADDR
+    inspect_addr = const.INSPECT_ADDR
+    halt_addr = const.HALT_ADDR
+
+    try:
+        while True:
+            op = fused[pc]
+            if op is not None:
+                kind = op[0]
+                if kind == ADD:
+                    _, src, z, dst = op
+                    t = (mem[z] - mem[src]) & WORD_MASK
+                    mem[z] = t
+                    mem[dst] = (mem[dst] - t) & WORD_MASK
+                    mem[z] = 0
+                    count += 3
+                    pc += 9
+                elif kind == CPY:
+                    _, src, z, dst = op
+                    mem[dst] = 0
+                    t = (mem[z] - mem[src]) & WORD_MASK
+                    mem[z] = t
+                    mem[dst] = (mem[dst] - t) & WORD_MASK
+                    mem[z] = 0
+                    count += 4
+                    pc += 12
+                elif kind == CLR:
+                    mem[op[1]] = 0
+                    count += 1
+                    pc += 3
+                else:
+                    mem[op[1]] = 0
+                    count += 1
+                    if op[2] == halt_addr:
+                        return HALTED, count
+                    pc = op[2]
+                    if count >= limit:
+                        return pc, count
+                continue
+
+            count += 1
+            a = mem[pc]
+            b = mem[pc + 1]
+            c = mem[pc + 2]
+
+            if a == io_addr:
+                try:
+                    da = -read(count) & WORD_MASK
+                except EOFError:
+                    return HALTED, count - 1  # out of input: halt before the read
+            else:
+                da = mem[a]
+
+            if b == io_addr:
+                write(da, count)
+                db = mem[b]
+            elif b == inspect_addr:
+                out.flush()
+                print(f" < {da:5d}, {da:6x}, {da:16b}")
+                db = mem[b]
+            else:
+                db = (mem[b] - da) & WORD_MASK
+                mem[b] = db
+                if guard[b]:
+                    _unfuse(fused, guard, b)
+
+            if db == 0 or db & SIGN_BIT:
+                if c == halt_addr:
+                    return HALTED, count
+                pc = c
+                if count >= limit:
+                    return pc, count
+                continue
+            pc = (pc + 3) & WORD_MASK
+    except IndexError:
+        if len(mem) <= WORD_MASK or pc + 2 <= WORD_MASK:
+            raise
+        return step_wrapped(mem, pc, count - 1, out, inp)
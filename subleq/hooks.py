@@ -0,0 +1,204 @@
+# noqa: INP001
+"""Instrumentation hooks: callbacks on instructions, writes, branches, I/O and halt.
+
+Subclass `Hooks` and override the `on_*` methods you need; `subleq_hooked` runs
+the fast loop with calls to exactly those. The loop is generated for the set
+of overridden methods when the run starts, so an event nobody listens to has
+no code in it at all, not even a flag test::
+
+    class Coverage(Hooks):
+        def __init__(self) -> None:
+            self.seen = set()
+
+        def on_instruction(self, count, pc, a, b, c):
+            self.seen.add(pc)
+
+`run --hook module:Coverage` builds hooks from the command line.
+"""
+
+import importlib
+from collections.abc import Callable, Iterable
+
+import numpy as np
+
+from . import const
+from .devices import InputDevice, OutputDevice, PromptInput
+from .fast import SIGN_BIT, WORD_MASK
+from .watchdog import HALTED, Watchdog, run_sliced
+
+EVENTS = ("instruction", "write", "branch", "read", "output", "halt")
+
+
+class Hooks:
+    """Base class for instrumentation; every method is a no-op that costs nothing unless overridden."""
+
+    def on_instruction(self, count: int, pc: int, a: int, b: int, c: int) -> None:
+        """Instruction number `count` at `pc` is executing (its operands are read, nothing written yet)."""
+
+    def on_write(self, count: int, addr: int, old: int, new: int) -> None:
+        """Instruction number `count` stored `new` at `addr`, which held `old`."""
+
+    def on_branch(self, count: int, pc: int, target: int) -> None:
+        """The instruction at `pc` took its branch to `target` (a branch to HALT is `on_halt`)."""
+
+    def on_read(self, count: int, value: int) -> None:
+        """Instruction number `count` read `value` from the input device."""
+
+    def on_output(self, count: int, value: int) -> None:
+        """Instruction number `count` wrote `value` to the output device."""
+
+    def on_halt(self, count: int, pc: int) -> None:
+        """The machine halted at `pc` after `count` instructions (also when input ran out)."""
+
+
+def callbacks(hooks: Iterable[Hooks]) -> dict[str, list[Callable]]:
+    """Per event, the bound methods of `hooks` that override the `Hooks` no-ops."""
+    found = {event: [] for event in EVENTS}
+    for hook in hooks:
+        for event in EVENTS:
+            name = f"on_{event}"
+            if getattr(type(hook), name, None) is not getattr(Hooks, name):
+                found[event].append(getattr(hook, name))
+    return found
+
+
+def load_hook(spec: str) -> Hooks:
+    """Instantiate `module:Class` (or any callable returning hooks) with no arguments."""
+    module, _, name = spec.partition(":")
+    if not name:
+        msg = f"hook {spec!r} is not module:name"
+        raise ValueError(msg)
+    return getattr(importlib.import_module(module), name)()
+
+
+def subleq_hooked(
+    data: np.ndarray,
+    labels: dict[str, int],  # noqa: ARG001
+    out: OutputDevice | None = None,
+    inp: InputDevice | None = None,
+    pc: int = 0,
+    count: int = 0,
+    watchdog: Watchdog | None = None,
+    hooks: Iterable[Hooks] = (),
+) -> int:
+    """`fast.subleq_fast` calling the overridden methods of every object in `hooks`."""
+    out = out or OutputDevice()
+    inp = inp or PromptInput(on_block=out.on_input)
+    mem = data.tolist()
+    run = _build(callbacks(hooks), mem, out, inp)
+    try:
+        return run_sliced(run, pc, count, watchdog)
+    finally:
+        data[:] = mem
+        out.flush()
+
+
+# compiled loops by the number of callbacks per event
+_code: dict[tuple[int, ...], object] = {}
+
+
+def _build(found: dict[str, list[Callable]], mem: list[int], out: OutputDevice, inp: InputDevice) -> Callable:
+    """The generated loop, bound to these callbacks and devices."""
+    key = tuple(len(found[event]) for event in EVENTS)
+    code = _code.get(key)
+    if code is None:
+        source = _gen_loop(key, wrapped=False) + _gen_loop(key, wrapped=True)
+        code = _code[key] = compile(source, f"<subleq hooks {key}>", "exec")
+    namespace = {
+        "mem": mem,
+        "out": out,
+        "inp": inp,
+        "HALTED": HALTED,
+        **{f"{event}_{i}": f for event in EVENTS for i, f in enumerate(found[event])},
+    }
+    exec(code, namespace)  # noqa: S102
+    return namespace["loop"]
+
+
+def _calls(key: tuple[int, ...], event: str, args: str, indent: str) -> list[str]:
+    return [f"{indent}{event}_{i}({args})" for i in range(key[EVENTS.index(event)])]
+
+
+def _gen_loop(key: tuple[int, ...], *, wrapped: bool) -> str:
+    """Source of the fast loop with the callbacks of `key` (callback counts per event) inlined.
+
+    `wrapped` generates `step_wrapped`, which runs the single instruction whose
+    words wrap past the top of memory; the loop hands that one over to it.
+    """
+    on = dict(zip(EVENTS, key, strict=True))
+    ind = " " * (8 if wrapped else 12)
+    if wrapped:
+        lines = [
+            "def step_wrapped(pc, count):",
+            "    write = out.write",
+            "    read = inp.read",
+            "    if True:",
+            "        count += 1",
+            "        a = mem[pc]",
+            f"        b = mem[(pc + 1) & {WORD_MASK}]",
+            f"        c = mem[(pc + 2) & {WORD_MASK}]",
+        ]
+    else:
+        lines = [
+            "def loop(pc, count, limit):",
+            "    write = out.write",
+            "    read = inp.read",
+            "    try:",
+            "        while True:",
+            "            count += 1",
+            "            a = mem[pc]",
+            "            b = mem[pc + 1]",
+            "            c = mem[pc + 2]",
+        ]
+    lines += [
+        f"{ind}if a == {const.IO_ADDR}:",
+        f"{ind}    try:",
+        f"{ind}        value = read(count)",
+        f"{ind}    except EOFError:",
+        *_calls(key, "halt", "count - 1, pc", ind + "        "),
+        f"{ind}        return HALTED, count - 1  # out of input: halt before the read",
+        *_calls(key, "read", "count, value", ind + "    "),
+        f"{ind}    da = -value & {WORD_MASK}",
+        f"{ind}else:",
+        f"{ind}    da = mem[a]",
+        *_calls(key, "instruction", "count, pc, a, b, c", ind),
+        f"{ind}if b == {const.IO_ADDR}:",
+        *_calls(key, "output", "count, da", ind + "    "),
+        f"{ind}    write(da, count)",
+        f"{ind}    db = mem[b]",
+        f"{ind}elif b == {const.INSPECT_ADDR}:",
+        f"{ind}    out.flush()",
+        f'{ind}    print(f" < {{da:5d}}, {{da:6x}}, {{da:16b}}")',
+        f"{ind}    db = mem[b]",
+        f"{ind}else:",
+        f"{ind}    db = (mem[b] - da) & {WORD_MASK}",
+    ]
+    if on["write"]:
+        lines.append(f"{ind}    old = mem[b]")
+    lines += [
+        f"{ind}    mem[b] = db",
+        *_calls(key, "write", "count, b, old, db", ind + "    "),
+        f"{ind}if db == 0 or db & {SIGN_BIT}:",
+        f"{ind}    if c == {const.HALT_ADDR}:",
+        *_calls(key, "halt", "count, pc", ind + "        "),
+        f"{ind}        return HALTED, count",
+        *_calls(key, "branch", "count, pc, c", ind + "    "),
+    ]
+    if wrapped:
+        lines += [
+            f"{ind}    return c, count",
+            f"{ind}return (pc + 3) & {WORD_MASK}, count",
+        ]
+    else:
+        lines += [
+            f"{ind}    pc = c",
+            f"{ind}    if count >= limit:",
+            f"{ind}        return pc, count",
+            f"{ind}    continue",
+            f"{ind}pc = (pc + 3) & {WORD_MASK}",
+            "    except IndexError:",
+            f"        if len(mem) <= {WORD_MASK} or pc + 2 <= {WORD_MASK}:",
+            "            raise",
+            "        return step_wrapped(pc, count - 1)",
+        ]
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,152 @@
+# noqa: INP001
+"""Self-describing subleq image files.
+
+Layout (little endian)::
+
+    header    magic, version, word width, entry point, memory size (words),
+              offset of the word array, offset/size of the symbol table and of
+              the source map
+    words     page aligned, so the array can be memory-mapped as is
+    symbols   JSON {label: address}
+    source    JSON source map (may be empty)
+
+Images compiled before this format (`.npy` plus an optional `.labels` file)
+load through the same interface.
+"""
+
+import json
+import struct
+from dataclasses import dataclass, field
+from functools import cached_property
+from pathlib import Path
+
+import numpy as np
+
+MAGIC = b"SUBLEQ\x00\x00"
+VERSION = 1
+PAGE_SIZE = 4096
+SUFFIX = ".sqi"
+
+_HEADER = struct.Struct("<8sHHIIQQQQQ")
+_DTYPES = {16: np.dtype("<u2")}
+
+
+class ImageError(Exception):
+    """Malformed or unsupported image file."""
+
+
+@dataclass
+class Image:
+    """A loaded image: the word array plus lazily read metadata."""
+
+    words: np.ndarray
+    entry: int = 0
+    word_bits: int = 16
+    path: Path | None = None
+    _sections: dict[str, tuple[int, int]] = field(default_factory=dict, repr=False)
+
+    @cached_property
+    def labels(self) -> dict[str, int]:
+        """The symbol table, read from disk on first use."""
+        return self._read_json("symbols", {})
+
+    @cached_property
+    def source_map(self) -> dict:
+        """The source map, read from disk on first use."""
+        return self._read_json("source", {})
+
+    def _read_json(self, section: str, default: dict | list) -> dict | list:
+        if self.path is None:
+            return default
+        if section not in self._sections:
+            # images saved as .npy keep their labels next to them
+            legacy = self.path.with_suffix(".labels")
+            if section == "symbols" and legacy.exists():
+                return json.loads(legacy.read_text())
+            return default
+        offset, size = self._sections[section]
+        if not size:
+            return default
+        with self.path.open("rb") as fp:
+            fp.seek(offset)
+            return json.loads(fp.read(size))
+
+
+def save_image(
+    path: Path,
+    words: np.ndarray,
+    labels: dict[str, int],
+    entry: int = 0,
+    source_map: dict | None = None,
+) -> None:
+    """Write `words` and their metadata as an image file."""
+    symbols = json.dumps(labels).encode()
+    source = json.dumps(source_map).encode() if source_map else b""
+    body = np.ascontiguousarray(words, dtype=_DTYPES[16]).tobytes()
+
+    words_offset = PAGE_SIZE
+    symbols_offset = words_offset + len(body)
+    source_offset = symbols_offset + len(symbols)
+    header = _HEADER.pack(
+        MAGIC,
+        VERSION,
+        16,
+        entry,
+        len(words),
+        words_offset,
+        symbols_offset,
+        len(symbols),
+        source_offset,
+        len(source),
+    )
+    with path.open("wb") as fp:
+        fp.write(header.ljust(words_offset, b"\x00"))
+        fp.write(body)
+        fp.write(symbols)
+        fp.write(source)
+
+
+def load_image(path: Path) -> Image:
+    """Open an image file without reading its words or metadata.
+
+    The words are memory-mapped copy-on-write: the engine can write to them
+    without touching the file. `.npy` images are loaded with `np.load`.
+    """
+    with path.open("rb") as fp:
+        head = fp.read(_HEADER.size)
+    if not head.startswith(MAGIC):
+        if path.suffix == ".npy":
+            return Image(np.load(path), path=path)
+        msg = f"{path} is not a subleq image"
+        raise ImageError(msg)
+
+    (
+        _,
+        version,
+        word_bits,
+        entry,
+        size,
+        words_offset,
+        symbols_offset,
+        symbols_size,
+        source_offset,
+        source_size,
+    ) = _HEADER.unpack(head)
+    if version != VERSION:
+        msg = f"{path}: unsupported image version {version}"
+        raise ImageError(msg)
+    if word_bits not in _DTYPES:
+        msg = f"{path}: unsupported word width {word_bits}"
+        raise ImageError(msg)
+
+    words = np.memmap(path, dtype=_DTYPES[word_bits], mode="c", offset=words_offset, shape=(size,))
+    return Image(
+        words,
+        entry=entry,
+        word_bits=word_bits,
+        path=path,
+        _sections={
+            "symbols": (symbols_offset, symbols_size),
+            "source": (source_offset, source_size),
+        },
+    )
@@ -0,0 +1,183 @@
+# noqa: INP001
+"""Binary I/O logs for deterministic record and replay.
+
+A log is a header followed by fixed-size little-endian records::
+
+    kind (u8)   INPUT, OUTPUT, EOF or END
+    value (u16) the word read or written (0 for EOF and END)
+    count (u64) number of the instruction doing the I/O (total for END)
+
+`--record` wraps the run's devices to append a record per read and write;
+`--replay` feeds the recorded input back and raises `ReplayMismatch` at the
+first read or write that differs from the log.
+"""
+
+import struct
+from pathlib import Path
+from typing import BinaryIO
+
+from .devices import InputDevice, OutputDevice
+
+MAGIC = b"SQIOLOG\x00"
+VERSION = 1
+
+INPUT = 1
+OUTPUT = 2
+EOF = 3
+END = 4
+
+_HEADER = struct.Struct("<8sH")
+_RECORD = struct.Struct("<BHQ")
+_KIND_NAMES = {INPUT: "input", OUTPUT: "output", EOF: "end of input", END: "halt"}
+
+
+class ReplayMismatch(Exception):  # noqa: N818
+    """The replayed run did I/O the recorded run did not."""
+
+
+class IoLogWriter:
+    """Appends records to a log file."""
+
+    def __init__(self, path: Path) -> None:
+        self.fp: BinaryIO = path.open("wb")
+        self.fp.write(_HEADER.pack(MAGIC, VERSION))
+
+    def record(self, kind: int, value: int, count: int) -> None:
+        self.fp.write(_RECORD.pack(kind, value, count))
+
+    def close(self, count: int | None = None) -> None:
+        """Finish the log; `count` is the final instruction count if the run halted."""
+        if count is not None:
+            self.record(END, 0, count)
+        self.fp.close()
+
+
+def read_log(path: Path) -> list[tuple[int, int, int]]:
+    """All (kind, value, count) records of a log."""
+    data = path.read_bytes()
+    magic, version = _HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        msg = f"{path} is not a version {VERSION} I/O log"
+        raise ValueError(msg)
+    return list(_RECORD.iter_unpack(data[_HEADER.size :]))
+
+
+class RecordingInput(InputDevice):
+    """Passes reads through to `inner`, logging each one."""
+
+    def __init__(self, inner: InputDevice, log: IoLogWriter) -> None:
+        super().__init__(inner.on_block)
+        self.inner = inner
+        self.log = log
+
+    def read(self, count: int = 0) -> int:
+        try:
+            value = self.inner.read(count)
+        except EOFError:
+            self.log.record(EOF, 0, count)
+            raise
+        self.log.record(INPUT, value & 0xFFFF, count)
+        return value
+
+    @property
+    def offset(self) -> int:
+        return getattr(self.inner, "offset", 0)
+
+    @offset.setter
+    def offset(self, offset: int) -> None:
+        self.inner.offset = offset
+
+    def pending(self) -> tuple[list[int], bytes]:
+        return self.inner.pending()
+
+    def restore(self, words: list[int], raw: bytes = b"") -> None:
+        self.inner.restore(words, raw)
+
+
+class RecordingOutput(OutputDevice):
+    """Passes writes through to `inner`, logging each one."""
+
+    def __init__(self, inner: OutputDevice, log: IoLogWriter) -> None:  # noqa: D107
+        self.inner = inner
+        self.log = log
+
+    def write(self, value: int, count: int = 0) -> None:
+        self.log.record(OUTPUT, value, count)
+        self.inner.write(value, count)
+
+    def __getattr__(self, name: str):  # noqa: ANN204
+        return getattr(self.inner, name)
+
+    def on_input(self) -> None:
+        self.inner.on_input()
+
+    def flush(self) -> None:
+        self.inner.flush()
+
+
+class Replay:
+    """The recorded I/O of one run, consumed in order by the replay devices."""
+
+    def __init__(self, records: list[tuple[int, int, int]]) -> None:
+        self.records = records
+        self.pos = 0
+
+    def expect(self, kind: int, value: int, count: int) -> None:
+        """Check that the next record is this one."""
+        if self.pos == len(self.records):
+            got = "nothing"
+        else:
+            got = self.records[self.pos]
+            if got == (kind, value, count):
+                self.pos += 1
+                return
+            got = f"{_KIND_NAMES[got[0]]} {got[1]} at instruction {got[2]}"
+        msg = (
+            f"replay diverged at record {self.pos}: {_KIND_NAMES[kind]} {value} at "
+            f"instruction {count}, recorded {got}"
+        )
+        raise ReplayMismatch(msg)
+
+    def next_kind(self) -> int | None:
+        return self.records[self.pos][0] if self.pos < len(self.records) else None
+
+    def finish(self, count: int) -> None:
+        """Check that the run halted where the recorded run did."""
+        if self.next_kind() == END:
+            self.expect(END, 0, count)
+        if self.pos != len(self.records):
+            kind, value, at = self.records[self.pos]
+            msg = f"replay ended early: recorded {_KIND_NAMES[kind]} {value} at instruction {at} not reached"
+            raise ReplayMismatch(msg)
+
+
+class ReplayInput(InputDevice):
+    """Feeds the recorded input back, checking each read happens where it did."""
+
+    def __init__(self, replay: Replay) -> None:
+        super().__init__()
+        self.replay = replay
+
+    def read(self, count: int = 0) -> int:
+        replay = self.replay
+        if replay.next_kind() == EOF:
+            replay.expect(EOF, 0, count)
+            raise EOFError
+        if replay.next_kind() != INPUT:
+            replay.expect(INPUT, 0, count)  # raises
+        value = replay.records[replay.pos][1]
+        replay.expect(INPUT, value, count)
+        self.consumed += 1
+        return value
+
+
+class ReplayOutput(RecordingOutput):
+    """Passes writes through to `inner`, checking each against the log."""
+
+    def __init__(self, inner: OutputDevice, replay: Replay) -> None:  # noqa: D107
+        self.inner = inner
+        self.replay = replay
+
+    def write(self, value: int, count: int = 0) -> None:
+        self.replay.expect(OUTPUT, value, count)
+        self.inner.write(value, count)
@@ -0,0 +1,344 @@
+# noqa: INP001
+"""Basic-block JIT subleq engine.
+
+Hot straight-line runs of instructions are turned into Python functions with
+`compile`/`exec` and cached by entry pc. Operands are baked into the generated
+code, so a per-page bitmap marks the pages holding compiled code and any write
+into one of them invalidates the blocks whose words it overwrites.
+
+Blocks only take instructions whose words `analysis.analyze` found no fixed
+store to, so a generated store to a word it did find never needs the check.
+Other generated writes to pages that have never held code skip it too; the
+block is listed as an unchecked writer of that page instead and is evicted (and
+later recompiled with the check) once code lands on the page.
+
+Devices are those of a `bus.Bus` (default: `default_bus`): an instruction
+naming a device word calls its `load` or `store` from the block, every other
+generated instruction runs with no device checks.
+"""
+
+import numpy as np
+
+from . import const
+from .analysis import analyze
+from .bus import Bus, default_bus
+from .devices import InputDevice, OutputDevice, PromptInput
+from .fast import SIGN_BIT, WORD_MASK
+from .loops import CountedLoop, find_counted_loop
+from .watchdog import HALTED, Watchdog, run_sliced
+
+PAGE_BITS = 4
+DEFAULT_HOT_THRESHOLD = 8
+MAX_BLOCK_LEN = 64
+MAX_INVALIDATIONS = 4
+
+
+def subleq_jit(
+    data: np.ndarray,
+    labels: dict[str, int],  # noqa: ARG001
+    out: OutputDevice | None = None,
+    inp: InputDevice | None = None,
+    hot_threshold: int = DEFAULT_HOT_THRESHOLD,
+    pc: int = 0,
+    count: int = 0,
+    watchdog: Watchdog | None = None,
+    bus: Bus | None = None,
+) -> int:
+    """Emulate a subleq computer, compiling hot basic blocks to Python.
+
+    `bus` holds the devices (default: `default_bus`).
+    """
+    out = out or OutputDevice()
+    inp = inp or PromptInput(on_block=out.on_input)
+    bus = bus or default_bus()
+    written = bytearray(analyze(data, pc, frozenset(bus.stores)).written)
+    mem = data.tolist()
+    bus.attach(mem, out, inp)
+    try:
+        return run_sliced(BlockJit(mem, bus, hot_threshold, written).run, pc, count, watchdog)
+    finally:
+        data[:] = mem
+        bus.flush()
+        out.flush()
+
+
+class BlockJit:
+    """Block cache, invalidation bookkeeping and dispatch loop over `mem`, with the devices of `bus` attached to it."""
+
+    def __init__(
+        self,
+        mem: list[int],
+        bus: Bus,
+        hot_threshold: int = DEFAULT_HOT_THRESHOLD,
+        written: bytearray | None = None,
+    ) -> None:
+        self.mem = mem
+        self.loads = bus.loads
+        self.stores = bus.stores
+        self.ports = frozenset(bus.stores)
+        self.is_load = bytearray(len(mem))
+        self.is_store = bytearray(len(mem))
+        for addr in bus.loads:
+            self.is_load[addr] = 1
+        for addr in bus.stores:
+            self.is_store[addr] = 1
+        self.hot_threshold = hot_threshold
+        # words stores through fixed operands can reach, see `analysis.Analysis.written`
+        self.written = written if written is not None else bytearray(len(mem))
+        self.blocks = {}
+        self.ranges = {}
+        self.heat = {}
+        self.invalidations = {}
+        self.page_blocks = {}
+        self.unchecked_writers = {}
+        self.code_pages = bytearray((len(mem) >> PAGE_BITS) + 1)
+        self.seen_pages = bytearray(len(self.code_pages))
+
+    def run(self, pc: int, count: int, limit: int) -> tuple[int, int]:
+        """Run from `pc` until HALT or until `count` reaches `limit` at a block exit."""
+        blocks = self.blocks
+        heat = self.heat
+        hot_threshold = self.hot_threshold
+
+        while pc != HALTED and count < limit:
+            block = blocks.get(pc)
+            if block is None:
+                h = heat.get(pc, 0) + 1
+                heat[pc] = h
+                if h >= hot_threshold:
+                    block = self.compile(pc)
+            if block is not None:
+                pc, n = block(count)
+            else:
+                pc, n = self.interpret(pc, count)
+            count += n
+        return pc, count
+
+    def interpret(self, pc: int, base: int) -> tuple[int, int]:
+        """Step from `pc` until a branch leaves the straight-line path.
+
+        `base` is the instruction count so far, passed on to the devices.
+        """
+        mem = self.mem
+        code_pages = self.code_pages
+        invalidate = self.invalidate
+        loads = self.loads
+        stores = self.stores
+        is_load = self.is_load
+        is_store = self.is_store
+        halt_addr = const.HALT_ADDR
+
+        count = 0
+        try:
+            while True:
+                count += 1
+                a = mem[pc]
+                b = mem[pc + 1]
+                c = mem[pc + 2]
+
+                if is_load[a]:
+                    try:
+                        da = loads[a](base + count)
+                    except EOFError:
+                        return HALTED, count - 1  # out of input: halt before the read
+                else:
+                    da = mem[a]
+
+                if is_store[b]:
+                    stores[b](da, base + count)
+                    db = mem[b]
+                else:
+                    db = (mem[b] - da) & WORD_MASK
+                    mem[b] = db
+                    if code_pages[b >> PAGE_BITS]:
+                        invalidate(b)
+
+                nxt = (pc + 3) & WORD_MASK
+                if db == 0 or db & SIGN_BIT:
+                    if c == halt_addr:
+                        return HALTED, count
+                    if c != nxt:
+                        return c, count
+                pc = nxt
+        except IndexError:
+            if len(mem) <= WORD_MASK or pc + 2 <= WORD_MASK:
+                raise
+            pc, executed = self._step_wrapped(pc, base + count - 1)
+            return pc, executed - base
+
+    def _step_wrapped(self, pc: int, count: int) -> tuple[int, int]:
+        """`fast.step_wrapped` through the bus: the one instruction at `pc` whose words wrap around."""
+        mem = self.mem
+        a, b, c = mem[pc], mem[(pc + 1) & WORD_MASK], mem[(pc + 2) & WORD_MASK]
+        count += 1
+        if self.is_load[a]:
+            try:
+                da = self.loads[a](count)
+            except EOFError:
+                return HALTED, count - 1
+        else:
+            da = mem[a]
+        if self.is_store[b]:
+            self.stores[b](da, count)
+            db = mem[b]
+        else:
+            db = (mem[b] - da) & WORD_MASK
+            mem[b] = db
+            if self.code_pages[b >> PAGE_BITS]:
+                self.invalidate(b)
+        if db == 0 or db & SIGN_BIT:
+            return (HALTED if c == const.HALT_ADDR else c), count
+        return (pc + 3) & WORD_MASK, count
+
+    def compile(self, entry: int):  # noqa: ANN201
+        """Compile the block starting at `entry`, or None if it cannot be compiled."""
+        if self.invalidations.get(entry, 0) >= MAX_INVALIDATIONS:
+            return None
+        instructions = self._scan(entry)
+        if not instructions:
+            self.invalidations[entry] = MAX_INVALIDATIONS
+            return None
+
+        end = instructions[-1][0] + 3
+        self.ranges[entry] = (entry, end)
+        for page in range(entry >> PAGE_BITS, ((end - 1) >> PAGE_BITS) + 1):
+            self.page_blocks.setdefault(page, set()).add(entry)
+            self.code_pages[page] = 1
+            if not self.seen_pages[page]:
+                self.seen_pages[page] = 1
+                for writer in list(self.unchecked_writers.pop(page, ())):
+                    self._evict(writer)
+
+        written = self.written
+        ports = self.ports
+        unchecked = {b >> PAGE_BITS for _, _, b, _ in instructions if not written[b] and b not in ports}
+        unchecked = {page for page in unchecked if not self.seen_pages[page]}
+        for page in unchecked:
+            self.unchecked_writers.setdefault(page, set()).add(entry)
+
+        source = _gen_block(entry, instructions, unchecked, written, (frozenset(self.loads), ports))
+        namespace = {"m": self.mem, "cp": self.code_pages, "inv": self.invalidate, "ld": self.loads, "st": self.stores}
+        exec(compile(source, f"<subleq block {entry}>", "exec"), namespace)  # noqa: S102
+        block = namespace[f"block_{entry}"]
+        loop = find_counted_loop(self.mem, entry, ports)
+        if loop is not None and loop.end == end:
+            block = self._accelerate(loop, block)
+        self.blocks[entry] = block
+        return block
+
+    def _accelerate(self, loop: CountedLoop, block):  # noqa: ANN001, ANN202
+        """Wrap `block` so that it runs `loop` in closed form when it can."""
+        mem = self.mem
+        code_pages = self.code_pages
+        invalidate = self.invalidate
+        target = HALTED if loop.exit == const.HALT_ADDR else loop.exit
+        written = [loop.counter, *loop.written]
+
+        def accelerated(count):  # noqa: ANN001, ANN202
+            n = loop.iterate(mem)
+            if n is None:
+                return block(count)
+            for addr in written:
+                if code_pages[addr >> PAGE_BITS]:
+                    invalidate(addr)
+            return target, n
+
+        return accelerated
+
+    def invalidate(self, addr: int) -> None:
+        """Drop every compiled block whose words include `addr`."""
+        page = addr >> PAGE_BITS
+        for entry in list(self.page_blocks.get(page, ())):
+            start, end = self.ranges[entry]
+            if start <= addr < end:
+                self.invalidations[entry] = self.invalidations.get(entry, 0) + 1
+                self._evict(entry)
+
+    def _evict(self, entry: int) -> None:
+        del self.blocks[entry]
+        start, end = self.ranges.pop(entry)
+        for page in range(start >> PAGE_BITS, ((end - 1) >> PAGE_BITS) + 1):
+            entries = self.page_blocks[page]
+            entries.discard(entry)
+            if not entries:
+                del self.page_blocks[page]
+                self.code_pages[page] = 0
+        for page, writers in list(self.unchecked_writers.items()):
+            writers.discard(entry)
+            if not writers:
+                del self.unchecked_writers[page]
+
+    def _scan(self, entry: int) -> list[tuple[int, int, int, int]]:
+        """Collect the (pc, a, b, c) instructions that make up the block at `entry`."""
+        mem = self.mem
+        size = len(mem)
+        is_store = self.is_store
+        patched = self.written
+
+        instructions = []
+        written = set()
+        pc = entry
+        while len(instructions) < MAX_BLOCK_LEN and pc + 2 < size:
+            if written.intersection((pc, pc + 1, pc + 2)):
+                break  # an earlier instruction of this block patches this one
+            if patched[pc] or patched[pc + 1] or patched[pc + 2]:
+                break  # some instruction of the program patches this one
+            a, b, c = mem[pc], mem[pc + 1], mem[pc + 2]
+            if a >= size or b >= size:
+                break
+            instructions.append((pc, a, b, c))
+            written.add(b)
+            if a == b and not is_store[b] and c != pc + 3:
+                break  # unconditional jump
+            pc += 3
+        return instructions
+
+
+def _gen_block(
+    entry: int,
+    instructions: list[tuple[int, int, int, int]],
+    unchecked: set[int],
+    written: bytearray,
+    devices: tuple[frozenset[int], frozenset[int]],
+) -> str:
+    """Generate the source of a block function taking the count so far and returning (next pc, executed count).
+
+    `devices` are the addresses loading and storing through the bus.
+    """
+    loads, stores = devices
+    used = [f"ld{a}=ld[{a}]" for a in sorted({a for _, a, _, _ in instructions if a in loads})]
+    used += [f"st{b}=st[{b}]" for b in sorted({b for _, _, b, _ in instructions if b in stores})]
+    lines = [f"def block_{entry}({', '.join(['count', 'm=m', 'cp=cp', 'inv=inv', *used])}):"]
+    for i, (pc, a, b, c) in enumerate(instructions, start=1):
+        target = HALTED if c == const.HALT_ADDR else c
+        lines.append(f"    # {pc}: {a} {b} {c}")
+        da = f"m[{a}]"
+        if a in loads:
+            lines += [
+                "    try:",
+                f"        r = ld{a}(count + {i})",
+                "    except EOFError:",
+                f"        return {HALTED}, {i - 1}  # out of input: halt before the read",
+            ]
+            da = "r"
+        if b in stores:
+            lines.append(f"    st{b}({da}, count + {i})")
+            lines.append(f"    v = m[{b}]")
+        elif a == b:
+            lines.append(f"    m[{b}] = 0")
+        else:
+            lines.append(f"    v = (m[{b}] - {da}) & {WORD_MASK}")
+            lines.append(f"    m[{b}] = v")
+        if b not in stores and not written[b] and b >> PAGE_BITS not in unchecked:
+            lines.append(f"    if cp[{b >> PAGE_BITS}]:")
+            lines.append(f"        inv({b})")
+        if c == pc + 3:
+            continue
+        if a == b and b not in stores:
+            lines.append(f"    return {target}, {i}")
+            return "\n".join(lines) + "\n"
+        lines.append(f"    if v == 0 or v & {SIGN_BIT}:")
+        lines.append(f"        return {target}, {i}")
+    pc = instructions[-1][0]
+    lines.append(f"    return {(pc + 3) & WORD_MASK}, {len(instructions)}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,132 @@
+# noqa: INP001
+"""Closed-form execution of counted loops such as the ones in `mul!` and `lshift!`.
+
+A counted loop has the shape::
+
+    L:  d cnt exit;       # header: cnt -= d, leave when cnt <= 0
+        ...               # body: straight-line, every branch falls through
+        z z L;            # tail: unconditional jump back to the header
+
+Every body instruction is `m[b] -= m[a]` modulo 2**16, so one trip through the
+body is an affine map over the cells it writes. Running k trips is that map's
+k-th power, computed by repeated squaring.
+"""
+
+from dataclasses import dataclass
+
+import numpy as np
+
+from .analysis import PORTS
+from .fast import SIGN_BIT, WORD_MASK
+
+MAX_BODY_LEN = 32
+MIN_TRIPS = 8
+MODULUS = WORD_MASK + 1
+
+
+@dataclass
+class CountedLoop:
+    """A loop whose body is an affine map and whose trip count is known on entry."""
+
+    header: int
+    end: int
+    step: int
+    counter: int
+    exit: int
+    body_len: int
+    cells: list[int]
+    written: list[int]
+    matrix: np.ndarray
+
+    def iterate(self, mem: list[int]) -> int | None:
+        """Run the loop to its exit in one step and return the instructions it took.
+
+        Returns None, leaving `mem` untouched, when the counter or step do not
+        give a positive trip count or the loop would exit too soon to pay off.
+        """
+        d = mem[self.step]
+        cnt = mem[self.counter]
+        if d == 0 or d & SIGN_BIT or cnt == 0 or cnt & SIGN_BIT:
+            return None
+        headers = -(-cnt // d)  # header executions, the last one exits
+        trips = headers - 1
+        if trips < MIN_TRIPS:
+            return None
+
+        x = np.array([mem[cell] for cell in self.cells] + [1], dtype=np.int64)
+        x = _matpow(self.matrix, trips) @ x % MODULUS
+        for cell, value in zip(self.cells, x[: len(self.written)].tolist(), strict=False):
+            mem[cell] = value
+        mem[self.counter] = (cnt - headers * d) & WORD_MASK
+        return headers + trips * self.body_len
+
+
+def find_counted_loop(mem: list[int], header: int, ports: frozenset[int] = PORTS) -> CountedLoop | None:
+    """Recognise a counted loop starting at `header`, or return None.
+
+    Loops naming a device word in `ports` (see `bus.Bus.stores`) are not counted loops.
+    """
+    size = len(mem)
+    if header + 2 >= size:
+        return None
+    step, counter, exit_ = mem[header : header + 3]
+    if step == counter or exit_ == header + 3 or step in ports or counter in ports:
+        return None
+    if step >= size or counter >= size:
+        return None
+
+    body = []
+    pc = header + 3
+    while True:
+        if len(body) >= MAX_BODY_LEN or pc + 2 >= size:
+            return None
+        a, b, c = mem[pc : pc + 3]
+        if a in ports or b in ports or a >= size or b >= size:
+            return None
+        body.append((a, b))
+        if a == b and c == header:
+            break  # tail
+        if c != pc + 3:
+            return None
+        pc += 3
+    end = pc + 3
+
+    written = sorted({b for _, b in body})
+    reads = {a for a, _ in body} | set(written)
+    if {step, counter} & reads:
+        return None
+    if any(header <= addr < end for addr in [counter, *written]):
+        return None  # self-modifying loop
+
+    cells = written + sorted(reads - set(written))
+    index = {cell: i for i, cell in enumerate(cells)}
+    n = len(cells) + 1
+
+    # symbolic execution: each cell's value as a row over the entry values
+    exprs = {cell: np.eye(n, dtype=np.int64)[index[cell]] for cell in cells}
+    for a, b in body:
+        exprs[b] = (exprs[b] - exprs[a]) % MODULUS
+    matrix = np.stack([exprs[cell] for cell in cells] + [np.eye(n, dtype=np.int64)[-1]])
+
+    return CountedLoop(
+        header=header,
+        end=end,
+        step=step,
+        counter=counter,
+        exit=exit_,
+        body_len=len(body),
+        cells=cells,
+        written=written,
+        matrix=matrix,
+    )
+
+
+def _matpow(matrix: np.ndarray, k: int) -> np.ndarray:
+    """`matrix ** k` modulo 2**16."""
+    result = np.eye(len(matrix), dtype=np.int64)
+    while k:
+        if k & 1:
+            result = result @ matrix % MODULUS
+        matrix = matrix @ matrix % MODULUS
+        k >>= 1
+    return result
@@ -0,0 +1,84 @@
+# noqa: INP001
+"""Machine memory and the load-time bounds verifier."""
+
+from dataclasses import dataclass
+
+import numpy as np
+
+from . import const
+
+
+def allocate(words: np.ndarray, word_bits: int = 16) -> np.ndarray:
+    """Memory covering the whole address space of the word width, `words` at 0."""
+    memory = np.zeros(1 << word_bits, dtype=np.uint16)
+    memory[: len(words)] = words
+    return memory
+
+
+@dataclass
+class Bounds:
+    """What `verify` found out about an image in a memory of `size` words."""
+
+    size: int
+    reachable: np.ndarray
+    faults: np.ndarray
+    self_modifying: bool
+
+    @property
+    def ok(self) -> bool:
+        """Every access of every run stays inside the memory.
+
+        Only the batch engine acts on this, keeping image-sized memory without
+        checks. The other engines run on memory covering the whole address
+        space, where no access can fall outside, so they have nothing to skip.
+        """
+        return not self.self_modifying and not len(self.faults)
+
+
+def verify(words: np.ndarray, size: int, entry: int = 0) -> Bounds:
+    """Check which instructions reachable from `entry` can access outside `size` words.
+
+    Reachability follows the operands as they are in the image, one vectorised
+    frontier per step. `faults` lists reachable pcs whose fetch or operands fall
+    outside the memory; in memory covering the whole address space those only
+    wrap around, which every engine does. If a reachable instruction writes
+    into a reachable instruction the operands seen here may change at
+    runtime, so the image is not verified however clean the faults look.
+    """
+    w = np.zeros(size + 3, dtype=np.int64)
+    n = min(len(words), size)
+    w[:n] = words[:n]
+    io_addrs = np.array([const.IO_ADDR, const.INSPECT_ADDR])
+
+    reachable = np.zeros(size, dtype=bool)
+    faults = []
+    frontier = np.array([entry], dtype=np.int64)
+    while frontier.size:
+        outside = frontier + 2 >= size
+        faults.append(frontier[outside])
+        pc = frontier[~outside]
+        reachable[pc] = True
+
+        a, b, c = w[pc], w[pc + 1], w[pc + 2]
+        faults.append(pc[(a >= size) | (b >= size)])
+
+        # `x x c` always branches; a branch to HALT has no successor
+        always = (a == b) & ~np.isin(b, io_addrs)
+        successors = np.concatenate([pc[~always] + 3, c[c != const.HALT_ADDR]])
+        successors = np.unique(successors)
+        fresh = successors >= size  # reported as faults on the next step
+        fresh[~fresh] = ~reachable[successors[~fresh]]
+        frontier = successors[fresh]
+
+    pcs = np.nonzero(reachable)[0]
+    targets = w[pcs + 1]
+    targets = targets[(targets < size) & ~np.isin(targets, io_addrs)]
+    code = np.zeros(size + 2, dtype=bool)
+    for k in range(3):
+        code[pcs + k] = True
+    return Bounds(
+        size=size,
+        reachable=reachable,
+        faults=np.unique(np.concatenate(faults)),
+        self_modifying=bool(code[targets].any()),
+    )
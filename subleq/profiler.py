@@ -0,0 +1,167 @@
+# noqa: INP001
+"""Per-address execution counts and the per-label profile built from them."""
+
+import argparse
+import json
+from array import array
+from pathlib import Path
+
+import numpy as np
+
+from .debugger import Breakpoints, run_to_breakpoint
+from .devices import InputDevice, OutputDevice, PromptInput
+from .sourcemap import SourceMap, attribute_macros, format_macro_report
+from .trace import code_labels
+from .watchdog import Watchdog, run_sliced
+
+START_LABEL = "<start>"
+DEFAULT_TOP = 25
+
+
+class Profile:
+    """How many times each address was executed as an instruction."""
+
+    def __init__(self, size: int) -> None:
+        self.counts = np.zeros(size, dtype=np.uint64)
+
+    def add(self, pcs: array) -> None:
+        """Fold a batch of executed pcs into the counters."""
+        hits = np.bincount(np.frombuffer(pcs, dtype=np.uint16), minlength=len(self.counts))
+        self.counts += hits[: len(self.counts)].astype(np.uint64)
+
+    def by_label(self, labels: dict[str, int]) -> list[tuple[str, int]]:
+        """Totals per label (nearest preceding label), most expensive first."""
+        return fold_labels(self.counts, labels)
+
+    def save(self, path: Path, labels: dict[str, int], source_map: dict | None = None) -> None:
+        """Write the counters, and the labels and source map they fold through, to an .npz."""
+        names, addrs = code_labels(labels)
+        np.savez_compressed(
+            path,
+            counts=self.counts,
+            label_names=names,
+            label_addrs=addrs,
+            source_map=np.array(json.dumps(source_map or {})),
+        )
+
+    @classmethod
+    def load(cls, path: Path) -> tuple["Profile", dict[str, int], dict]:
+        """Read a profile saved by `save`, with its labels and source map."""
+        with np.load(path) as f:
+            profile = cls(len(f["counts"]))
+            profile.counts[:] = f["counts"]
+            labels = dict(zip(f["label_names"].tolist(), f["label_addrs"].tolist(), strict=True))
+            source_map = json.loads(str(f["source_map"])) if "source_map" in f else {}
+        return profile, labels, source_map
+
+    def macro_report(self, source_map: dict, top: int = DEFAULT_TOP) -> list[str]:
+        """Per call site and per macro tables, if the image has a source map."""
+        if not source_map:
+            return []
+        sites, macros = attribute_macros(self.counts, SourceMap.from_json(source_map))
+        total = int(self.counts.sum())
+        return [
+            *format_macro_report(sites, total, top, "macro call site"),
+            "",
+            *format_macro_report(macros, total, top, "macro"),
+        ]
+
+
+def fold_labels(counts: np.ndarray, labels: dict[str, int]) -> list[tuple[str, int]]:
+    """Sum `counts` per nearest preceding label, most expensive first."""
+    names, addrs = code_labels(labels)
+    pcs = np.nonzero(counts)[0]
+    owner = np.searchsorted(addrs, pcs, side="right") - 1
+    totals = np.zeros(len(names) + 1, dtype=np.uint64)
+    np.add.at(totals, owner + 1, counts[pcs])
+    names = [START_LABEL, *names.tolist()]
+    folded = [(names[i], int(totals[i])) for i in np.nonzero(totals)[0].tolist()]
+    return sorted(folded, key=lambda item: -item[1])
+
+
+def format_report(folded: list[tuple[str, int]], top: int = DEFAULT_TOP) -> list[str]:
+    """Lines of a per-label report."""
+    total = sum(n for _, n in folded) or 1
+    width = max((len(name) for name, _ in folded[:top]), default=5)
+    lines = [f"{'label':<{width}}  {'instructions':>14}  {'share':>7}"]
+    lines += [f"{name:<{width}}  {n:>14}  {100 * n / total:6.2f}%" for name, n in folded[:top]]
+    if len(folded) > top:
+        rest = sum(n for _, n in folded[top:])
+        lines.append(f"{f'({len(folded) - top} more)':<{width}}  {rest:>14}  {100 * rest / total:6.2f}%")
+    return lines
+
+
+def subleq_profiled(
+    data: np.ndarray,
+    labels: dict[str, int],  # noqa: ARG001
+    out: OutputDevice | None = None,
+    inp: InputDevice | None = None,
+    pc: int = 0,
+    count: int = 0,
+    watchdog: Watchdog | None = None,
+    profile: Profile | None = None,
+) -> int:
+    """`fast.subleq_fast` that also counts every executed pc into `profile`.
+
+    Runs the `debugger.run_to_breakpoint` loop with no breakpoints; its
+    `record` hook only appends pcs to a buffer, which is folded into the
+    counters once per watchdog slice.
+    """
+    out = out or OutputDevice()
+    inp = inp or PromptInput(on_block=out.on_input)
+    profile = profile or Profile(len(data))
+    mem = data.tolist()
+    pcs = array("H")
+    append = pcs.append
+    no_stops = Breakpoints()
+
+    def record(pc: int, a: int, b: int, c: int, old: int, new: int) -> None:  # noqa: ARG001
+        append(pc)
+
+    def step(pc: int, count: int, limit: int) -> tuple[int, int]:
+        try:
+            return run_to_breakpoint(mem, out, inp, no_stops, pc, count, limit, skip=False, record=record)
+        finally:
+            profile.add(pcs)
+            del pcs[:]
+
+    try:
+        return run_sliced(step, pc, count, watchdog)
+    finally:
+        data[:] = mem
+        out.flush()
+
+
+def main() -> None:
+    """Entrypoint."""
+    parser = argparse.ArgumentParser(description="Show or compare saved subleq profiles")
+    parser.add_argument("profile", type=Path, help="Profile saved by `run --profile`")
+    parser.add_argument("baseline", type=Path, nargs="?", help="Earlier profile to compare against")
+    parser.add_argument("-n", "--top", type=int, default=DEFAULT_TOP, help="Number of labels shown")
+    args = parser.parse_args()
+
+    profile, labels, source_map = Profile.load(args.profile)
+    folded = profile.by_label(labels)
+    if args.baseline is None:
+        for line in format_report(folded, args.top):
+            print(line)
+        for line in profile.macro_report(source_map, args.top):
+            print(line)
+        return
+
+    baseline, base_labels, _ = Profile.load(args.baseline)
+    before = dict(baseline.by_label(base_labels))
+    after = dict(folded)
+    deltas = sorted(
+        ((name, before.get(name, 0), after.get(name, 0)) for name in before.keys() | after.keys()),
+        key=lambda item: -abs(item[2] - item[1]),
+    )
+    width = max((len(name) for name, *_ in deltas[: args.top]), default=5)
+    print(f"{'label':<{width}}  {'before':>14}  {'after':>14}  {'change':>14}")
+    for name, b, a in deltas[: args.top]:
+        print(f"{name:<{width}}  {b:>14}  {a:>14}  {a - b:>+14}")
+    print(f"{'total':<{width}}  {sum(before.values()):>14}  {sum(after.values()):>14}")
+
+
+if __name__ == "__main__":
+    main()
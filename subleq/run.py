@@ -4,16 +4,51 @@
 import argparse
 
 # from rich import print  # noqa: A004
-import json
-from functools import wraps
+from functools import partial, wraps
 from pathlib import Path
+from typing import BinaryIO
 
 import numpy as np
+import signal
 import sys
-import os
 import time
 
 from . import const
+from .bus import DEVICES, build_bus
+from .debugger import Breakpoints, Debugger, resolve, resolve_range, subleq_debug
+from .devices import (
+    DEFAULT_BUFFER_SIZE,
+    DEFAULT_CHUNK_SIZE,
+    ENCODINGS,
+    INPUT_MODES,
+    BadInput,
+    InputDevice,
+    OutputDevice,
+    PromptInput,
+)
+from .fast import WORD_MASK, subleq_fast
+from .fuse import subleq_fused
+from .hooks import load_hook, subleq_hooked
+from .image import load_image
+from .iolog import (
+    IoLogWriter,
+    RecordingInput,
+    RecordingOutput,
+    Replay,
+    ReplayInput,
+    ReplayMismatch,
+    ReplayOutput,
+    read_log,
+)
+from .jit import DEFAULT_HOT_THRESHOLD, subleq_jit
+from .memory import allocate
+from .profiler import Profile, format_report, subleq_profiled
+from .state import MachineState, load_state, save_state
+from .timetravel import DEFAULT_INTERVAL, DEFAULT_SEGMENTS, Journal
+from .trace import DEFAULT_DEPTH, TraceRing, reverse_labels
+from .tracefile import Bound, TraceWriter, subleq_trace_file
+from .translate import load_translation, subleq_translated
+from .watchdog import HALTED, Stopped, Watchdog, run_sliced
 
 DEBUG = True
 
@@ -35,58 +70,114 @@ def format_value(v):
     return f"{int(v):5d} (0x{int(v) & 0xFFFF:04X}, {np.int16(v):6d})"
 
 
-def debug_instruction(pc, data, rlabels):
-    a, b, c = (
-        data[pc],
-        data[pc + 1],
-        data[pc + 2],
-    )
-    da, db = np.int16(data[a]), np.int16(data[b])
-    with np.errstate(over="ignore"):
-        ndb = db - da
-    debug(
-        f"data[{pc:5d}] = {a:5d} -> data[{a:5d}] = {np.uint16(da):6x} : {rlabels.get(a, ''):15s}"
-    )
-    debug(
-        f"data[{pc + 1:5d}] = {b:5d} -> data[{b:5d}] = {np.uint16(db):6x} : {rlabels.get(b, ''):15s} -> {ndb:5d}, {np.uint16(ndb):6x}, {np.uint16(ndb):0>16b}"
-    )
-    debug(
-        f"data[{pc + 2:5d}] = {c:5d}                         : {rlabels.get(c, ''):15s}"
-    )
-    debug("-" * 50)
+def subleq(
+    data: np.ndarray,
+    labels: dict[str, int],  # noqa: ARG001
+    out: OutputDevice | None = None,
+    inp: InputDevice | None = None,
+    trace: TraceRing | None = None,
+    pc: int = 0,
+    count: int = 0,
+    watchdog: Watchdog | None = None,
+) -> int:
+    """Emulate a subleq computer on a bank of data.
+
+    The untraced loop does no tracing work at all; with a `trace` every executed
+    instruction is recorded into it and formatting is left to the caller.
+    Reading past the end of the input halts the machine before the read.
+    Starting at `pc` with `count` instructions already executed resumes a run
+    that a `watchdog` stopped.
+    """
+    out = out or OutputDevice()
+    inp = inp or PromptInput(on_block=out.on_input)
+    try:
+        if trace is not None:
+            step = partial(_subleq_traced, data, out, inp, trace)
+        else:
+            step = partial(_subleq, data, out, inp)
+        return run_sliced(step, pc, count, watchdog)
+    finally:
+        out.flush()
+
+
+def _subleq(
+    data: np.ndarray,
+    out: OutputDevice,
+    inp: InputDevice,
+    pc: int,
+    count: int,
+    limit: int,
+) -> tuple[int, int]:
+    while True:
+        count += 1
+        a, b, c = (
+            data[pc],
+            data[(pc + 1) & WORD_MASK],
+            data[(pc + 2) & WORD_MASK],
+        )
+
+        da, db = data[a], data[b]
+
+        if a == const.IO_ADDR:
+            try:
+                da = (-inp.read(count)) % (1 << 16)
+            except EOFError:
+                return HALTED, count - 1  # out of input: halt before the read
+
+        if b == const.IO_ADDR:
+            out.write(int(da), count)
 
+        elif b == const.INSPECT_ADDR:
+            out.flush()
+            print(f" < {da:5d}, {np.uint16(da):6x}, {np.uint16(da):16b}")
 
-def subleq(data: np.ndarray, labels: dict[str, int]) -> int:
-    """Emulate a subleq computer on a bank of data."""
-    count = 0
+        else:
+            with np.errstate(over="ignore"):
+                db = db - da
+            data[b] = db
 
-    # reverse the dictionary
-    rlabels = {}
-    for label, addr in labels.items():
-        if addr in rlabels:
-            rlabels[addr] += " " + label
+        if db.astype(np.int16) <= 0:
+            if c == const.HALT_ADDR:
+                return HALTED, count
+            pc = int(c)
+            if count >= limit:
+                return pc, count
             continue
-        rlabels[addr] = label
+        pc = (pc + 3) & WORD_MASK
 
-    pc = np.uint16(0)
+
+def _subleq_traced(
+    data: np.ndarray,
+    out: OutputDevice,
+    inp: InputDevice,
+    trace: TraceRing,
+    pc: int,
+    count: int,
+    limit: int,
+) -> tuple[int, int]:
     while True:
         count += 1
-        debug_instruction(pc, data, rlabels)
         a, b, c = (
             data[pc],
-            data[pc + 1],
-            data[pc + 2],
+            data[(pc + 1) & WORD_MASK],
+            data[(pc + 2) & WORD_MASK],
         )
 
         da, db = data[a], data[b]
 
         if a == const.IO_ADDR:
-            da = (-eval(input("> "))) % (1 << 16)  # noqa: S307
+            try:
+                da = (-inp.read(count)) % (1 << 16)
+            except EOFError:
+                return HALTED, count - 1  # out of input: halt before the read
+
+        trace.record(count, int(pc), int(a), int(b), int(c), int(da), int(db))
 
         if b == const.IO_ADDR:
-            os.write(1, bytes([da]))
+            out.write(int(da), count)
 
         elif b == const.INSPECT_ADDR:
+            out.flush()
             print(f" < {da:5d}, {np.uint16(da):6x}, {np.uint16(da):16b}")
 
         else:
@@ -96,22 +187,52 @@ def subleq(data: np.ndarray, labels: dict[str, int]) -> int:
 
         if db.astype(np.int16) <= 0:
             if c == const.HALT_ADDR:
-                debug("HALT")
-                return count
-            pc = c
+                return HALTED, count
+            pc = int(c)
+            if count >= limit:
+                return pc, count
             continue
-        pc += 3
+        pc = (pc + 3) & WORD_MASK
+
+
+EXIT_STOPPED = 3
+EXIT_BAD_INPUT = 4
+
+
+def _interrupt(watchdog: Watchdog, signum: int, frame: object) -> None:  # noqa: ARG001
+    """First Ctrl-C: stop cleanly and save state. Second: the usual KeyboardInterrupt."""
+    watchdog.request_stop()
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+
+
+def _discard(stream: BinaryIO, size: int) -> None:
+    """Read past the first `size` bytes of a stream that cannot seek, such as a pipe."""
+    while size > 0:
+        chunk = stream.read(min(size, DEFAULT_CHUNK_SIZE))
+        if not chunk:
+            return
+        size -= len(chunk)
+
+
+ENGINES = {
+    "reference": subleq,
+    "fast": subleq_fast,
+    "jit": subleq_jit,
+    "fused": subleq_fused,
+    "translated": subleq_translated,
+}
+BUS_ENGINES = ("jit", "translated")  # the engines taking a `bus`; the others have only IO and INSPECT
 
 
 def main() -> None:
     """Entrypoint."""
     parser = argparse.ArgumentParser(description="Subleq")
-    parser.add_argument("input", type=Path, help="Input source file")
+    parser.add_argument("input", type=Path, help="Input image file (.sqi or .npy)")
     parser.add_argument(
         "-l",
         "--labels",
         action="store_true",
-        help="Input labels file",
+        help="Ignored: labels are read from the image (or .labels file) when needed",
         dest="labels",
     )
     parser.add_argument(
@@ -120,21 +241,366 @@ def main() -> None:
         action="store_true",
         help="Enable debug mode",
     )
+    parser.add_argument(
+        "--trace-depth",
+        type=int,
+        default=DEFAULT_DEPTH,
+        help="Number of instructions kept for the -g trace",
+    )
+    parser.add_argument(
+        "--trace",
+        type=Path,
+        metavar="FILE",
+        help="Write a columnar trace (pc, a, b, c, old and new data[b], branch taken) to FILE (.npz) "
+        "(runs the fast engine with tracing, instead of --engine)",
+    )
+    parser.add_argument(
+        "--trace-from",
+        metavar="LABEL|COUNT",
+        help="Start tracing when the pc reaches LABEL, or after COUNT instructions",
+    )
+    parser.add_argument(
+        "--trace-to",
+        metavar="LABEL|COUNT",
+        help="Stop tracing when the pc reaches LABEL, or after COUNT instructions",
+    )
+    parser.add_argument(
+        "-e",
+        "--engine",
+        choices=ENGINES,
+        default="reference",
+        help="Emulator engine (-g traces the reference engine only; translated uses the module from "
+        "`translate`, translating the image first if there is none or it is stale)",
+    )
+    parser.add_argument(
+        "--hot-threshold",
+        type=int,
+        metavar="N",
+        help=f"Executions before the JIT compiles a block (-e jit only, default {DEFAULT_HOT_THRESHOLD})",
+    )
+    parser.add_argument(
+        "--device",
+        action="append",
+        default=[],
+        metavar="KIND@ADDR[=ARG]",
+        help=f"Map a device ({', '.join(DEVICES)}) at a label or address, next to IO and INSPECT; "
+        "`storage@ADDR=FILE` keeps its blocks in FILE. Only -e jit and -e translated take devices: their "
+        "generated code calls one only from the instructions naming its words, the instructions they "
+        "interpret look up every operand. The reference, fast and fused loops keep their fixed IO and "
+        "INSPECT checks and reject --device",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        help="Write program output to this file instead of stdout",
+    )
+    parser.add_argument(
+        "--output-encoding",
+        choices=ENCODINGS,
+        default="byte",
+        help="How words written to IO are encoded",
+    )
+    parser.add_argument(
+        "--output-buffer",
+        type=int,
+        default=DEFAULT_BUFFER_SIZE,
+        help="Flush program output once this many bytes are buffered",
+    )
+    parser.add_argument(
+        "-i",
+        "--input-file",
+        type=Path,
+        help="Read program input from this file instead of stdin",
+    )
+    parser.add_argument(
+        "--input-mode",
+        choices=INPUT_MODES,
+        help="How input is parsed (default: prompt on a terminal, else ints)",
+    )
+    parser.add_argument(
+        "--max-instructions",
+        type=int,
+        help="Stop after about this many instructions (at the next block boundary)",
+    )
+    parser.add_argument("--timeout", type=float, help="Stop after this many seconds")
+    parser.add_argument(
+        "--state-file",
+        type=Path,
+        help="Where a stopped run saves its state (default: <input>.state.npz)",
+    )
+    parser.add_argument(
+        "--resume",
+        type=Path,
+        metavar="STATE",
+        help="Continue a stopped run from its state file",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Count executed instructions per address and report them per label "
+        "(runs the fast engine with counting, instead of --engine)",
+    )
+    parser.add_argument(
+        "--profile-output",
+        type=Path,
+        help="Where the profile counters are saved (default: <input>.profile.npz)",
+    )
+    parser.add_argument(
+        "-b",
+        "--break",
+        dest="breakpoints",
+        action="append",
+        default=[],
+        metavar="LABEL",
+        help="Stop when the pc reaches LABEL, LABEL+N or an address "
+        "(runs the fast engine with breakpoint checks, instead of --engine)",
+    )
+    parser.add_argument(
+        "--watch",
+        action="append",
+        default=[],
+        metavar="LABEL[:N]",
+        help="Stop after an instruction writes one of the N words (default 1) at LABEL",
+    )
+    parser.add_argument(
+        "--reverse",
+        action="store_true",
+        help="Journal every write so the debugger can step back (rs, rc, j); also stops at the halt",
+    )
+    parser.add_argument(
+        "--journal-interval",
+        type=int,
+        default=DEFAULT_INTERVAL,
+        help="Instructions between the journal's memory snapshots (the cost of going back)",
+    )
+    parser.add_argument(
+        "--journal-segments",
+        type=int,
+        default=DEFAULT_SEGMENTS,
+        help="Snapshots kept; older history is dropped",
+    )
+    parser.add_argument(
+        "--hook",
+        dest="hooks",
+        action="append",
+        default=[],
+        metavar="MODULE:CLASS",
+        help="Instrument the run with a `hooks.Hooks` subclass, instantiated without arguments "
+        "(runs the fast engine with the hooks, instead of --engine)",
+    )
+    replay_group = parser.add_mutually_exclusive_group()
+    replay_group.add_argument(
+        "--record",
+        type=Path,
+        metavar="LOG",
+        help="Log every input and output word with its instruction count",
+    )
+    replay_group.add_argument(
+        "--replay",
+        type=Path,
+        metavar="LOG",
+        help="Feed the input recorded in LOG back and check the output matches it",
+    )
+    parser.add_argument(
+        "--no-line-buffer",
+        dest="line_buffered",
+        action="store_false",
+        help="Do not flush program output on newlines (only done on a terminal)",
+    )
     args = parser.parse_args()
+    if args.debug and args.engine != "reference":
+        parser.error("-g traces the reference engine only")
+    if args.debug and args.profile:
+        parser.error("-g and --profile cannot be combined")
+    stops = args.breakpoints or args.watch or args.reverse
+    if stops and (args.debug or args.profile):
+        parser.error("breakpoints cannot be combined with -g or --profile")
+    if args.hooks and (args.debug or args.profile or stops):
+        parser.error("--hook cannot be combined with -g, --profile or breakpoints")
+    if args.trace and (args.debug or args.profile or stops or args.hooks):
+        parser.error("--trace cannot be combined with -g, --profile, breakpoints or --hook")
+    if (args.trace_from or args.trace_to) and not args.trace:
+        parser.error("--trace-from and --trace-to need --trace")
+    if args.hot_threshold is not None and args.engine != "jit":
+        parser.error("--hot-threshold needs -e jit")
+    if args.hot_threshold is not None and args.hot_threshold < 1:
+        parser.error("--hot-threshold must be at least 1")
+    if args.device and args.engine not in BUS_ENGINES:
+        parser.error(f"--device needs -e jit or -e translated, the {args.engine} engine has only IO and INSPECT")
+    if args.device and (args.profile or stops or args.hooks or args.trace):
+        parser.error("--device cannot be combined with --profile, breakpoints, --hook or --trace")
 
     global DEBUG  # noqa: PLW0603
     DEBUG = args.debug
 
-    data = np.load(args.input)
+    image = load_image(args.input)
+    data = allocate(image.words, image.word_bits)
+    labels = image.labels if args.debug or args.profile or stops or args.trace or args.device else {}
+    pc, count = image.entry, 0
+    state = None
+    if args.resume:
+        state = load_state(args.resume)
+        if state.memory.shape != data.shape:
+            parser.error(f"{args.resume} does not hold a memory of {len(data)} words")
+        data[:] = state.memory
+        pc, count = state.pc, state.count
+
+    sink = args.output.open("ab" if state else "wb") if args.output else 1
+    out = OutputDevice(
+        sink,
+        args.output_encoding,
+        args.output_buffer,
+        line_buffered=args.line_buffered and not args.output and sys.stdout.isatty(),
+    )
+    input_mode = args.input_mode
+    if input_mode is None:
+        input_mode = "prompt" if not args.input_file and sys.stdin.isatty() else "ints"
+    source = args.input_file.open("rb") if args.input_file else sys.stdin.buffer
+    if input_mode == "prompt":
+        inp = PromptInput(on_block=out.on_input)
+    else:
+        inp = INPUT_MODES[input_mode](source, on_block=out.on_input)
+    if state is not None:
+        inp.restore(state.input_words, state.input_bytes)
+        if input_mode != "prompt":
+            if source.seekable():
+                source.seek(state.input_offset)
+            else:
+                _discard(source, state.input_offset)
+            inp.offset = state.input_offset
+        out.written = state.output_offset
+
+    iolog = replay = None
+    if args.record:
+        iolog = IoLogWriter(args.record)
+        inp, out = RecordingInput(inp, iolog), RecordingOutput(out, iolog)
+    if args.replay:
+        replay = Replay(read_log(args.replay))
+        inp, out = ReplayInput(replay), ReplayOutput(out, replay)
+
+    watchdog = Watchdog(args.max_instructions, args.timeout)
+    signal.signal(signal.SIGINT, partial(_interrupt, watchdog))
 
-    labels = {}
-    if args.labels:
-        with args.input.with_suffix(".labels").open("r") as fp:
-            labels = json.load(fp)
+    engine = partial(ENGINES[args.engine], out=out, inp=inp, pc=pc, count=count, watchdog=watchdog)
+    if args.hot_threshold is not None:
+        engine = partial(engine, hot_threshold=args.hot_threshold)
+    if args.engine in BUS_ENGINES:
+        try:
+            bus = build_bus(args.device, labels)
+        except ValueError as e:
+            parser.error(str(e))
+        engine = partial(engine, bus=bus)
+    if args.engine == "translated":
+        engine = partial(engine, module=load_translation(args.input, bus=bus))
+    trace = None
+    if args.debug:
+        trace = TraceRing(args.trace_depth)
+        engine = partial(engine, trace=trace)
+    profile = None
+    if args.profile:
+        profile = Profile(len(data))
+        engine = partial(subleq_profiled, out=out, inp=inp, pc=pc, count=count, watchdog=watchdog, profile=profile)
+    if stops:
+        try:
+            breakpoints = Breakpoints(
+                [resolve(spec, labels) for spec in args.breakpoints],
+                [resolve_range(spec, labels) for spec in args.watch],
+            )
+        except ValueError as e:
+            parser.error(str(e))
+        journal = None
+        if args.reverse:
+            journal = Journal(args.journal_interval, args.journal_segments)
+            inp, out = journal.devices(inp, out)
+        debugger = Debugger(breakpoints, labels, image.source_map, journal=journal)
+        engine = partial(subleq_debug, out=out, inp=inp, pc=pc, count=count, watchdog=watchdog, debugger=debugger)
+    if args.hooks:
+        try:
+            hooks = [load_hook(spec) for spec in args.hooks]
+        except (ImportError, AttributeError, ValueError) as e:
+            parser.error(f"--hook: {e}")
+        engine = partial(subleq_hooked, out=out, inp=inp, pc=pc, count=count, watchdog=watchdog, hooks=hooks)
+    trace_file = None
+    if args.trace:
+        try:
+            start = Bound.parse(args.trace_from, labels) if args.trace_from else None
+            stop = Bound.parse(args.trace_to, labels) if args.trace_to else None
+        except ValueError as e:
+            parser.error(str(e))
+        if start and stop and start.count is not None and stop.count is not None and stop.count <= start.count:
+            parser.error("--trace-to must come after --trace-from")
+        trace_file = TraceWriter(args.trace)
+        engine = partial(
+            subleq_trace_file,
+            out=out,
+            inp=inp,
+            pc=pc,
+            count=count,
+            watchdog=watchdog,
+            trace=trace_file,
+            start=start,
+            stop=stop,
+        )
 
     t = time.time()
-    print("---------------------------------")
-    count = subleq(data, labels)
+    if state is None:  # a resumed run continues the output of the stopped one
+        print("---------------------------------")
+    halted_at = None
+    try:
+        count = engine(data, labels)
+        halted_at = count
+        if replay is not None:
+            replay.finish(count)
+    except ReplayMismatch as e:
+        print(f"\n{args.input}: {e}", file=sys.stderr)
+        sys.exit(1)
+    except BadInput as e:
+        print(f"\n{args.input}: bad input, {e}", file=sys.stderr)
+        sys.exit(EXIT_BAD_INPUT)
+    except Stopped as stop:
+        state_file = args.state_file or args.input.with_suffix(".state.npz")
+        words, raw = inp.pending()
+        save_state(
+            state_file,
+            MachineState(
+                memory=data,
+                pc=stop.pc,
+                count=stop.count,
+                input_words=words,
+                input_bytes=raw,
+                input_offset=getattr(inp, "offset", 0),
+                output_offset=out.written,
+            ),
+        )
+        print(
+            f"\n{args.input}: {stop.reason} after {stop.count} instructions, state saved to {state_file}",
+            file=sys.stderr,
+        )
+        sys.exit(EXIT_STOPPED)
+    finally:
+        if iolog is not None:
+            iolog.close(halted_at)
+        if trace_file is not None:
+            trace_file.close(labels)
+            traced = sum(n for _, n in trace_file.chunks)
+            print(f"trace of {traced} instructions saved to {args.trace}", file=sys.stderr)
+        if trace is not None:
+            for line in trace.format(reverse_labels(labels)):
+                debug(line)
+        if profile is not None:
+            profile_file = args.profile_output or args.input.with_suffix(".profile.npz")
+            profile.save(profile_file, labels, image.source_map)
+            for line in format_report(profile.by_label(labels)):
+                print(line, file=sys.stderr)
+            for line in profile.macro_report(image.source_map):
+                print(line, file=sys.stderr)
+            print(f"profile saved to {profile_file}", file=sys.stderr)
+        if args.output:
+            sink.close()
+        if args.input_file:
+            source.close()
+    debug("HALT")
     print("\n---------------------------------")
     print(f"{args.input} halted in {count} instructions, {time.time() - t:.3f} seconds")
 
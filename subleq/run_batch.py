@@ -0,0 +1,213 @@
+# noqa: INP001
+"""Run a manifest of jobs (image, input file, memory patches) across a process pool.
+
+The manifest is a JSON list of jobs::
+
+    [{"image": "program.sqi", "input": "nums.txt", "patches": {"x": 5, "0x20": 1}},
+     {"image": "program.sqi", "input_mode": "bytes", "engine": "jit"}]
+
+Paths are relative to the manifest. `patches` maps labels or addresses to
+words written into memory before the run. Optional per-job keys: `engine`
+(default fast), `input_mode` (default ints), `max_instructions`, `timeout`.
+A job without `input` gets no input; its first read halts it.
+
+With `--in-process` the jobs run as machines of one `scheduler.Scheduler`
+instead, taking turns in quanta; jobs may then also set `priority` and
+`max_output` (bytes), and `timeout` limits the time spent running the job.
+"""
+
+import argparse
+import base64
+import io
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+from types import ModuleType
+
+import numpy as np
+
+from .devices import INPUT_MODES, ArrayInput, OutputDevice
+from .image import Image, load_image
+from .memory import allocate
+from .run import ENGINES
+from .scheduler import DEFAULT_QUANTUM, POLICIES, Quota, Scheduler
+from .translate import load_module, translate
+from .watchdog import Stopped, Watchdog
+
+DEFAULT_ENGINE = "fast"
+
+# images already loaded (and translated) by this worker process, by path
+_images: dict[Path, Image] = {}
+_translations: dict[Path, ModuleType] = {}
+
+
+def _image(path: Path) -> Image:
+    image = _images.get(path)
+    if image is None:
+        image = _images[path] = load_image(path)
+    return image
+
+
+def _translation(path: Path) -> ModuleType:
+    """The image translated once per worker; patched words fall back to its interpreter."""
+    module = _translations.get(path)
+    if module is None:
+        image = _image(path)
+        module = _translations[path] = load_module(translate(image.words, image.entry, image.labels, path.name))
+    return module
+
+
+def run_job(job: dict) -> dict:
+    """Run one manifest job in this process and return its result record."""
+    t = time.perf_counter()
+    result = {"image": job["image"], "input": job.get("input"), "status": "halted", "count": 0}
+    output = bytearray()
+    try:
+        image, data = _load(job)
+        out = OutputDevice(output, line_buffered=False)
+        watchdog = Watchdog(job.get("max_instructions"), job.get("timeout"))
+        name = job.get("engine", DEFAULT_ENGINE)
+        engine = ENGINES[name]
+        if name == "translated":
+            engine = partial(engine, module=_translation(Path(job["image"])))
+        if job.get("input") is None:
+            inp = ArrayInput([])
+            result["count"] = engine(data, {}, out=out, inp=inp, pc=image.entry, watchdog=watchdog)
+        else:
+            with Path(job["input"]).open("rb") as source:
+                inp = INPUT_MODES[job.get("input_mode", "ints")](source)
+                result["count"] = engine(data, {}, out=out, inp=inp, pc=image.entry, watchdog=watchdog)
+    except Stopped as stop:
+        result.update(status="stopped", count=stop.count, reason=stop.reason)
+    except Exception as e:  # noqa: BLE001
+        result.update(status="error", reason=f"{type(e).__name__}: {e}")
+    result["time"] = time.perf_counter() - t
+    result["output"] = bytes(output)
+    return result
+
+
+def _load(job: dict) -> tuple[Image, np.ndarray]:
+    """The job's image and its memory with the patches applied."""
+    image = _image(Path(job["image"]))
+    data = allocate(image.words, image.word_bits)
+    for target, value in job.get("patches", {}).items():
+        addr = image.labels[target] if target in image.labels else int(target, 0)
+        data[addr] = int(value) & 0xFFFF
+    return image, data
+
+
+def run_in_process(jobs: list[dict], quantum: int = DEFAULT_QUANTUM, policy: str = "round-robin") -> list[dict]:
+    """Run every job as a machine of one scheduler in this process; returns the result records."""
+    scheduler = Scheduler(quantum, policy)
+    results = []
+    machines = []
+    for job in jobs:
+        result = {"image": job["image"], "input": job.get("input"), "status": "halted", "count": 0}
+        results.append(result)
+        try:
+            image, data = _load(job)
+            if job.get("input") is None:
+                inp = ArrayInput([])
+            else:
+                source = io.BytesIO(Path(job["input"]).read_bytes())
+                inp = INPUT_MODES[job.get("input_mode", "ints")](source)
+        except Exception as e:  # noqa: BLE001
+            result.update(status="error", reason=f"{type(e).__name__}: {e}", time=0.0, output=b"")
+            continue
+        quota = Quota(job.get("max_instructions"), job.get("max_output"), job.get("timeout"))
+        vm = scheduler.spawn(data, entry=image.entry, priority=job.get("priority", 0), quota=quota, inp=inp)
+        machines.append((result, vm))
+
+    scheduler.run()
+    for result, vm in machines:
+        result.update(status=vm.status, count=vm.count, time=vm.seconds, output=vm.take_output())
+        if vm.reason:
+            result["reason"] = vm.reason
+    return results
+
+
+def load_manifest(path: Path) -> list[dict]:
+    """Read a manifest, resolving its paths relative to the manifest file."""
+    jobs = json.loads(path.read_text())
+    for job in jobs:
+        for key in ("image", "input"):
+            if job.get(key) is not None:
+                job[key] = str(path.parent / job[key])
+    return jobs
+
+
+def save_results(path: Path, results: list[dict]) -> None:
+    """Write results as .npz (arrays plus concatenated output) or JSON (output in base64)."""
+    if path.suffix == ".npz":
+        np.savez(
+            path,
+            counts=np.array([r["count"] for r in results], dtype=np.int64),
+            times=np.array([r["time"] for r in results]),
+            status=np.array([r["status"] for r in results]),
+            output_data=np.frombuffer(b"".join(r["output"] for r in results), dtype=np.uint8),
+            output_offsets=np.cumsum([0] + [len(r["output"]) for r in results]),
+        )
+        return
+    records = [{**r, "output": base64.b64encode(r["output"]).decode()} for r in results]
+    path.write_text(json.dumps(records, indent=1))
+
+
+def main() -> None:
+    """Entrypoint."""
+    parser = argparse.ArgumentParser(description="Run many subleq jobs across all cores")
+    parser.add_argument("manifest", type=Path, help="JSON list of jobs")
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        help="Save results to this file (.npz, anything else is JSON; default: <manifest>.results.json)",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of worker processes",
+    )
+    parser.add_argument(
+        "--in-process",
+        action="store_true",
+        help="Run every job in this process, taking turns under a scheduler (engine is ignored)",
+    )
+    parser.add_argument(
+        "--quantum",
+        type=int,
+        default=DEFAULT_QUANTUM,
+        help="Instructions per turn with --in-process",
+    )
+    parser.add_argument(
+        "--policy",
+        choices=POLICIES,
+        default="round-robin",
+        help="Which job takes the next turn with --in-process (priority: highest `priority` first)",
+    )
+    args = parser.parse_args()
+
+    jobs = load_manifest(args.manifest)
+    t = time.time()
+    if args.in_process:
+        results = run_in_process(jobs, args.quantum, args.policy)
+    else:
+        with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            results = list(pool.map(run_job, jobs, chunksize=max(1, len(jobs) // (4 * args.jobs))))
+    output = args.output or args.manifest.with_suffix(".results.json")
+    save_results(output, results)
+
+    statuses = [r["status"] for r in results]
+    print(
+        f"{len(jobs)} jobs ({statuses.count('halted')} halted, {statuses.count('stopped')} stopped, "
+        f"{statuses.count('error')} failed) in {time.time() - t:.3f} seconds, "
+        f"{sum(r['count'] for r in results)} instructions; results saved to {output}",
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+# noqa: INP001
+"""Many subleq machines in one process, run in turns by a cooperative scheduler.
+
+Each `VM` has its own memory, pc, input queue and output buffer. The scheduler
+gives the ready machine picked by its policy one quantum of instructions at a
+time (a quantum ends at the first taken branch past it, as a watchdog slice
+does): `round-robin` takes turns in order, `priority` always runs the highest
+`priority` ready machine, taking turns among equals.
+
+A machine that reads from an empty `QueueInput` is parked before the read and
+runs again once `Scheduler.feed` gives it input; closing the queue makes the
+read halt it, as at the end of any other input. Per-machine `Quota`s on
+instructions, output bytes and wall time stop a machine that goes over them;
+they are checked between quanta, so a machine can overshoot by one quantum::
+
+    scheduler = Scheduler(quantum=10_000)
+    vm = scheduler.spawn(image.words, name="job", quota=Quota(max_output=1 << 20))
+    scheduler.feed(vm, [3, 4], close=True)
+    scheduler.run()
+    print(vm.status, vm.take_output())
+"""
+
+import heapq
+import itertools
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from .devices import InputDevice, OutputDevice
+from .fast import run_slice
+from .memory import allocate
+from .watchdog import HALTED
+
+DEFAULT_QUANTUM = 1 << 14
+POLICIES = ("round-robin", "priority")
+
+STATUSES = ("ready", "waiting", "halted", "stopped", "error")
+
+
+class WouldBlock(Exception):  # noqa: N818
+    """The input queue is empty but not closed: more input may still come."""
+
+
+class QueueInput(InputDevice):
+    """Input words fed by the host; reading it empty parks the machine instead of ending its input."""
+
+    def __init__(self, words: list[int] | None = None, *, closed: bool = False) -> None:
+        super().__init__()
+        self.words = list(words or ())
+        self.closed = closed
+        self.waiting = False  # a read found the queue empty; cleared by the scheduler
+
+    def read(self, count: int = 0) -> int:  # noqa: ARG002
+        pos = self.pos
+        if pos == len(self.words):
+            if self.closed:
+                raise EOFError
+            self.waiting = True
+            raise WouldBlock
+        self.pos = pos + 1
+        self.consumed += 1
+        return self.words[pos]
+
+    def feed(self, words: list[int]) -> None:
+        """Queue more words behind the unread ones."""
+        del self.words[: self.pos]
+        self.pos = 0
+        self.words.extend(int(w) for w in words)
+
+    def close(self) -> None:
+        """No more words will come: reading past the queued ones halts the machine."""
+        self.closed = True
+
+
+@dataclass
+class Quota:
+    """Limits on one machine; None is unlimited."""
+
+    max_instructions: int | None = None
+    max_output: int | None = None  # bytes
+    max_seconds: float | None = None  # wall time spent running it
+
+
+@dataclass(eq=False)
+class VM:
+    """One machine: memory, registers, devices and what the scheduler knows about it."""
+
+    name: str
+    mem: list[int]
+    inp: InputDevice
+    pc: int = 0
+    count: int = 0
+    priority: int = 0
+    quota: Quota = field(default_factory=Quota)
+    status: str = "ready"  # one of STATUSES
+    reason: str = ""
+    seconds: float = 0.0
+    output: bytearray = field(default_factory=bytearray)
+    out: OutputDevice | None = None
+
+    def __post_init__(self) -> None:
+        if self.out is None:
+            self.out = OutputDevice(self.output, line_buffered=False, flush_on_input=False)
+
+    @property
+    def memory(self) -> np.ndarray:
+        return np.array(self.mem, dtype=np.uint16)
+
+    @property
+    def output_bytes(self) -> int:
+        """Bytes written so far, taken or not."""
+        return self.out.written + len(self.out.buffer)
+
+    def inspect(self, value: int) -> None:
+        """An `INSPECT` line, into the output behind the words written before it."""
+        self.out.buffer += f" < {value:5d}, {value:6x}, {value:16b}\n".encode()
+
+    def take_output(self) -> bytes:
+        """The output written since the last call."""
+        self.out.flush()
+        data = bytes(self.output)
+        self.output.clear()
+        return data
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("halted", "stopped", "error")
+
+
+class Scheduler:
+    """Runs the ready machines in quanta of `quantum` instructions by `policy`."""
+
+    def __init__(self, quantum: int = DEFAULT_QUANTUM, policy: str = "round-robin") -> None:
+        if policy not in POLICIES:
+            msg = f"unknown policy {policy!r}, expected one of {', '.join(POLICIES)}"
+            raise ValueError(msg)
+        self.quantum = quantum
+        self.policy = policy
+        self.vms: list[VM] = []
+        self._queue: deque[VM] = deque()
+        self._heap: list[tuple[int, int, VM]] = []
+        self._turn = itertools.count()
+
+    def spawn(  # noqa: PLR0913
+        self,
+        words: np.ndarray,
+        *,
+        name: str | None = None,
+        entry: int = 0,
+        priority: int = 0,
+        quota: Quota | None = None,
+        inp: InputDevice | None = None,
+        out: OutputDevice | None = None,
+    ) -> VM:
+        """Load an image into a new machine.
+
+        It reads an empty, open `QueueInput` unless given `inp`, and writes into
+        `VM.output` unless given `out`.
+        """
+        vm = VM(
+            name=name if name is not None else f"vm{len(self.vms)}",
+            mem=allocate(np.asarray(words)).tolist(),
+            inp=inp if inp is not None else QueueInput(),
+            pc=entry,
+            priority=priority,
+            quota=quota or Quota(),
+            out=out,
+        )
+        self.vms.append(vm)
+        self._ready(vm)
+        return vm
+
+    def feed(self, vm: VM, words: list[int], *, close: bool = False) -> None:
+        """Queue input for `vm` (a `QueueInput`), waking it if it was waiting."""
+        vm.inp.feed(words)
+        if close:
+            vm.inp.close()
+        if vm.status == "waiting":
+            vm.status = "ready"
+            self._ready(vm)
+
+    def kill(self, vm: VM, reason: str = "killed") -> None:
+        """Stop `vm` for good; it stays in `vms` with its memory and output."""
+        if not vm.done:
+            vm.status = "stopped"
+            vm.reason = reason
+
+    def run(self) -> None:
+        """Run quanta until no machine is ready: every one has halted, stopped or waits for input."""
+        while self.run_quantum() is not None:
+            pass
+
+    def run_quantum(self) -> VM | None:
+        """Give one quantum to the next ready machine; returns it, or None if none is ready."""
+        vm = self._next()
+        if vm is None:
+            return None
+        quota = vm.quota
+        limit = vm.count + self.quantum
+        if quota.max_instructions is not None:
+            limit = min(limit, quota.max_instructions)
+        t = time.perf_counter()
+        try:
+            pc, count = run_slice(
+                vm.mem, vm.out, vm.inp, vm.pc, vm.count, limit, park=(WouldBlock,), inspect=vm.inspect
+            )
+        except Exception as e:  # noqa: BLE001
+            vm.status = "error"
+            vm.reason = f"{type(e).__name__}: {e}"
+            return vm
+        finally:
+            vm.seconds += time.perf_counter() - t
+            vm.out.flush()
+        vm.count = count
+        if pc == HALTED:
+            vm.status = "halted"
+            return vm
+        vm.pc = pc
+        if quota.max_instructions is not None and count >= quota.max_instructions:
+            self.kill(vm, "instruction quota used")
+        elif quota.max_output is not None and vm.output_bytes > quota.max_output:
+            self.kill(vm, "output quota used")
+        elif quota.max_seconds is not None and vm.seconds >= quota.max_seconds:
+            self.kill(vm, "time quota used")
+        elif getattr(vm.inp, "waiting", False):
+            vm.inp.waiting = False
+            vm.status = "waiting"
+        else:
+            self._ready(vm)
+        return vm
+
+    def _ready(self, vm: VM) -> None:
+        if self.policy == "priority":
+            heapq.heappush(self._heap, (-vm.priority, next(self._turn), vm))
+        else:
+            self._queue.append(vm)
+
+    def _next(self) -> VM | None:
+        while self._queue or self._heap:
+            vm = self._queue.popleft() if self._queue else heapq.heappop(self._heap)[2]
+            if vm.status == "ready":
+                return vm
+        return None
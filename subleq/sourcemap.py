@@ -0,0 +1,142 @@
+# noqa: INP001
+"""Source map from image words back to source lines and macro expansions.
+
+Stored as JSON in the image's source section::
+
+    {"files": [name, ...],
+     "frames": [[macro, file, call line, parent frame], ...],
+     "words": [[file, line, frame], ...]}
+
+A frame is one expansion of a macro call; `parent` is the frame the call was
+expanded in, or -1 at the top level. Every word points at the source line that
+emitted it and at its innermost frame (-1 outside any macro).
+"""
+
+from dataclasses import dataclass
+
+import numpy as np
+
+TOP = -1
+
+
+@dataclass(frozen=True)
+class Frame:
+    """One expansion of a macro call."""
+
+    macro: str
+    file: int
+    line: int
+    parent: int = TOP
+
+
+@dataclass
+class SourceMap:
+    """Where every word of an image came from."""
+
+    files: list[str]
+    frames: list[Frame]
+    words: list[tuple[int, int, int]]
+
+    @classmethod
+    def from_json(cls, obj: dict) -> "SourceMap":
+        return cls(
+            files=list(obj["files"]),
+            frames=[Frame(*f) for f in obj["frames"]],
+            words=[tuple(w) for w in obj["words"]],
+        )
+
+    def to_json(self) -> dict:
+        return {
+            "files": self.files,
+            "frames": [[f.macro, f.file, f.line, f.parent] for f in self.frames],
+            "words": [list(w) for w in self.words],
+        }
+
+    def location(self, addr: int) -> str:
+        """`file:line` of the source that emitted the word at `addr`."""
+        if not 0 <= addr < len(self.words):
+            return "?"
+        file, line, _ = self.words[addr]
+        return f"{self.files[file]}:{line}"
+
+    def stack(self, addr: int) -> list[int]:
+        """Frame indices of the expansions the word at `addr` came from, innermost first."""
+        if not 0 <= addr < len(self.words):
+            return []
+        frames = []
+        frame = self.words[addr][2]
+        while frame != TOP:
+            frames.append(frame)
+            frame = self.frames[frame].parent
+        return frames
+
+    def format_stack(self, addr: int) -> list[str]:
+        """The source line of `addr` followed by the macro calls it was expanded from."""
+        lines = [self.location(addr)]
+        for frame in self.stack(addr):
+            f = self.frames[frame]
+            lines.append(f"  in {f.macro}! called at {self.files[f.file]}:{f.line}")
+        return lines
+
+
+@dataclass
+class MacroCost:
+    """Cycles charged to a macro definition or call site."""
+
+    name: str
+    inclusive: int = 0
+    exclusive: int = 0
+
+
+def attribute_macros(
+    counts: np.ndarray,
+    source_map: SourceMap,
+) -> tuple[list[MacroCost], list[MacroCost]]:
+    """Charge per-address execution counts to macro call sites and definitions.
+
+    A word's count is inclusive for every frame on its stack and exclusive for
+    the innermost one. Call sites are grouped by source location, so a call
+    written inside a macro body is one call site however often the body is
+    expanded. Both lists are sorted by inclusive cost.
+    """
+    sites = {}
+    macros = {}
+    site_names = [
+        f"{f.macro}! at {source_map.files[f.file]}:{f.line}" for f in source_map.frames
+    ]
+    for addr in np.nonzero(counts[: len(source_map.words)])[0].tolist():
+        n = int(counts[addr])
+        stack = source_map.stack(addr)
+        seen_sites, seen_macros = set(), set()
+        for depth, frame in enumerate(stack):
+            site = site_names[frame]
+            macro = source_map.frames[frame].macro
+            if site not in seen_sites:
+                seen_sites.add(site)
+                cost = sites.setdefault(site, MacroCost(site))
+                cost.inclusive += n
+                cost.exclusive += n if depth == 0 else 0
+            if macro not in seen_macros:
+                seen_macros.add(macro)
+                cost = macros.setdefault(macro, MacroCost(macro))
+                cost.inclusive += n
+                cost.exclusive += n if depth == 0 else 0
+    return (
+        sorted(sites.values(), key=lambda c: -c.inclusive),
+        sorted(macros.values(), key=lambda c: -c.inclusive),
+    )
+
+
+def format_macro_report(costs: list[MacroCost], total: int, top: int, title: str) -> list[str]:
+    """Lines of an inclusive/exclusive cost table."""
+    total = total or 1
+    width = max([len(title), *(len(c.name) for c in costs[:top])])
+    lines = [f"{title:<{width}}  {'inclusive':>14}  {'share':>7}  {'exclusive':>14}  {'share':>7}"]
+    lines += [
+        f"{c.name:<{width}}  {c.inclusive:>14}  {100 * c.inclusive / total:6.2f}%"
+        f"  {c.exclusive:>14}  {100 * c.exclusive / total:6.2f}%"
+        for c in costs[:top]
+    ]
+    if len(costs) > top:
+        lines.append(f"({len(costs) - top} more)")
+    return lines
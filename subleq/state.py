@@ -0,0 +1,50 @@
+# noqa: INP001
+"""Machine state files written when a run is stopped, for `run --resume`."""
+
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+
+@dataclass
+class MachineState:
+    """Everything needed to continue a stopped run exactly where it left off."""
+
+    memory: np.ndarray
+    pc: int
+    count: int
+    input_words: list[int]  # parsed ahead of the program but not read by it yet
+    input_bytes: bytes = b""  # read from the input source but not parsed yet
+    input_offset: int = 0  # bytes taken from the input source so far
+    output_offset: int = 0  # bytes written to the output so far
+
+
+def save_state(path: Path, state: MachineState) -> None:
+    """Write `state` as a compressed .npz file."""
+    with path.open("wb") as fp:
+        np.savez_compressed(
+            fp,
+            memory=state.memory,
+            registers=np.array(
+                [state.pc, state.count, state.input_offset, state.output_offset],
+                dtype=np.int64,
+            ),
+            input_words=np.array(state.input_words, dtype=np.int64),
+            input_bytes=np.frombuffer(state.input_bytes, dtype=np.uint8),
+        )
+
+
+def load_state(path: Path) -> MachineState:
+    """Read a state file written by `save_state`."""
+    with np.load(path) as f:
+        pc, count, input_offset, output_offset = (int(x) for x in f["registers"])
+        return MachineState(
+            memory=f["memory"],
+            pc=pc,
+            count=count,
+            input_words=f["input_words"].tolist(),
+            input_bytes=f["input_bytes"].tobytes(),
+            input_offset=input_offset,
+            output_offset=output_offset,
+        )
@@ -0,0 +1,270 @@
+# noqa: INP001
+"""Write journal and snapshots for stepping the debugger backwards in time.
+
+The journal is a list of segments. Each starts with a full snapshot of memory
+and then holds one (pc, b, mem[b] before) entry per executed instruction in a
+preallocated uint16 array; instruction numbers are implicit in the position.
+Any state since the first snapshot is rebuilt from the snapshot after it (or
+the live memory) by undoing at most one segment of entries, and a new segment
+starts every `interval` instructions, so a rewind costs O(interval). Only the
+last `max_segments` segments are kept.
+
+Input read since the first snapshot is kept too, so execution after a rewind
+reads the same words at the same instructions; output is not taken back, and
+writes already made are not made again.
+"""
+
+import bisect
+from array import array
+from dataclasses import dataclass
+
+import numpy as np
+
+from . import const
+from .debugger import Breakpoints, run_to_breakpoint
+from .devices import InputDevice, OutputDevice
+from .fast import WORD_MASK, step_wrapped
+from .watchdog import HALTED
+
+DEFAULT_INTERVAL = 1 << 18
+DEFAULT_SEGMENTS = 16
+
+# entries a straight-line run can add past the slice limit, see `Journal.run`
+_SLACK = 1 << 15
+
+
+@dataclass
+class Segment:
+    """A memory snapshot after `count` instructions at `pc`, and the entries that follow it."""
+
+    count: int
+    pc: int
+    memory: np.ndarray
+    entries: np.ndarray
+    length: int = 0
+
+    @property
+    def end(self) -> int:
+        return self.count + self.length
+
+
+class TimelineInput(InputDevice):
+    """Logs every read by instruction number and serves the logged word when it is read again."""
+
+    def __init__(self, inner: InputDevice) -> None:
+        super().__init__(inner.on_block)
+        self.inner = inner
+        self.log: list[tuple[int, int | None]] = []
+        self.replay = 0
+
+    def read(self, count: int = 0) -> int:
+        if self.replay < len(self.log):
+            _, value = self.log[self.replay]
+            self.replay += 1
+            if value is None:
+                raise EOFError
+            return value
+        try:
+            value = self.inner.read(count)
+        except EOFError:
+            self.log.append((count, None))
+            self.replay += 1
+            raise
+        self.log.append((count, value))
+        self.replay += 1
+        return value
+
+    def rewind(self, count: int) -> None:
+        """Reads after instruction `count` will be served from the log."""
+        self.replay = bisect.bisect_right(self.log, count, key=lambda entry: entry[0])
+
+    def forget(self, count: int) -> None:
+        """Drop reads done at or before instruction `count`."""
+        drop = bisect.bisect_right(self.log, count, key=lambda entry: entry[0])
+        del self.log[:drop]
+        self.replay -= drop
+
+    @property
+    def offset(self) -> int:
+        return getattr(self.inner, "offset", 0)
+
+    @offset.setter
+    def offset(self, offset: int) -> None:
+        self.inner.offset = offset
+
+    def pending(self) -> tuple[list[int], bytes]:
+        words, raw = self.inner.pending()
+        return [v for _, v in self.log[self.replay :] if v is not None] + words, raw
+
+    def restore(self, words: list[int], raw: bytes = b"") -> None:
+        self.inner.restore(words, raw)
+
+
+class TimelineOutput(OutputDevice):
+    """Passes writes to `inner` once: a write by an instruction that already wrote is dropped."""
+
+    def __init__(self, inner: OutputDevice) -> None:  # noqa: D107
+        self.inner = inner
+        self.high = 0
+
+    def write(self, value: int, count: int = 0) -> None:
+        if count <= self.high:
+            return
+        self.high = count
+        self.inner.write(value, count)
+
+    def __getattr__(self, name: str):  # noqa: ANN204
+        return getattr(self.inner, name)
+
+    def on_input(self) -> None:
+        self.inner.on_input()
+
+    def flush(self) -> None:
+        self.inner.flush()
+
+
+class Journal:
+    """Segments of snapshots and undo entries, with the timeline I/O devices."""
+
+    def __init__(self, interval: int = DEFAULT_INTERVAL, max_segments: int = DEFAULT_SEGMENTS) -> None:
+        self.interval = interval
+        self.max_segments = max_segments
+        self.segments: list[Segment] = []
+        self.staged = array("H")
+        self.input: TimelineInput | None = None
+        self._no_stops: Breakpoints | None = None
+
+    def devices(self, inp: InputDevice, out: OutputDevice) -> tuple[TimelineInput, TimelineOutput]:
+        """Wrap the run's devices so that I/O survives rewinds."""
+        self.input = TimelineInput(inp)
+        return self.input, TimelineOutput(out)
+
+    @property
+    def first(self) -> int:
+        """The earliest instruction count the journal can go back to."""
+        return self.segments[0].count if self.segments else 0
+
+    def run(  # noqa: PLR0913
+        self,
+        mem: list[int],
+        out: OutputDevice,
+        inp: InputDevice,
+        breakpoints: Breakpoints,
+        pc: int,
+        count: int,
+        limit: int,
+        *,
+        skip: bool,
+    ) -> tuple[int, int]:
+        """`debugger` loop that also journals every instruction, up to the end of the segment at most."""
+        self._prepare(mem, pc, count)
+        limit = min(limit, self.segments[-1].count + self.interval)
+        stage = self.staged.extend
+
+        def record(pc: int, a: int, b: int, c: int, old: int, new: int) -> None:  # noqa: ARG001
+            stage((pc, b, old))
+
+        try:
+            return run_to_breakpoint(mem, out, inp, breakpoints, pc, count, limit, skip=skip, record=record)
+        finally:
+            self._fold()
+
+    def step(self, mem: list[int], out: OutputDevice, inp: InputDevice, pc: int, count: int) -> tuple[int, int]:
+        """Execute and journal one instruction."""
+        self._prepare(mem, pc, count)
+        b = mem[(pc + 1) & WORD_MASK]
+        old = mem[b]
+        nxt, executed = step_wrapped(mem, pc, count, out, inp)
+        if executed > count:
+            self.staged.extend((pc, b, old))
+            self._fold()
+        return nxt, executed
+
+    def travel(self, mem: list[int], out: OutputDevice, inp: InputDevice, pc: int, count: int, to: int) -> tuple[int, int]:
+        """Bring `mem` to its state after instruction `to`; returns the pc and count there.
+
+        Forward travel runs the program (without stopping at breakpoints) and
+        stops early if it halts.
+        """
+        if to < self.first:
+            msg = f"the journal only goes back to instruction {self.first}"
+            raise ValueError(msg)
+        if self._no_stops is None:
+            self._no_stops = Breakpoints()
+        while count < to and pc != HALTED:
+            limit = min(to, count + self.interval)
+            pc, count = self.run(mem, out, inp, self._no_stops, pc, count, limit, skip=False)
+        if to < count:
+            pc = self.rewind(mem, pc, to)
+            count = to
+        return pc, count
+
+    def rewind(self, mem: list[int], pc: int, to: int) -> int:
+        """Undo the instructions after `to` in `mem` and forget them; returns the pc after `to`."""
+        segments = self.segments
+        i = bisect.bisect_right(segments, to, key=lambda s: s.count) - 1
+        segment = segments[i]
+        later = segments[i + 1] if i + 1 < len(segments) else None
+        memory = later.memory.copy() if later is not None else np.array(mem, dtype=np.uint16)
+        entries = segment.entries[to - segment.count : segment.length]
+        if len(entries):
+            # the value before the earliest undone write of each address
+            addrs, first = np.unique(entries[:, 1], return_index=True)
+            memory[addrs] = entries[first, 2]
+            pc = int(entries[0, 0])
+        elif later is not None:
+            pc = later.pc
+        segment.length = to - segment.count
+        del segments[i + 1 :]
+        mem[:] = memory.tolist()
+        if self.input is not None:
+            self.input.rewind(to)
+        return pc
+
+    def previous_stop(self, count: int, breakpoints: Breakpoints) -> int | None:
+        """The latest instruction count before `count` where a breakpoint or watch would have stopped."""
+        addrs = np.array(sorted(breakpoints.addrs), dtype=np.uint16)
+        watched = np.frombuffer(breakpoints.watched, dtype=np.uint8).astype(bool)
+        watched[[const.IO_ADDR, const.INSPECT_ADDR]] = False
+        for segment in reversed(self.segments):
+            entries = segment.entries[: segment.length]
+            # a breakpoint stops before its instruction, a watch after the write
+            before = np.nonzero(np.isin(entries[:, 0], addrs))[0] + segment.count
+            after = np.nonzero(watched[entries[:, 1]])[0] + segment.count + 1
+            stops = np.concatenate([before[before < count], after[after < count]])
+            if len(stops):
+                return int(stops.max())
+        return None
+
+    def _prepare(self, mem: list[int], pc: int, count: int) -> None:
+        """Start a new segment with a snapshot when the last one is full."""
+        segments = self.segments
+        if segments and segments[-1].length < self.interval:
+            return
+        segments.append(
+            Segment(
+                count,
+                pc,
+                np.array(mem, dtype=np.uint16),
+                np.empty((self.interval + _SLACK, 3), dtype=np.uint16),
+            ),
+        )
+        if len(segments) > self.max_segments:
+            del segments[0]
+            if self.input is not None:
+                self.input.forget(segments[0].count)
+
+    def _fold(self) -> None:
+        """Move the staged entries of the last run into the last segment."""
+        staged = np.frombuffer(self.staged, dtype=np.uint16).reshape(-1, 3)
+        segment = self.segments[-1]
+        end = segment.length + len(staged)
+        if end > len(segment.entries):
+            grown = np.empty((max(end, 2 * len(segment.entries)), 3), dtype=np.uint16)
+            grown[: segment.length] = segment.entries[: segment.length]
+            segment.entries = grown
+        segment.entries[segment.length : end] = staged
+        segment.length = end
+        del staged
+        del self.staged[:]
+
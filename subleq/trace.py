@@ -0,0 +1,117 @@
+# noqa: INP001
+"""Structured instruction trace kept in a preallocated ring buffer."""
+
+from collections.abc import Iterator
+
+import numpy as np
+
+from . import const
+
+DEFAULT_DEPTH = 1 << 12
+
+FIELDS = ("count", "pc", "a", "b", "c", "da", "db", "result")
+
+
+def reverse_labels(labels: dict[str, int]) -> dict[int, str]:
+    """Map addresses to the space separated names of their labels."""
+    rlabels = {}
+    for label, addr in labels.items():
+        if addr in rlabels:
+            rlabels[addr] += " " + label
+            continue
+        rlabels[addr] = label
+    return rlabels
+
+
+def code_labels(labels: dict[str, int]) -> tuple[np.ndarray, np.ndarray]:
+    """Labels sorted by address, one per address, without the fixed I/O names."""
+    fixed = const.get_labels()
+    first = {}
+    for name, addr in labels.items():
+        if name not in fixed:
+            first.setdefault(addr, name)
+    addrs = np.array(sorted(first), dtype=np.int64)
+    names = np.array([first[a] for a in addrs.tolist()], dtype=str)
+    return names, addrs
+
+
+class Names:
+    """Addresses as `label+offset`, vectorised over arrays of addresses."""
+
+    def __init__(self, labels: dict[str, int]) -> None:
+        names, self.addrs = code_labels(labels)
+        self.names = names.tolist()
+
+    def __call__(self, addr: int) -> str:
+        i = int(np.searchsorted(self.addrs, addr, side="right")) - 1
+        if i < 0:
+            return str(addr)
+        offset = addr - int(self.addrs[i])
+        return f"{self.names[i]}+{offset}" if offset else self.names[i]
+
+    def owners(self, addrs: np.ndarray) -> np.ndarray:
+        """Index into `names` of the label owning each address, -1 before the first label."""
+        return np.searchsorted(self.addrs, addrs, side="right") - 1
+
+
+def format_instruction(
+    pc: int,
+    a: int,
+    b: int,
+    c: int,
+    da: int,
+    db: int,
+    rlabels: dict[int, str],
+) -> list[str]:
+    """Format one instruction and the values it reads, as `-g` shows it."""
+    result = (db - da) & 0xFFFF
+    signed = result - 0x10000 if result & 0x8000 else result
+    return [
+        f"data[{pc:5d}] = {a:5d} -> data[{a:5d}] = {da:6x} : {rlabels.get(a, ''):15s}",
+        (
+            f"data[{pc + 1:5d}] = {b:5d} -> data[{b:5d}] = {db:6x} : {rlabels.get(b, ''):15s}"
+            f" -> {signed:5d}, {result:6x}, {result:0>16b}"
+        ),
+        f"data[{pc + 2:5d}] = {c:5d}                         : {rlabels.get(c, ''):15s}",
+        "-" * 50,
+    ]
+
+
+class TraceRing:
+    """The last `depth` executed instructions, formatted only when asked for."""
+
+    def __init__(self, depth: int = DEFAULT_DEPTH) -> None:
+        self.events = np.zeros((depth, len(FIELDS)), dtype=np.int64)
+        self.recorded = 0
+
+    def record(self, count: int, pc: int, a: int, b: int, c: int, da: int, db: int) -> None:
+        """Store one executed instruction, overwriting the oldest when full."""
+        self.events[self.recorded % len(self.events)] = (
+            count,
+            pc,
+            a,
+            b,
+            c,
+            da,
+            db,
+            (db - da) & 0xFFFF,
+        )
+        self.recorded += 1
+
+    def __len__(self) -> int:
+        return min(self.recorded, len(self.events))
+
+    def ordered(self) -> np.ndarray:
+        """The retained events, oldest first."""
+        depth = len(self.events)
+        if self.recorded <= depth:
+            return self.events[: self.recorded]
+        return np.roll(self.events, -(self.recorded % depth), axis=0)
+
+    def format(self, rlabels: dict[int, str]) -> Iterator[str]:
+        """Yield the `-g` text for the retained events."""
+        dropped = self.recorded - len(self)
+        if dropped:
+            yield f"... {dropped} earlier instructions not retained"
+        for _, pc, a, b, c, da, db, _ in self.ordered().tolist():
+            yield from format_instruction(pc, a, b, c, da, db, rlabels)
@@ -0,0 +1,280 @@
+# noqa: INP001
+"""Reports on a trace file from `run --trace`: hot loops, branches, writes and hot sequences.
+
+Chunks are read one at a time and folded into fixed-size per-address counters
+(and sparse tallies for loop edges and instruction sequences), so memory use
+does not grow with the length of the trace. Every step is a NumPy operation
+on a whole chunk.
+"""
+
+import argparse
+import json
+from pathlib import Path
+
+import numpy as np
+
+from . import const
+from .fast import WORD_MASK
+from .image import load_image
+from .trace import Names
+from .tracefile import iter_chunks, trace_labels
+
+DEFAULT_TOP = 15
+DEFAULT_SEQUENCE = 4
+MAX_SEQUENCE = 4  # pcs packed 16 bits each into an int64 key
+RATIO_BINS = (0.0, 1e-9, 0.1, 0.5, 0.9, 1 - 1e-9, 1.0)
+RATIO_NAMES = ("never", "< 10%", "10-50%", "50-90%", "> 90%", "always")
+
+
+class Tally:
+    """Counts of int64 keys, merged chunk by chunk."""
+
+    def __init__(self) -> None:
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.counts = np.zeros(0, dtype=np.int64)
+
+    def add(self, keys: np.ndarray) -> None:
+        keys, counts = np.unique(keys, return_counts=True)
+        self.keys, inverse = np.unique(np.concatenate([self.keys, keys]), return_inverse=True)
+        self.counts = np.bincount(inverse, weights=np.concatenate([self.counts, counts])).astype(np.int64)
+
+    def top(self, n: int) -> tuple[np.ndarray, np.ndarray]:
+        """The `n` most frequent keys and their counts."""
+        order = np.argsort(-self.counts, kind="stable")[:n]
+        return self.keys[order], self.counts[order]
+
+
+class TraceStats:
+    """Everything the reports need, accumulated over the chunks of a trace."""
+
+    def __init__(self, sequence: int = DEFAULT_SEQUENCE) -> None:
+        size = WORD_MASK + 1
+        self.sequence = sequence
+        self.instructions = 0
+        self.first = None
+        self.executed = np.zeros(size, dtype=np.int64)  # per pc
+        self.branches = np.zeros(size, dtype=np.int64)  # per pc, conditional branch rows
+        self.taken = np.zeros(size, dtype=np.int64)  # per pc, conditional branches taken
+        self.jumps = 0  # a == b: always taken
+        self.writes = np.zeros(size, dtype=np.int64)  # per cell
+        self.loops = Tally()  # taken backward branches, key pc << 16 | target
+        self.sequences = Tally()  # key: `sequence` consecutive pcs
+        self._tail = np.zeros(0, dtype=np.int64)
+        self._next = None
+
+    def add(self, first: int, columns: dict[str, np.ndarray]) -> None:
+        """Fold one chunk into the counters."""
+        pc = columns["pc"].astype(np.int64)
+        a, b, c = columns["a"], columns["b"], columns["c"]
+        taken = columns["taken"].astype(bool)
+        size = len(self.executed)
+        if self.first is None:
+            self.first = first
+        self.instructions += len(pc)
+
+        self.executed += np.bincount(pc, minlength=size)
+        conditional = (c != (pc + 3) & WORD_MASK) & (a != b)
+        self.branches += np.bincount(pc[conditional], minlength=size)
+        self.taken += np.bincount(pc[conditional & taken], minlength=size)
+        self.jumps += int(np.count_nonzero((a == b) & (c != (pc + 3) & WORD_MASK)))
+
+        stores = (b != const.IO_ADDR) & (b != const.INSPECT_ADDR)
+        self.writes += np.bincount(b[stores], minlength=size)
+
+        backward = taken & (c <= pc) & (c != const.HALT_ADDR)
+        self.loops.add(pc[backward] << 16 | c[backward].astype(np.int64))
+
+        # sequences run across chunk boundaries when the chunks are contiguous
+        pcs = np.concatenate([self._tail, pc]) if first == self._next else pc
+        k = self.sequence
+        if len(pcs) >= k:
+            windows = np.lib.stride_tricks.sliding_window_view(pcs, k)
+            keys = np.zeros(len(windows), dtype=np.int64)
+            for i in range(k):
+                keys = keys << 16 | windows[:, i]
+            self.sequences.add(keys)
+        self._tail = pcs[len(pcs) - (k - 1) :] if k > 1 else pcs[:0]
+        self._next = first + len(pc)
+
+
+def _table(header: tuple[str, ...], rows: list[tuple]) -> list[str]:
+    """Left-align the first column, right-align the rest."""
+    widths = [max(len(str(row[i])) for row in [header, *rows]) for i in range(len(header))]
+    return [
+        "  ".join(f"{cell!s:<{widths[0]}}" if i == 0 else f"{cell!s:>{widths[i]}}" for i, cell in enumerate(row))
+        for row in [header, *rows]
+    ]
+
+
+def _share(n: int, total: int) -> str:
+    return f"{100 * n / (total or 1):6.2f}%"
+
+
+def report_loops(stats: TraceStats, name: Names, top: int) -> list[str]:
+    """Hot loops: taken backward branches, with the instructions executed in their span."""
+    keys, counts = stats.loops.top(top)
+    spans = np.concatenate([[0], np.cumsum(stats.executed)])
+    rows = []
+    for key, n in zip(keys.tolist(), counts.tolist(), strict=True):
+        pc, target = key >> 16, key & WORD_MASK
+        body = int(spans[min(pc + 3, len(spans) - 1)] - spans[target])
+        rows.append(
+            (f"{name(target)} .. {name(pc)}", n, (pc - target) // 3 + 1, body, _share(body, stats.instructions))
+        )
+    header = ("loop (target .. backward branch)", "iterations", "length", "instructions", "share")
+    return ["hot loops", *_table(header, rows)]
+
+
+def report_branches(stats: TraceStats, name: Names, top: int) -> list[str]:
+    """Taken versus fall-through, overall, by per-site taken ratio and per hot site."""
+    branches = int(stats.branches.sum())
+    taken = int(stats.taken.sum())
+    lines = [
+        "branches",
+        (
+            f"conditional: {branches} ({_share(branches, stats.instructions)} of instructions), "
+            f"taken {taken} ({_share(taken, branches)}), fall-through {branches - taken} "
+            f"({_share(branches - taken, branches)}); unconditional jumps: {stats.jumps}"
+        ),
+    ]
+    sites = np.nonzero(stats.branches)[0]
+    ratio = stats.taken[sites] / stats.branches[sites]
+    bucket = np.digitize(ratio, RATIO_BINS[1:-1], right=True)
+    site_counts = np.bincount(bucket, minlength=len(RATIO_NAMES))
+    executions = np.bincount(bucket, weights=stats.branches[sites], minlength=len(RATIO_NAMES)).astype(np.int64)
+    lines += _table(
+        ("taken", "sites", "executions", "share"),
+        [
+            (label, int(s), int(e), _share(int(e), branches))
+            for label, s, e in zip(RATIO_NAMES, site_counts, executions, strict=True)
+        ],
+    )
+    hot = sites[np.argsort(-stats.branches[sites], kind="stable")[:top]]
+    lines += [
+        "",
+        *_table(
+            ("branch site", "executions", "taken"),
+            [
+                (name(pc), int(stats.branches[pc]), _share(int(stats.taken[pc]), int(stats.branches[pc])))
+                for pc in hot.tolist()
+            ],
+        ),
+    ]
+    return lines
+
+
+def report_writes(stats: TraceStats, name: Names, top: int) -> list[str]:
+    """Writes per cell and per label, and how many went into executed code."""
+    writes = stats.writes
+    total = int(writes.sum())
+    code = np.zeros(len(writes), dtype=bool)
+    executed = np.nonzero(stats.executed)[0]
+    for i in range(3):
+        code[(executed + i) & WORD_MASK] = True
+    into_code = int(writes[code].sum())
+    cells = np.nonzero(writes)[0]
+    hot = cells[np.argsort(-writes[cells], kind="stable")[:top]]
+    owners = name.owners(cells)
+    per_label = np.bincount(owners + 1, weights=writes[cells], minlength=len(name.names) + 1).astype(np.int64)
+    labelled = ["<start>", *name.names]
+    order = np.argsort(-per_label, kind="stable")[:top]
+    return [
+        "writes",
+        f"{total} writes to {len(cells)} cells, {into_code} ({_share(into_code, total)}) into executed code",
+        *_table(
+            ("cell", "writes", "share", "code"),
+            [
+                (name(addr), int(writes[addr]), _share(int(writes[addr]), total), "yes" if code[addr] else "")
+                for addr in hot.tolist()
+            ],
+        ),
+        "",
+        *_table(
+            ("label", "writes", "share"),
+            [
+                (labelled[i], int(per_label[i]), _share(int(per_label[i]), total))
+                for i in order.tolist()
+                if per_label[i]
+            ],
+        ),
+    ]
+
+
+def report_sequences(stats: TraceStats, name: Names, top: int) -> list[str]:
+    """The most frequently executed runs of `stats.sequence` consecutive instructions."""
+    keys, counts = stats.sequences.top(top)
+    k = stats.sequence
+    rows = []
+    for key, n in zip(keys.tolist(), counts.tolist(), strict=True):
+        pcs = [(key >> (16 * (k - 1 - i))) & WORD_MASK for i in range(k)]
+        rows.append((" > ".join(name(pc) for pc in pcs), n, _share(n, stats.instructions)))
+    return [f"hot sequences of {k} instructions", *_table(("sequence", "count", "share"), rows)]
+
+
+def analyze(path: Path, sequence: int = DEFAULT_SEQUENCE) -> TraceStats:
+    """Stream every chunk of a trace into a `TraceStats`."""
+    stats = TraceStats(sequence)
+    for first, columns in iter_chunks(path):
+        stats.add(first, columns)
+    return stats
+
+
+def _load_labels(path: Path) -> dict[str, int]:
+    if path.suffix == ".labels":
+        return json.loads(path.read_text())
+    return load_image(path).labels
+
+
+REPORTS = {
+    "loops": report_loops,
+    "branches": report_branches,
+    "writes": report_writes,
+    "sequences": report_sequences,
+}
+
+
+def main() -> None:
+    """Entrypoint."""
+    parser = argparse.ArgumentParser(description="Analyze a trace written by `run --trace`")
+    parser.add_argument("trace", type=Path, help="Trace file (.npz)")
+    parser.add_argument(
+        "-l",
+        "--labels",
+        type=Path,
+        help="Image or .labels file to name addresses with (default: the labels saved in the trace)",
+    )
+    parser.add_argument("-n", "--top", type=int, default=DEFAULT_TOP, help="Rows per table")
+    parser.add_argument(
+        "-k",
+        "--sequence-length",
+        type=int,
+        default=DEFAULT_SEQUENCE,
+        choices=range(1, MAX_SEQUENCE + 1),
+        help="Instructions per hot sequence",
+    )
+    parser.add_argument(
+        "-r",
+        "--report",
+        action="append",
+        choices=REPORTS,
+        help="Reports to show (default: all)",
+    )
+    args = parser.parse_args()
+
+    stats = analyze(args.trace, args.sequence_length)
+    name = Names(_load_labels(args.labels) if args.labels else trace_labels(args.trace))
+    if stats.first is None:
+        print(f"{args.trace}: empty trace")
+        return
+    print(
+        f"{args.trace}: {stats.instructions} instructions "
+        f"({stats.first} to {stats.first + stats.instructions - 1} if contiguous)",
+    )
+    for report in args.report or REPORTS:
+        print()
+        for line in REPORTS[report](stats, name, args.top):
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+# noqa: INP001
+"""Columnar execution trace files written by `run --trace`.
+
+A trace file is a NumPy .npz archive written incrementally: every
+`chunk_size` traced instructions become one zlib (deflate) compressed member
+per column, named `<chunk>/<column>`::
+
+    with np.load("prog.trace.npz") as f:
+        pcs = f["000000/pc"]
+
+Columns are `pc`, `a`, `b`, `c`, `old` and `new` (the value of `data[b]`
+before and after the instruction) as uint16 and `taken` (branch taken) as
+uint8. `chunks` holds the first instruction number and length of every chunk,
+and the image's labels are stored as in a profile. `iter_chunks` streams the
+chunks back one at a time, `read_trace` concatenates them.
+
+Tracing covers a window from `--trace-from` to `--trace-to`, each a label
+(the pc reaching it) or an instruction count. Outside the window the run
+uses the fast loop; count bounds are met exactly by trimming the columns
+instead of testing the count in the loop.
+"""
+
+import zipfile
+from array import array
+from collections.abc import Callable, Iterator
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+from .debugger import Breakpoints, resolve, run_to_breakpoint
+from .devices import InputDevice, OutputDevice, PromptInput
+from .fast import SIGN_BIT, WORD_MASK, run_slice
+from .trace import code_labels
+from .watchdog import Watchdog, run_sliced
+
+DEFAULT_CHUNK = 1 << 16
+COLUMNS = ("pc", "a", "b", "c", "old", "new", "taken")
+
+# the most instructions a run can add past its limit before taking a branch
+_STRAIGHT_LINE = (WORD_MASK + 1) // 3 + 1
+
+
+@dataclass
+class Bound:
+    """One end of the trace window: the pc reaching `addr`, or instruction number `count`."""
+
+    addr: int | None = None
+    count: int | None = None
+
+    @classmethod
+    def parse(cls, spec: str, labels: dict[str, int]) -> "Bound":
+        """A plain number is an instruction count; anything else a label or `label+N`."""
+        if spec.strip().isdigit():
+            return cls(count=int(spec))
+        return cls(addr=resolve(spec, labels))
+
+
+class TraceWriter:
+    """Stages traced instructions in arrays and writes them out in compressed chunks."""
+
+    def __init__(self, path: Path, chunk_size: int = DEFAULT_CHUNK) -> None:
+        self.zip = zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED)
+        self.chunk_size = chunk_size
+        self.columns = {name: array("B" if name == "taken" else "H") for name in COLUMNS}
+        self.first = 0  # instruction number of the first staged row
+        self.chunks: list[tuple[int, int]] = []
+        self.record = self._recorder()
+
+    def __len__(self) -> int:
+        return len(self.columns["pc"])
+
+    def _recorder(self) -> Callable[[int, int, int, int, int, int], None]:
+        """`record`: stages one executed instruction, for `debugger.run_to_breakpoint`."""
+        pcs, a_s, b_s, c_s, olds, news, taken = (self.columns[name].append for name in COLUMNS)
+
+        def record(pc: int, a: int, b: int, c: int, old: int, new: int) -> None:
+            pcs(pc)
+            a_s(a)
+            b_s(b)
+            c_s(c)
+            olds(old)
+            news(new)
+            taken(new == 0 or new >= SIGN_BIT)
+
+        return record
+
+    def start(self, count: int) -> None:
+        """The next staged row is instruction number `count + 1`."""
+        self.flush(final=True)
+        self.first = count + 1
+
+    def trim(self, head: int = 0, tail: int = 0) -> None:
+        """Drop rows staged before the window opened or after it closed."""
+        for column in self.columns.values():
+            if tail:
+                del column[len(column) - tail :]
+            del column[:head]
+        self.first += head
+
+    def flush(self, *, final: bool = False) -> None:
+        """Write every full chunk staged, and with `final` the partial one too."""
+        size = self.chunk_size
+        while len(self) >= size or (final and len(self)):
+            n = min(size, len(self))
+            index = len(self.chunks)
+            for name, column in self.columns.items():
+                with self.zip.open(f"{index:06d}/{name}.npy", "w") as fp:
+                    np.lib.format.write_array(fp, np.frombuffer(column, dtype=column.typecode)[:n].copy())
+                del column[:n]
+            self.chunks.append((self.first, n))
+            self.first += n
+
+    def close(self, labels: dict[str, int]) -> None:
+        """Write the last chunk, the chunk table and the labels."""
+        self.flush(final=True)
+        names, addrs = code_labels(labels)
+        extra = {
+            "chunks": np.array(self.chunks, dtype=np.int64).reshape(-1, 2),
+            "label_names": names,
+            "label_addrs": addrs,
+        }
+        for name, value in extra.items():
+            with self.zip.open(f"{name}.npy", "w") as fp:
+                np.lib.format.write_array(fp, value)
+        self.zip.close()
+
+
+def iter_chunks(path: Path) -> Iterator[tuple[int, dict[str, np.ndarray]]]:
+    """Yield (first instruction number, columns) per chunk, reading one chunk at a time."""
+    with np.load(path) as f:
+        for i, (first, _) in enumerate(f["chunks"].tolist()):
+            yield first, {name: f[f"{i:06d}/{name}"] for name in COLUMNS}
+
+
+def trace_labels(path: Path) -> dict[str, int]:
+    """The labels stored with a trace."""
+    with np.load(path) as f:
+        return dict(zip(f["label_names"].tolist(), f["label_addrs"].tolist(), strict=True))
+
+
+def read_trace(path: Path) -> tuple[dict[str, np.ndarray], dict[str, int]]:
+    """All columns of a trace, plus `count` (the instruction number of each row), and its labels."""
+    parts = {name: [] for name in (*COLUMNS, "count")}
+    for first, columns in iter_chunks(path):
+        for name, column in columns.items():
+            parts[name].append(column)
+        parts["count"].append(np.arange(first, first + len(columns["pc"]), dtype=np.int64))
+    empty = {"taken": np.uint8, "count": np.int64}
+    columns = {
+        name: np.concatenate(chunks) if chunks else np.zeros(0, dtype=empty.get(name, np.uint16))
+        for name, chunks in parts.items()
+    }
+    return columns, trace_labels(path)
+
+
+def subleq_trace_file(
+    data: np.ndarray,
+    labels: dict[str, int],  # noqa: ARG001
+    out: OutputDevice | None = None,
+    inp: InputDevice | None = None,
+    pc: int = 0,
+    count: int = 0,
+    watchdog: Watchdog | None = None,
+    trace: TraceWriter | None = None,
+    start: Bound | None = None,
+    stop: Bound | None = None,
+) -> int:
+    """`fast.subleq_fast` that records every instruction between `start` and `stop` into `trace`.
+
+    Without `start` tracing begins immediately, without `stop` it lasts to the
+    halt. The window opens and closes once.
+    """
+    out = out or OutputDevice()
+    inp = inp or PromptInput(on_block=out.on_input)
+    start = start or Bound(count=count)
+    stop = stop or Bound()
+    mem = data.tolist()
+    phase = "before"
+    start_at = None if start.addr is None else Breakpoints([start.addr])
+    stop_at = Breakpoints([] if stop.addr is None else [stop.addr])
+    opened = False
+
+    def step(pc: int, count: int, limit: int) -> tuple[int, int]:
+        nonlocal phase, opened
+        if phase == "before":
+            if start_at is not None:
+                pc, count = run_to_breakpoint(mem, out, inp, start_at, pc, count, limit, skip=False)
+                if start_at.take() is None:
+                    return pc, count
+            elif count < start.count - _STRAIGHT_LINE:
+                # stop early enough that the run cannot overshoot the window
+                return run_slice(mem, out, inp, pc, count, min(limit, start.count - _STRAIGHT_LINE))
+            trace.start(count)  # rows up to start.count are trimmed below
+            phase = "tracing"
+            opened = True
+        if phase == "tracing":
+            first = count
+            if stop.count is not None:
+                limit = min(limit, stop.count)
+            pc, count = run_to_breakpoint(mem, out, inp, stop_at, pc, count, limit, skip=opened, record=trace.record)
+            opened = False
+            if start.count is not None and trace.first <= start.count:
+                trace.trim(head=min(start.count - trace.first + 1, len(trace)))
+            if stop_at.take() is not None:
+                if start.count is None or count >= start.count:
+                    phase = "after"
+                else:
+                    opened = True  # reached before the window opened: go on past it
+            elif stop.count is not None and count >= stop.count:
+                trace.trim(tail=count - max(stop.count, first))
+                phase = "after"
+            trace.flush()
+            return pc, count
+        return run_slice(mem, out, inp, pc, count, limit)
+
+    try:
+        return run_sliced(step, pc, count, watchdog)
+    finally:
+        data[:] = mem
+        out.flush()
+
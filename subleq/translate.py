@@ -0,0 +1,364 @@
+# noqa: INP001
+"""Ahead-of-time translation of an image into a Python module.
+
+`analysis.analyze` works out which words the image can write. Every
+instruction it reaches whose own three words are never written becomes
+straight-line Python in a block function: its operands are literals, and an
+`a` operand that is never written is read at translation time instead of from
+memory. Blocks run until a taken conditional branch, follow unconditional jumps
+and are dispatched by entry pc.
+
+Devices are known when the image is translated (a `bus.Bus` layout): only
+instructions naming a device word get a call to its `load` or `store`, every
+other one runs with no device checks at all. Everything else (self-modified
+instructions, code the pass did not reach) runs in an interpreter embedded in
+the module, which looks every operand up on the bus. Only that interpreter can write
+through a self-modified operand, so only its writes are checked against the
+words baked into blocks; such a write drops the blocks using the word, and the
+module carries on interpreting them. The module is plain Python, imported (and
+byte-compiled by Python's own cache) like any other::
+
+    translate prog.sqi              # writes prog.translated.py
+    run prog.sqi -e translated      # uses it, translating again if stale
+    run prog.sqi -e translated --device timer@TIMER
+"""
+
+import argparse
+import hashlib
+import importlib.util
+import sys
+from pathlib import Path
+from types import ModuleType
+
+import numpy as np
+
+from . import const
+from .analysis import analyze
+from .bus import Bus, build_bus, default_bus
+from .devices import InputDevice, OutputDevice, PromptInput
+from .fast import SIGN_BIT, WORD_MASK
+from .image import load_image
+from .memory import allocate
+from .watchdog import HALTED, Watchdog, run_sliced
+
+SUFFIX = ".translated.py"
+MAX_BLOCK_LEN = 64
+
+
+def translate(
+    words: np.ndarray,
+    entry: int = 0,
+    labels: dict[str, int] | None = None,
+    name: str = "",
+    bus: Bus | None = None,
+) -> str:
+    """Source of the module translating `words` for the devices of `bus` (default: `default_bus`).
+
+    Blocks start at the entry, at branch targets and after self-modified
+    instructions; labels in reached code are used as extra entries (for code
+    only reached through computed jumps, such as subroutine returns).
+    """
+    mem = allocate(np.asarray(words)).tolist()
+    layout = (bus or default_bus()).layout
+    loads, stores = layout
+    analysis = analyze(words, entry, frozenset(stores))
+    written = set(np.nonzero(analysis.written)[0].tolist())
+    reached = set(np.nonzero(analysis.reached)[0].tolist())
+    fixed = set(np.nonzero(analysis.fixed)[0].tolist())
+
+    leaders = {entry, *(addr for addr in (labels or {}).values() if addr in fixed)}
+    for pc in reached - fixed:
+        leaders.update((pc + 3, mem[pc + 2]))
+    leaders &= fixed
+    blocks = {}
+    constants = {}
+    cover: dict[int, list[int]] = {}
+    work = sorted(leaders)
+    while work:
+        pc = work.pop()
+        if pc in blocks:
+            continue
+        source, exits, baked = _gen_block(pc, mem, fixed, written, layout)
+        blocks[pc] = source
+        for addr in baked:
+            constants[addr] = mem[addr]
+            cover.setdefault(addr, []).append(pc)
+        work.extend(target for target in exits if target in fixed and target not in blocks)
+
+    digest = image_digest(words, entry, layout)
+    lines = [
+        f'"""Subleq image {name} translated by `translate`; regenerate rather than edit."""',
+        "",
+        f"DIGEST = {digest!r}",
+        f"ENTRY = {entry}",
+        f"LOADS = {loads!r}",
+        f"STORES = {stores!r}",
+        (
+            f"STATS = {{'reached': {len(reached)}, 'translated': {len(fixed)}, 'written': {len(written)}, "
+            f"'blocks': {len(blocks)}}}"
+        ),
+        f"CONSTANTS = {constants!r}",
+        f"COVER = {{{', '.join(f'{addr}: {tuple(entries)!r}' for addr, entries in sorted(cover.items()))}}}",
+        "",
+        "",
+        "def bind(m, bus):",
+        '    """`step(pc, count, limit) -> (pc, count)` over memory `m` (a list of ints) with the devices of `bus`."""',
+        "    loads = bus.loads",
+        "    stores = bus.stores",
+        *(f"    load_{addr} = loads[{addr}]" for addr in loads),
+        *(f"    store_{addr} = stores[{addr}]" for addr in stores),
+    ]
+    for pc in sorted(blocks):
+        lines += ["", *blocks[pc]]
+    lines += [
+        "",
+        f"    blocks = {{{', '.join(f'{pc}: b{pc}' for pc in sorted(blocks))}}}",
+        _RUNTIME,
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def _gen_block(
+    entry: int,
+    mem: list[int],
+    fixed: set[int],
+    written: set[int],
+    layout: tuple[tuple[int, ...], tuple[int, ...]],
+) -> tuple[list[str], set[int], set[int]]:
+    """One block function: its source lines, the pcs it can exit to and the words baked into it."""
+    loads, stores = layout
+    ind = " " * 8
+    lines = [f"    def b{entry}(count):"]
+    exits = set()
+    baked = set()
+    done = set()
+    pc = entry
+    n = 0
+    while True:
+        if pc not in fixed or pc in done or n == MAX_BLOCK_LEN:
+            lines.append(f"{ind}return {pc}, count + {n}")
+            exits.add(pc)
+            break
+        done.add(pc)
+        n += 1
+        a, b, c = mem[pc], mem[pc + 1], mem[pc + 2]
+        baked.update((pc, pc + 1, pc + 2))
+        lines.append(f"{ind}# {pc}: {a} {b} {c}")
+        if a in loads:
+            lines += [
+                f"{ind}try:",
+                f"{ind}    r = load_{a}(count + {n})",
+                f"{ind}except EOFError:",
+                f"{ind}    return {HALTED}, count + {n - 1}  # out of input: halt before the read",
+            ]
+            da = "r"
+        elif a in written:
+            da = f"m[{a}]"
+        else:
+            baked.add(a)
+            da = str(mem[a])
+
+        db = None  # the stored value when it is known now
+        if b in stores:
+            lines.append(f"{ind}store_{b}({da}, count + {n})")
+            baked.add(b)
+            db = mem[b]
+        elif a == b:
+            lines.append(f"{ind}m[{b}] = 0")
+            db = 0
+        elif da != "0":
+            lines += [f"{ind}v = (m[{b}] - {da}) & {WORD_MASK}", f"{ind}m[{b}] = v"]
+        else:
+            lines.append(f"{ind}v = m[{b}]")
+
+        target = HALTED if c == const.HALT_ADDR else c
+        nxt = (pc + 3) & WORD_MASK
+        if db is None:
+            if c != nxt:
+                lines += [f"{ind}if v == 0 or v & {SIGN_BIT}:", f"{ind}    return {target}, count + {n}"]
+                if target != HALTED:
+                    exits.add(c)
+            pc = nxt
+        elif db == 0 or db & SIGN_BIT:
+            if target == HALTED:
+                lines.append(f"{ind}return {HALTED}, count + {n}")
+                break
+            pc = c
+        else:
+            pc = nxt
+    return lines, exits, baked
+
+
+# the dispatch loop and the embedded interpreter, inside `bind` of every module
+_RUNTIME = f"""
+    frozen = bytearray(len(m))
+    entries = bytearray(len(m))
+    for addr in CONSTANTS:
+        frozen[addr] = 1
+    for pc in blocks:
+        entries[pc] = 1
+
+    def invalidate(addr):
+        frozen[addr] = 0
+        for pc in COVER[addr]:
+            if blocks.pop(pc, None) is not None:
+                entries[pc] = 0
+
+    # memory that is not the image (a resumed state) may have changed baked words
+    for addr, value in CONSTANTS.items():
+        if m[addr] != value:
+            invalidate(addr)
+
+    def interpret(pc, count, limit):
+        while True:
+            count += 1
+            a = m[pc]
+            b = m[(pc + 1) & {WORD_MASK}]
+            c = m[(pc + 2) & {WORD_MASK}]
+            load = loads.get(a)
+            if load is None:
+                da = m[a]
+            else:
+                try:
+                    da = load(count)
+                except EOFError:
+                    return {HALTED}, count - 1  # out of input: halt before the read
+            store = stores.get(b)
+            if store is not None:
+                store(da, count)
+                db = m[b]
+            else:
+                db = (m[b] - da) & {WORD_MASK}
+                m[b] = db
+                if frozen[b]:
+                    invalidate(b)
+            if db == 0 or db & {SIGN_BIT}:
+                if c == {const.HALT_ADDR}:
+                    return {HALTED}, count
+                pc = c
+                if count >= limit:
+                    return pc, count
+            else:
+                pc = (pc + 3) & {WORD_MASK}
+            if entries[pc]:
+                return pc, count
+
+    def step(pc, count, limit):
+        get = blocks.get
+        while pc != {HALTED} and count < limit:
+            block = get(pc)
+            if block is None:
+                pc, count = interpret(pc, count, limit)
+            else:
+                pc, count = block(count)
+        return pc, count
+
+    return step"""
+
+
+def image_digest(
+    words: np.ndarray,
+    entry: int = 0,
+    layout: tuple[tuple[int, ...], tuple[int, ...]] | None = None,
+) -> str:
+    """Identifies the image a module was translated from, and the device layout it was translated for."""
+    h = hashlib.sha256(np.ascontiguousarray(words, dtype="<u2").tobytes())
+    h.update(entry.to_bytes(2, "little"))
+    h.update(repr(layout or default_bus().layout).encode())
+    return h.hexdigest()
+
+
+def load_module(source: str | Path, name: str = "subleq_translated") -> ModuleType:
+    """Import a translated module from a file, or exec it from source."""
+    if isinstance(source, Path):
+        spec = importlib.util.spec_from_file_location(name, source)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    module = ModuleType(name)
+    exec(compile(source, f"<{name}>", "exec"), module.__dict__)  # noqa: S102
+    return module
+
+
+def translated_path(image: Path) -> Path:
+    return image.with_suffix(SUFFIX)
+
+
+def load_translation(image: Path, path: Path | None = None, bus: Bus | None = None) -> ModuleType:
+    """The translated module of an image file for `bus`, translating it first if missing or stale."""
+    loaded = load_image(image)
+    path = path or translated_path(image)
+    digest = image_digest(loaded.words, loaded.entry, (bus or default_bus()).layout)
+    if path.exists():
+        module = load_module(path)
+        if getattr(module, "DIGEST", None) == digest:
+            return module
+    path.write_text(translate(loaded.words, loaded.entry, loaded.labels, image.name, bus))
+    return load_module(path)
+
+
+def subleq_translated(
+    data: np.ndarray,
+    labels: dict[str, int],
+    out: OutputDevice | None = None,
+    inp: InputDevice | None = None,
+    pc: int = 0,
+    count: int = 0,
+    watchdog: Watchdog | None = None,
+    module: ModuleType | None = None,
+    bus: Bus | None = None,
+) -> int:
+    """Emulate a subleq computer with a translated module (translating `data` itself when not given one).
+
+    `bus` holds the devices (default: `default_bus`); a given `module` must have
+    been translated for the same layout.
+    """
+    out = out or OutputDevice()
+    inp = inp or PromptInput(on_block=out.on_input)
+    bus = bus or default_bus()
+    if module is None:
+        module = load_module(translate(data, pc, labels, bus=bus))
+    elif (module.LOADS, module.STORES) != bus.layout:
+        msg = "the module was translated for other devices"
+        raise ValueError(msg)
+    mem = data.tolist()
+    bus.attach(mem, out, inp)
+    try:
+        return run_sliced(module.bind(mem, bus), pc, count, watchdog)
+    finally:
+        data[:] = mem
+        bus.flush()
+        out.flush()
+
+
+def main() -> None:
+    """Entrypoint."""
+    parser = argparse.ArgumentParser(description="Translate a subleq image into a Python module")
+    parser.add_argument("input", type=Path, help="Input image file (.sqi or .npy)")
+    parser.add_argument("-o", "--output", type=Path, help=f"Module to write (default: the image with {SUFFIX})")
+    parser.add_argument(
+        "--device",
+        action="append",
+        default=[],
+        metavar="KIND@ADDR[=ARG]",
+        help="Translate for a device mapped at ADDR too, as `run --device` does",
+    )
+    args = parser.parse_args()
+
+    image = load_image(args.input)
+    try:
+        bus = build_bus(args.device, image.labels)
+    except ValueError as e:
+        parser.error(str(e))
+    output = args.output or translated_path(args.input)
+    output.write_text(translate(image.words, image.entry, image.labels, args.input.name, bus))
+    stats = load_module(output).STATS
+    print(
+        f"{output}: {stats['translated']} of {stats['reached']} reached instructions translated "
+        f"in {stats['blocks']} blocks, {stats['written']} words written",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
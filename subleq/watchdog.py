@@ -0,0 +1,79 @@
+# noqa: INP001
+"""Instruction budget and wall-clock limit for the engines.
+
+The engines never look at the watchdog per instruction. They run until their
+instruction count reaches `Watchdog.limit` (tested on taken branches or block
+exits only) and then call `Watchdog.check`, which raises `Stopped` once a limit
+is hit, so a run stops at a block boundary at or just after its budget.
+"""
+
+import time
+from collections.abc import Callable
+
+DEFAULT_SLICE = 1 << 16
+
+HALTED = -1
+
+
+class Stopped(Exception):  # noqa: N818
+    """The run hit a limit at `pc` after `count` instructions; it can be resumed."""
+
+    def __init__(self, pc: int, count: int, reason: str) -> None:
+        super().__init__(f"stopped at pc {pc} after {count} instructions: {reason}")
+        self.pc = pc
+        self.count = count
+        self.reason = reason
+
+
+class Watchdog:
+    """Instruction budget, deadline and stop requests, checked every `slice_size` instructions."""
+
+    def __init__(
+        self,
+        max_instructions: int | None = None,
+        timeout: float | None = None,
+        slice_size: int = DEFAULT_SLICE,
+    ) -> None:
+        self.max_instructions = max_instructions
+        self.deadline = None if timeout is None else time.monotonic() + timeout
+        self.slice_size = slice_size
+        self.stop_requested = False
+
+    def limit(self, count: int) -> int:
+        """The instruction count at which the engine should call `check` next."""
+        limit = count + self.slice_size
+        if self.max_instructions is not None:
+            limit = min(limit, self.max_instructions)
+        return limit
+
+    def check(self, pc: int, count: int) -> None:
+        """Raise `Stopped` if a limit has been reached."""
+        if self.stop_requested:
+            raise Stopped(pc, count, "interrupted")
+        if self.max_instructions is not None and count >= self.max_instructions:
+            raise Stopped(pc, count, "instruction budget used")
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            raise Stopped(pc, count, "timeout")
+
+    def request_stop(self) -> None:
+        """Stop at the next check, e.g. from a signal handler."""
+        self.stop_requested = True
+
+
+def run_sliced(
+    step: Callable[[int, int, int], tuple[int, int]],
+    pc: int,
+    count: int,
+    watchdog: Watchdog | None,
+) -> int:
+    """Call `step(pc, count, limit) -> (pc, count)` until it returns `HALTED`.
+
+    Without a watchdog the slices just run back to back.
+    """
+    while True:
+        limit = count + DEFAULT_SLICE if watchdog is None else watchdog.limit(count)
+        pc, count = step(pc, count, limit)
+        if pc == HALTED:
+            return count
+        if watchdog is not None:
+            watchdog.check(pc, count)
@@ -0,0 +1,44 @@
+# noqa: INP001
+"""Parsing of input integers by `devices.IntsInput` and `devices.parse_int`."""
+
+import io
+
+import pytest
+
+from subleq.devices import BadInput, IntsInput, parse_int
+
+
+def _words(data: bytes, chunk_size: int = 4) -> list[int]:
+    inp = IntsInput(io.BytesIO(data), chunk_size)
+    words = []
+    while True:
+        try:
+            words.append(inp.read())
+        except EOFError:
+            return words
+
+
+@pytest.mark.parametrize(
+    ("token", "value"),
+    [("08", 8), ("0009", 9), ("-07", -7), ("0x10", 16), ("0X1f", 31), ("0o17", 15), ("0b101", 5), ("-0x10", -16)],
+)
+def test_parse_int(token: str, value: int) -> None:
+    assert parse_int(token) == value
+    assert parse_int(token.encode()) == value
+
+
+def test_zero_padded_decimals() -> None:
+    assert _words(b"08 09\n010 0x10\n") == [8, 9, 10, 16]
+
+
+@pytest.mark.parametrize("token", [b"abc", b"1.5", b"0x", b"08z"])
+def test_bad_token(token: bytes) -> None:
+    with pytest.raises(BadInput, match="not an integer"):
+        parse_int(token)
+
+
+def test_bad_token_after_good_ones() -> None:
+    inp = IntsInput(io.BytesIO(b"1 2 abc 3\n"))
+    assert [inp.read(), inp.read()] == [1, 2]
+    with pytest.raises(BadInput, match="'abc'"):
+        inp.read()